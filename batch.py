@@ -0,0 +1,366 @@
+"""
+Batch processing of borrow and return records without prompts.
+
+Operations file format (CSV with a header, or JSON Lines with the same keys):
+-----------------------------------------------------------------------------
+action -> borrow or return
+borrower -> name of the borrower
+books -> names or IDs of the books to borrow, separated by ";" (a list in JSON Lines)
+noteid -> note ID to return, optional if the borrower has only one open note
+date -> ISO date of the operation, optional (now by default)
+
+Usage: python batch.py operations.csv [--report report.csv] [--user admin]
+"""
+import csv
+import sys
+import json
+import argparse
+import traceback
+from itertools import islice
+from datetime import datetime, timedelta
+from library import Library
+from storage import savebatch, searchnotes, lockedstocks
+from errors import BookError, NoteNotFound
+from instrumentation import enable_from_environment
+
+# Operations saved together with one savebatch call.
+CHUNK_SIZE = 10000
+# Columns of the report.
+REPORT_FIELDS = ["row", "action", "status", "noteid", "message"]
+
+
+def read_operations(path: str):
+    """
+    Yields the operations from a CSV or JSON Lines file as dictionaries.
+
+    Parameters:
+    -----------
+    path : str
+        path of the operations file, read as JSON Lines if it ends with .jsonl or .json.
+    """
+    with open(path, "r", newline="") as operations_file:
+        if path.endswith((".jsonl", ".json")):
+            for line in operations_file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(operations_file)
+
+
+def process_batch(library: Library, operations, chunk_size: int = CHUNK_SIZE) -> list[dict]:
+    """
+    Returns the report of processing the borrow and return operations against the library.
+
+    The records of every chunk of operations are saved with one savebatch call.
+    The stocks lock is held for each chunk, after syncing the stock changes
+    of the other processes, so that the terminals can work in between.
+
+    Parameters:
+    -----------
+    library : Library
+        Library to process the operations against.
+    operations : iterable of dict
+        operations with action, borrower, books, noteid and date keys.
+    chunk_size : int, optional
+        number of operations saved together.
+
+    Returns:
+    --------
+    report : list[dict]
+        row, action, status (ok or error), noteid and message of every operation.
+    """
+    report = []
+    batch = Batch(library)
+    operations = iter(operations)
+    while True:
+        chunk = list(islice(operations, chunk_size))
+        if not chunk:
+            break
+        with lockedstocks():
+            library.sync_stocks()
+            for operation in chunk:
+                row = len(report) + 1
+                action = str(operation.get("action") or "").strip().lower()
+                checkpoint = batch.checkpoint()
+                try:
+                    if action == "borrow":
+                        noteid = batch.borrow(operation)
+                    elif action == "return":
+                        noteid = batch.return_(operation)
+                    else:
+                        raise ValueError(action, "Invalid action.")
+                    report.append({"row": row, "action": action, "status": "ok",
+                                   "noteid": noteid, "message": ""})
+                except (BookError, NoteNotFound, ValueError) as e:
+                    batch.rollback(checkpoint)
+                    report.append({"row": row, "action": action, "status": "error",
+                                   "noteid": "", "message": str(e.args[-1])})
+                except Exception:
+                    # Only this row is dropped, with its stock changes put back, and the error is logged.
+                    print(f"ERROR! Row {row} failed: {operation!r}", file=sys.stderr)
+                    traceback.print_exc()
+                    batch.rollback(checkpoint)
+                    report.append({"row": row, "action": action, "status": "error",
+                                   "noteid": "", "message": "Unexpected Error."})
+            if not batch.save():
+                # None of the chunk was saved.
+                for result in report[len(report) - len(chunk):]:
+                    if result["status"] == "ok":
+                        result.update(status="error", noteid="", message="Not Saved.")
+    return report
+
+
+class Batch:
+    """
+    A class to represent the records of a batch waiting to be saved.
+
+    Attributes:
+    -----------
+    library : Library
+        Library the operations are processed against.
+    borrows : list[tuple[str, str]]
+        note ID and notes lines of each borrow.
+    returns : list[tuple[str, str]]
+        note ID and notes lines of each return.
+    changes : list[tuple[str, str]]
+        stock changes of the batch.
+    open_notes : dict[str, Note]
+        Note objects borrowed in the batch, keyed by note ID.
+    borrowers : dict[str, list[str]]
+        note IDs borrowed in the batch, keyed by borrower slug.
+    returned : dict[str, Note]
+        Note objects returned in the batch, keyed by note ID.
+
+    Methods:
+    --------
+    borrow(operation):
+        Adds a borrow record and returns its note ID.
+    return_(operation):
+        Adds a return record and returns its note ID.
+    clear():
+        Forgets the records of the batch after saving.
+    save():
+        Saves the records of the batch, putting back their stock changes if they couldn't be saved.
+    checkpoint():
+        Returns the position of the records, for rolling back the records added after it.
+    rollback(checkpoint=(0, 0, 0)):
+        Forgets the records added after the checkpoint and puts back their stock changes in memory.
+    """
+
+    def __init__(self, library: Library):
+        """
+        Constructor for the Batch object.
+
+        Parameters:
+        -----------
+        library : Library
+            Library the operations are processed against.
+        """
+        self.library = library
+        self.clear()
+
+    def clear(self):
+        """
+        Forgets the records of the batch after saving.
+        """
+        self.borrows = []
+        self.returns = []
+        self.changes = []
+        self.open_notes = {}
+        self.borrowers = {}
+        self.returned = {}
+
+    def borrow(self, operation: dict) -> str:
+        """
+        Adds a borrow record and returns its note ID.
+
+        Parameters:
+        -----------
+        operation : dict
+            operation with borrower, books and date keys.
+
+        Returns:
+        --------
+        noteid : str
+            note ID of the borrow record.
+        """
+        name = operation.get("borrower") or ""
+        if not isinstance(name, str):
+            raise ValueError(name, "Invalid Borrower.")
+        name = name.strip()
+        if not name:
+            raise ValueError(name, "Borrower Missing.")
+        # The notes lines are comma separated.
+        if "," in name or "\n" in name or "\r" in name:
+            raise ValueError(name, "Commas and line breaks aren't allowed in the borrower.")
+        books = operation.get("books") or []
+        if isinstance(books, str):
+            books = [book.strip() for book in books.split(";") if book.strip()]
+        if not isinstance(books, list) or not all([isinstance(book, str) for book in books]):
+            raise ValueError(books, "Invalid Books, use names or IDs.")
+        if not books:
+            raise ValueError(books, "Books Missing.")
+        borroweddate = parse_date(operation.get("date"))
+        # Moving the date by a second until the note ID is unused, as note IDs use the timestamp.
+        slug = name.lower().replace(" ", "-")
+        used = set(searchnotes(slug, False) + self.borrowers.get(slug, []))
+        while f"{slug}-{int(borroweddate.timestamp())}" in used:
+            borroweddate += timedelta(seconds=1)
+        noteid, notes = self.library.borrow_books(
+            name, books, borroweddate, save=False)
+        self.borrows.append((noteid, notes.get_borrow_notes()))
+        self.changes.extend([("BORROW", book.lib_id) for book in notes.books])
+        self.open_notes[noteid] = notes
+        self.borrowers.setdefault(slug, []).append(noteid)
+        return noteid
+
+    def return_(self, operation: dict) -> str:
+        """
+        Adds a return record and returns its note ID.
+
+        Parameters:
+        -----------
+        operation : dict
+            operation with noteid or borrower, and date keys.
+
+        Returns:
+        --------
+        noteid : str
+            note ID of the return record.
+        """
+        noteid = operation.get("noteid") or ""
+        borrower = operation.get("borrower") or ""
+        if not isinstance(noteid, str) or not isinstance(borrower, str):
+            raise ValueError(noteid, "Invalid Note ID or Borrower.")
+        noteid = noteid.strip()
+        if not noteid:
+            # Finding the only open note of the borrower.
+            slug = borrower.strip().lower().replace(" ", "-")
+            open_noteids = [
+                noteid for noteid in searchnotes(slug, True) if noteid not in self.returned]
+            open_noteids += [noteid for noteid in self.borrowers.get(slug, [])
+                             if noteid not in self.returned]
+            if len(open_noteids) != 1:
+                raise NoteNotFound(
+                    slug, f"{len(open_noteids)} open notes found, please use the noteid.")
+            noteid = open_noteids[0]
+        if noteid in self.returned:
+            raise NoteNotFound(noteid, "Note Already Returned.")
+        notes, returned_books = self.library.return_books(
+            noteid, self.open_notes.get(noteid), parse_date(operation.get("date")), save=False)
+        self.returns.append((noteid, notes.get_return_notes()))
+        self.changes.extend([("RETURN", book.lib_id) for book in returned_books])
+        self.returned[noteid] = notes
+        return noteid
+
+    def save(self) -> bool:
+        """
+        Saves the records of the batch, putting back their stock changes if they couldn't be saved.
+
+        Returns:
+        --------
+        True/False : bool
+            Boolean Value depending on the success or failure.
+        """
+        saved = True
+        if self.borrows or self.returns:
+            saved = savebatch(self.borrows, self.returns, self.changes)
+        if not saved:
+            self.rollback()
+        self.clear()
+        return saved
+
+    def checkpoint(self) -> tuple:
+        """
+        Returns the position of the records, for rolling back the records added after it.
+        """
+        return len(self.borrows), len(self.returns), len(self.changes)
+
+    def rollback(self, checkpoint: tuple = (0, 0, 0)):
+        """
+        Forgets the records added after the checkpoint and puts back their stock changes in memory.
+
+        Parameters:
+        -----------
+        checkpoint : tuple, optional
+            position returned by checkpoint, all the records by default.
+        """
+        borrows, returns, changes = checkpoint
+        for action, bookid in self.changes[changes:]:
+            book = self.library.find_book_by_id(bookid)
+            if book is not None:
+                book.add_stock(1 if action == "BORROW" else -1)
+        for noteid, _ in self.borrows[borrows:]:
+            self.open_notes.pop(noteid, None)
+            self.borrowers.get(noteid.rsplit("-", 1)[0], []).remove(noteid)
+        for noteid, _ in self.returns[returns:]:
+            self.returned.pop(noteid, None)
+            # The returned note was changed in place.
+            self.library.notes_cache.pop(noteid)
+        del self.borrows[borrows:]
+        del self.returns[returns:]
+        del self.changes[changes:]
+
+
+def parse_date(date: str) -> datetime:
+    """
+    Returns the datetime of an ISO date, or now if it is empty.
+
+    Parameters:
+    -----------
+    date : str
+        ISO date or None.
+
+    Returns:
+    --------
+    date : datetime
+        parsed date.
+    """
+    if not date:
+        return datetime.now()
+    try:
+        parsed = datetime.fromisoformat(date)
+    except (TypeError, ValueError):
+        raise ValueError(date, "Invalid Date.")
+    # The notes use local dates without a timezone.
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    if parsed > datetime.now():
+        raise ValueError(date, "Future Date.")
+    return parsed
+
+
+def write_report(report: list[dict], report_file):
+    """
+    Writes the report as CSV.
+
+    Parameters:
+    -----------
+    report : list[dict]
+        report returned by process_batch.
+    report_file : file
+        file to write the report to.
+    """
+    writer = csv.DictWriter(report_file, REPORT_FIELDS)
+    writer.writeheader()
+    writer.writerows(report)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Process borrow and return records from a CSV or JSON Lines file.")
+    parser.add_argument("operations", help="CSV or JSON Lines file of operations")
+    parser.add_argument("--report", help="CSV file for the report (stdout by default)")
+    parser.add_argument("--user", default="admin", help="user recorded as the sender")
+    args = parser.parse_args()
+    # Recording the timings when LMS_METRICS is set.
+    enable_from_environment()
+    library = Library("Islington Library", args.user)
+    report = process_batch(library, read_operations(args.operations))
+    if args.report:
+        with open(args.report, "w", newline="") as report_file:
+            write_report(report, report_file)
+    else:
+        write_report(report, sys.stdout)
+    errors = sum([1 for result in report if result["status"] == "error"])
+    print(f"Processed {len(report)} operations with {errors} errors.", file=sys.stderr)
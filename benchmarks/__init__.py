@@ -0,0 +1,5 @@
+"""
+Benchmarks for the Library with synthetic book stocks and notes.
+
+Usage: python -m benchmarks.run --books 10000 --notes 1000 --output results.json
+"""
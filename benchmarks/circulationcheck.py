@@ -0,0 +1,157 @@
+"""
+Check of the circulation report of every storage backend against a serial pass over the notes.
+
+Notes are saved through the Library, some of them are moved to the flat
+layout and a few get damaged lines, then the notes are migrated to the
+loan log and the SQLite database. The report of each backend, counted in
+small chunks, has to match the counts of Note.from_lines over every note.
+Exits with status 1 if a backend differs.
+
+Usage: python benchmarks/circulationcheck.py [--books 200] [--notes 1500] [--workers 2] [--seed 0]
+"""
+import os
+import sys
+import random
+import argparse
+from datetime import datetime, timedelta
+
+# The benchmarks package lives in the repository root.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import notesmanager
+import loanlog
+import sqlitestore
+import circulation
+from note import Note
+from library import Library
+from errors import NoMoreStocks
+from circulation import Circulation, circulation_report, FINE_PER_DAY
+from benchmarks.generate import data_directory, BORROWERS
+
+# Line added to some notes, which the migrations copy and every report has to skip.
+DAMAGED_LINE = "RETURN:Damaged Line,2020-01-01T00:00:00,unknown,0.0"
+# Counts compared between the reports.
+COUNTS = ("titles", "borrower_loans", "borrower_books", "loans", "books", "fees", "fines")
+
+
+def save_notes(library: Library, notes: int, seed: int) -> int:
+    """
+    Saves random borrows through the Library, returning about half of them, and returns the damaged lines added.
+
+    Parameters:
+    -----------
+    library : Library
+        Library to borrow from.
+    notes : int
+        number of borrows.
+    seed : int
+        seed for the random generator.
+    """
+    generator = random.Random(seed)
+    start = datetime(2020, 1, 1)
+    damaged = 0
+    for index in range(notes):
+        # A few months of borrows, so that the months and fines are spread out.
+        borroweddate = start + timedelta(hours=index * 7)
+        books = generator.sample(library.bookdb, generator.randint(1, 3))
+        try:
+            noteid, _ = library.borrow_books(generator.choice(BORROWERS), [book.lib_id for book in books],
+                                             borroweddate)
+        except NoMoreStocks:
+            continue
+        if generator.random() < 0.5:
+            library.return_books(noteid, returneddate=borroweddate + timedelta(days=generator.randint(1, 20)))
+        path = notesmanager.notepath(noteid, "data")
+        if generator.random() < 0.05:
+            with open(path, "a") as note:
+                note.write(f"\n{DAMAGED_LINE}")
+            damaged += 1
+        # Leaving a third of the notes in the flat layout.
+        if generator.random() < 0.3:
+            os.rename(path, notesmanager.notepath(noteid, "data", False))
+    return damaged
+
+
+def serial_counts(library: Library, damaged: int) -> Circulation:
+    """
+    Returns the counts of every note parsed with Note.from_lines, one note after another.
+
+    Parameters:
+    -----------
+    library : Library
+        Library with the borrowed books.
+    damaged : int
+        damaged lines added to the notes.
+    """
+    counts = Circulation()
+    for noteid, path in notesmanager.iternotes():
+        with open(path) as note_file:
+            lines = [line for line in note_file.read().splitlines() if line != DAMAGED_LINE]
+        note = Note.from_lines(lines, library.find_book)
+        month = note.borroweddate.isoformat()[:7]
+        borrower = note.name.strip().title()
+        counts.borrower_loans[borrower] += 1
+        counts.loans[month] += 1
+        for book in note.books:
+            counts.titles[book.name] += 1
+            counts.borrower_books[borrower] += 1
+            counts.books[month] += 1
+            counts.fees[month] += book.price
+        if note.returned:
+            counts.fines[note.returneddate.isoformat()[:7]] += max(note.late_days, 0) * FINE_PER_DAY
+    counts.skipped = damaged
+    return counts
+
+
+def compare_counts(storage: str, found: Circulation, expected: Circulation) -> list[str]:
+    """
+    Returns the differences between the counts of a backend and the expected ones.
+
+    Parameters:
+    -----------
+    storage : str
+        text, sqlite or log.
+    found : Circulation
+        counts of the backend.
+    expected : Circulation
+        counts of the serial pass.
+    """
+    failures = []
+    for name in COUNTS:
+        # Rounding the sums of prices, which are added in a different order.
+        found_counts = {key: round(value, 2) for key, value in getattr(found, name).items() if value}
+        expected_counts = {key: round(value, 2) for key, value in getattr(expected, name).items() if value}
+        if found_counts != expected_counts:
+            keys = sorted([key for key in found_counts.keys() | expected_counts.keys()
+                           if found_counts.get(key) != expected_counts.get(key)])
+            failures.append(f"{storage} {name}: {len(keys)} differences, e.g. {keys[0]} "
+                            f"{found_counts.get(keys[0])} instead of {expected_counts.get(keys[0])}")
+    if found.skipped != expected.skipped:
+        failures.append(f"{storage} skipped: {found.skipped} instead of {expected.skipped}")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the circulation report of every storage backend.")
+    parser.add_argument("--books", type=int, default=200, help="books in the synthetic database")
+    parser.add_argument("--notes", type=int, default=1500, help="borrows saved through the Library")
+    parser.add_argument("--workers", type=int, default=2, help="worker processes of the reports")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the random generator")
+    args = parser.parse_args()
+    # Small chunks, so that records and notes go over the chunk boundaries.
+    circulation.FILES_CHUNK = 7
+    circulation.SEGMENT_CHUNK = 4096
+    circulation.LOANS_CHUNK = 11
+    failures = []
+    with data_directory("lms-circulationcheck-", args.books, args.seed):
+        library = Library("Circulation Check Library", "check")
+        damaged = save_notes(library, args.notes, args.seed)
+        expected = serial_counts(library, damaged)
+        loanlog.migrate()
+        sqlitestore.migrate()
+        for storage in ("text", "log", "sqlite"):
+            failures += compare_counts(storage, circulation_report(storage, args.workers), expected)
+    for failure in failures:
+        print(f"FAILED {failure}", file=sys.stderr)
+    print(f"{sum(expected.loans.values())} loans in 3 backends, {len(failures)} failures.", file=sys.stderr)
+    sys.exit(1 if failures else 0)
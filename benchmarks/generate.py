@@ -0,0 +1,132 @@
+import os
+import sys
+import random
+import shutil
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+# The Library modules live in the repository root, and the benchmarks change the working directory.
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_PATH not in sys.path:
+    sys.path.insert(0, REPO_PATH)
+
+import libraryfs
+
+# Words used for the synthetic book names, authors and publishers.
+WORDS = ["Harry", "Potter", "Stone", "Secrets", "Prisoner", "Fire", "Order", "Prince",
+         "Hallows", "Ring", "Kingdom", "River", "Mountain", "Shadow", "Garden", "Winter",
+         "Summer", "Journey", "Night", "Light", "Silver", "Golden", "Empire", "Ocean"]
+BORROWERS = ["Bijay", "Utsav Magar", "Ram Bahadur", "Sita Sharma", "Hari Thapa",
+             "Gita Rai", "Anish Gurung", "Priya Shrestha"]
+
+
+def generate_bookstocks(path: str, total: int, seed: int = 0) -> list[str]:
+    """
+    Writes a synthetic book stocks file and returns the book names.
+
+    Parameters:
+    -----------
+    path : str
+        path of the book stocks file to write.
+    total : int
+        number of books.
+    seed : int, optional
+        seed for the random generator.
+
+    Returns:
+    --------
+    names : list[str]
+        names of the books, in the file order.
+    """
+    generator = random.Random(seed)
+    names = []
+    lines = []
+    for index in range(total):
+        name = " ".join(generator.choices(WORDS, k=4)) + f" {index}"
+        author = f"{generator.choice(WORDS)} {generator.choice(WORDS)}"
+        publisher = f"{generator.choice(WORDS)} Publishing"
+        stock = generator.randint(1, 50)
+        names.append(name)
+        lines.append(f"BK.{index},{name},{author},{publisher},{generator.randint(1900, 2021)},"
+                     f"{stock},{generator.randint(0, stock)},{float(generator.randint(1, 40))}\n")
+    with open(path, "w") as bookstocks:
+        bookstocks.writelines(lines)
+    return names
+
+
+def generate_notes(directory: str, total: int, names: list[str], seed: int = 0) -> list[str]:
+    """
+    Writes synthetic notes in the savenotes format and returns their note IDs.
+
+    About half of the notes are returned.
+
+    Parameters:
+    -----------
+    directory : str
+        notes directory to write to.
+    total : int
+        number of notes.
+    names : list[str]
+        names of the books that can be borrowed.
+    seed : int, optional
+        seed for the random generator.
+
+    Returns:
+    --------
+    noteids : list[str]
+        note IDs of the notes.
+    """
+    generator = random.Random(seed)
+    start = datetime(2020, 1, 1)
+    noteids = []
+    for index in range(total):
+        borrower = generator.choice(BORROWERS)
+        borroweddate = start + timedelta(seconds=index * 600)
+        returndate = borroweddate + timedelta(days=10)
+        noteid = f"{borrower.lower().replace(' ', '-')}-{int(borroweddate.timestamp())}"
+        books = generator.sample(names, k=min(len(names), generator.randint(1, 3)))
+        prices = [float(generator.randint(1, 40)) for _ in books]
+        lines = [f"BORROW:{borrower},{name},{borroweddate.isoformat()},{returndate.isoformat()},{price}\n"
+                 for name, price in zip(books, prices)]
+        if generator.random() < 0.5:
+            returneddate = borroweddate + timedelta(days=generator.randint(1, 20))
+            late_days = (returneddate - returndate).days
+            lines.append(f"RETURN:{borrower},{returneddate.isoformat()},{late_days},"
+                         f"{sum(prices) + max(late_days, 0) * 10.0}")
+        with open(os.path.join(directory, f"{noteid}.data"), "w") as notes:
+            notes.writelines(lines)
+        noteids.append(noteid)
+    return noteids
+
+
+@contextmanager
+def data_directory(prefix: str, books: int, seed: int = 0):
+    """
+    Runs the block in a temporary data directory with a synthetic book stocks file.
+
+    The working directory is changed back and the data directory removed afterwards.
+
+    Parameters:
+    -----------
+    prefix : str
+        prefix of the temporary directory name.
+    books : int
+        number of books in the book stocks file.
+    seed : int, optional
+        seed for the random generator.
+
+    Yields:
+    -------
+    names : list[str]
+        names of the books, in the file order.
+    """
+    working_directory = os.getcwd()
+    data_root = tempfile.mkdtemp(prefix=prefix)
+    try:
+        os.makedirs(os.path.join(data_root, "data", "notes"))
+        os.chdir(data_root)
+        yield generate_bookstocks(libraryfs.STOCKS_PATH, books, seed)
+    finally:
+        os.chdir(working_directory)
+        shutil.rmtree(data_root, ignore_errors=True)
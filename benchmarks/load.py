@@ -0,0 +1,149 @@
+"""
+Load generator for the Library service in server.py.
+
+Every simulated client opens its own connection and repeats a search,
+a borrow and a return of a random available book.
+
+Usage: python benchmarks/load.py --clients 1000 --cycles 5 [--port 8765] [--unix path]
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+
+# The Library modules live in the repository root.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server import HOST, PORT, LINE_LIMIT
+
+
+async def request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, latencies: dict,
+                  action: str, **fields) -> dict:
+    """
+    Sends a request, records its latency and returns the response.
+
+    Parameters:
+    -----------
+    reader : asyncio.StreamReader
+        stream of the responses.
+    writer : asyncio.StreamWriter
+        stream of the requests.
+    latencies : dict[str, list[float]]
+        latencies in seconds keyed by the action.
+    action : str
+        action of the request.
+    **fields
+        other keys of the request.
+    """
+    start = time.perf_counter()
+    writer.write(json.dumps({"action": action, **fields}).encode() + b"\n")
+    await writer.drain()
+    response = json.loads(await reader.readline())
+    latencies.setdefault(action, []).append(time.perf_counter() - start)
+    return response
+
+
+async def simulate_client(index: int, bookids: list, cycles: int, address: dict,
+                          latencies: dict, errors: list, seed: int):
+    """
+    Runs the search, borrow and return cycles of one simulated client.
+
+    Parameters:
+    -----------
+    index : int
+        number of the client, used in the borrower name.
+    bookids : list[str]
+        IDs of the books to borrow.
+    cycles : int
+        number of cycles.
+    address : dict
+        host and port, or unix path of the service.
+    latencies : dict[str, list[float]]
+        latencies in seconds keyed by the action.
+    errors : list[str]
+        messages of the failed requests.
+    seed : int
+        seed for the random generator.
+    """
+    generator = random.Random(seed + index)
+    if address.get("unix"):
+        reader, writer = await asyncio.open_unix_connection(address["unix"], limit=LINE_LIMIT)
+    else:
+        reader, writer = await asyncio.open_connection(address["host"], address["port"], limit=LINE_LIMIT)
+    try:
+        for cycle in range(cycles):
+            bookid = generator.choice(bookids)
+            await request(reader, writer, latencies, "search", query=bookid)
+            borrowed = await request(reader, writer, latencies, "borrow",
+                                     borrower=f"Load Client {index}", books=[bookid])
+            if borrowed["status"] != "ok":
+                errors.append(borrowed["message"])
+                continue
+            returned = await request(reader, writer, latencies, "return", noteid=borrowed["noteid"])
+            if returned["status"] != "ok":
+                errors.append(returned["message"])
+    finally:
+        writer.close()
+
+
+async def run_load(clients: int, cycles: int, address: dict, seed: int = 0) -> dict:
+    """
+    Returns the throughput and latency percentiles of the simulated clients.
+
+    Parameters:
+    -----------
+    clients : int
+        number of concurrent clients.
+    cycles : int
+        cycles per client.
+    address : dict
+        host and port, or unix path of the service.
+    seed : int, optional
+        seed for the random generator.
+
+    Returns:
+    --------
+    results : dict
+        requests, errors, seconds, requests per second and latencies per action.
+    """
+    if address.get("unix"):
+        reader, writer = await asyncio.open_unix_connection(address["unix"], limit=LINE_LIMIT)
+    else:
+        reader, writer = await asyncio.open_connection(address["host"], address["port"], limit=LINE_LIMIT)
+    listing = await request(reader, writer, {}, "list", available=True, limit=1000)
+    writer.close()
+    bookids = [book["lib_id"] for book in listing["books"]]
+    latencies = {}
+    errors = []
+    start = time.perf_counter()
+    await asyncio.gather(*[simulate_client(index, bookids, cycles, address, latencies, errors, seed)
+                           for index in range(clients)])
+    seconds = time.perf_counter() - start
+    requests = sum([len(values) for values in latencies.values()])
+    results = {"clients": clients, "requests": requests, "errors": len(errors),
+               "seconds": seconds, "requests_per_second": requests / seconds, "latency": {}}
+    for action, values in sorted(latencies.items()):
+        values.sort()
+        results["latency"][action] = {
+            "p50": values[len(values) // 2],
+            "p95": values[int(len(values) * 0.95)],
+            "p99": values[int(len(values) * 0.99)],
+            "max": values[-1],
+        }
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drive the Library service with simulated clients.")
+    parser.add_argument("--clients", type=int, default=1000, help="concurrent clients")
+    parser.add_argument("--cycles", type=int, default=5, help="search/borrow/return cycles per client")
+    parser.add_argument("--host", default=HOST, help=f"address of the service (default {HOST})")
+    parser.add_argument("--port", type=int, default=PORT, help=f"TCP port (default {PORT})")
+    parser.add_argument("--unix", help="Unix socket path of the service")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the book choices")
+    args = parser.parse_args()
+    address = {"host": args.host, "port": args.port, "unix": args.unix}
+    print(json.dumps(asyncio.run(run_load(args.clients, args.cycles, address, args.seed)), indent=2))
@@ -0,0 +1,184 @@
+"""
+Check of Library.query_books against a brute force filter and sort of all the books.
+
+Random queries are run between random borrows, returns, additions and
+removals, so the sorted indexes are checked while they are kept up to date.
+Exits with status 1 if a page differs from the brute force one.
+
+Usage: python benchmarks/querycheck.py [--books 2000] [--rounds 200] [--queries 20] [--seed 0]
+"""
+import os
+import sys
+import random
+import argparse
+
+# The benchmarks package lives in the repository root.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from book import Book
+from library import Library
+from errors import NoMoreStocks
+from sortedindex import SORT_FIELDS, SORT_KEYS
+from benchmarks.generate import data_directory, WORDS
+
+
+def brute_force(library: Library, query: dict) -> list[Book]:
+    """
+    Returns the page of the query by checking and sorting every book.
+
+    Parameters:
+    -----------
+    library : Library
+        Library to query.
+    query : dict
+        keyword arguments of query_books.
+    """
+    ranges = {field: query.get(field) for field in ("pub_date", "price", "remaining")}
+    if query.get("author") is not None:
+        ranges["author"] = (query["author"].casefold(), query["author"].casefold())
+    books = []
+    for book in library.bookdb:
+        for field, bounds in ranges.items():
+            if bounds is None:
+                continue
+            value = SORT_KEYS[field](book)
+            if (bounds[0] is not None and value < bounds[0]) or (bounds[1] is not None and value > bounds[1]):
+                break
+        else:
+            books.append(book)
+    # Same order as the sorted indexes, ties broken by the ID and then the id().
+    sort_key = SORT_KEYS[query["sort_by"]]
+    books.sort(key=lambda book: (sort_key(book), book.lib_id.casefold(), id(book)), reverse=query["descending"])
+    offset = query["offset"]
+    if query["page_size"] is None:
+        return books[offset:]
+    return books[offset:offset + query["page_size"]]
+
+
+def random_bounds(generator: random.Random, low, high, integer: bool = True) -> tuple:
+    """
+    Returns random bounds between low and high, each missing a fifth of the time.
+
+    Parameters:
+    -----------
+    generator : random.Random
+        random generator.
+    low, high : int
+        range of the values.
+    integer : bool, optional
+        whether the bounds are whole numbers.
+    """
+    value = generator.randint if integer else lambda first, last: float(generator.randint(first, last))
+    first, last = sorted([value(low, high), value(low, high)])
+    return (None if generator.random() < 0.2 else first, None if generator.random() < 0.2 else last)
+
+
+def random_query(generator: random.Random, authors: list[str]) -> dict:
+    """
+    Returns random keyword arguments for query_books.
+
+    Parameters:
+    -----------
+    generator : random.Random
+        random generator.
+    authors : list[str]
+        authors of the books, for the author queries.
+    """
+    query = {"sort_by": generator.choice(SORT_FIELDS), "descending": generator.random() < 0.5,
+             "page_size": generator.choice([None, 1, 10, 50]), "offset": generator.choice([0, 0, 5, 40])}
+    # Narrow and wide ranges, so that both ways of select_books are used.
+    if generator.random() < 0.5:
+        query["pub_date"] = random_bounds(generator, 1895, 2025)
+    if generator.random() < 0.4:
+        query["price"] = random_bounds(generator, 0, 45, integer=False)
+    if generator.random() < 0.4:
+        query["remaining"] = random_bounds(generator, 0, 50)
+    if generator.random() < 0.2:
+        # Authors in any case, as the author index is case folded.
+        author = generator.choice(authors)
+        query["author"] = author.upper() if generator.random() < 0.5 else author
+    return query
+
+
+def change_books(library: Library, generator: random.Random, open_notes: list, next_id: list):
+    """
+    Borrows, returns, adds or removes a random book without saving the notes.
+
+    Parameters:
+    -----------
+    library : Library
+        Library to change.
+    generator : random.Random
+        random generator.
+    open_notes : list[tuple]
+        note ID and Note object of the borrows not returned yet.
+    next_id : list[int]
+        number of the next added book.
+    """
+    action = generator.random()
+    if action < 0.4:
+        books = generator.sample(library.bookdb, generator.randint(1, 3))
+        try:
+            open_notes.append(library.borrow_books("Query Check", [book.lib_id for book in books], save=False))
+        except NoMoreStocks:
+            pass
+    elif action < 0.7 and open_notes:
+        noteid, notes = open_notes.pop(generator.randrange(len(open_notes)))
+        library.return_books(noteid, notes, save=False)
+    elif action < 0.85:
+        stock = generator.randint(0, 50)
+        book = Book(f"QC.{next_id[0]}", f"Query Check {next_id[0]}",
+                    f"{generator.choice(WORDS)} {generator.choice(WORDS)}", "Check Publishing",
+                    str(generator.randint(1900, 2021)), stock, float(generator.randint(1, 40)),
+                    generator.randint(0, stock))
+        next_id[0] += 1
+        library.add_books([book])
+    else:
+        library.remove_books([generator.choice(library.bookdb)])
+
+
+def check_queries(library: Library, rounds: int, queries: int, seed: int) -> list[str]:
+    """
+    Returns the queries whose page differs from the brute force one.
+
+    Parameters:
+    -----------
+    library : Library
+        Library to query and change.
+    rounds : int
+        rounds of changes followed by queries.
+    queries : int
+        queries per round.
+    seed : int
+        seed for the random generator.
+    """
+    generator = random.Random(seed)
+    open_notes = []
+    next_id = [0]
+    failures = []
+    for _ in range(rounds):
+        for _ in range(generator.randint(1, 20)):
+            change_books(library, generator, open_notes, next_id)
+        authors = [book.author for book in library.bookdb]
+        for _ in range(queries):
+            query = random_query(generator, authors)
+            expected = [book.lib_id for book in brute_force(library, query)]
+            found = [book.lib_id for book in library.query_books(**query)]
+            if found != expected:
+                failures.append(f"{query}: {len(found)} books {found[:5]}, expected {len(expected)} {expected[:5]}")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check Library.query_books against a brute force search.")
+    parser.add_argument("--books", type=int, default=2000, help="books in the synthetic database")
+    parser.add_argument("--rounds", type=int, default=200, help="rounds of random changes and queries")
+    parser.add_argument("--queries", type=int, default=20, help="queries per round")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the random generator")
+    args = parser.parse_args()
+    with data_directory("lms-querycheck-", args.books, args.seed):
+        failures = check_queries(Library("Query Check Library", "check"), args.rounds, args.queries, args.seed)
+    for failure in failures:
+        print(f"FAILED {failure}", file=sys.stderr)
+    print(f"{args.rounds * args.queries} queries, {len(failures)} failures.", file=sys.stderr)
+    sys.exit(1 if failures else 0)
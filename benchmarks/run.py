@@ -0,0 +1,200 @@
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import subprocess
+from datetime import datetime, timedelta
+
+# The benchmarks package lives in the repository root.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import libraryfs
+import notesmanager
+from library import Library
+from fulltext import TextIndex
+from circulation import circulation_report
+from benchmarks.generate import REPO_PATH, data_directory, generate_notes
+
+
+def measure(results: dict, name: str, function, calls: int = 1):
+    """
+    Times the function called the given number of times and adds it to the results.
+
+    Parameters:
+    -----------
+    results : dict
+        results keyed by the benchmark name.
+    name : str
+        name of the benchmark.
+    function : callable
+        function taking the call index.
+    calls : int, optional
+        number of calls.
+
+    Returns:
+    --------
+    value : any
+        value returned by the last call.
+    """
+    value = None
+    start = time.perf_counter()
+    for index in range(calls):
+        value = function(index)
+    seconds = time.perf_counter() - start
+    results[name] = {"seconds": seconds, "calls": calls, "per_call": seconds / calls}
+    print(f"{name:<32}{seconds:>10.4f} s{calls:>8} calls", file=sys.stderr)
+    return value
+
+
+def run_benchmarks(books: int, notes: int, queries: int, seed: int = 0) -> dict:
+    """
+    Returns the timings of the Library operations on synthetic data in a temporary directory.
+
+    Parameters:
+    -----------
+    books : int
+        number of books in the synthetic catalog.
+    notes : int
+        number of synthetic notes.
+    queries : int
+        number of calls for the lookup benchmarks.
+    seed : int, optional
+        seed for the random generator.
+
+    Returns:
+    --------
+    results : dict
+        timings keyed by the benchmark name.
+    """
+    generator = random.Random(seed)
+    results = {}
+    with data_directory("lms-bench-", books, seed) as names:
+        noteids = generate_notes("./data/notes/", notes, names, seed)
+        # Starting without the state left by an earlier run.
+        notesmanager.notes_catalog = None
+
+        measure(results, "loadbookstocks (text)",
+                lambda _: libraryfs.loadbookstocks())
+        measure(results, "loadbookstocks (binary)",
+                lambda _: libraryfs.loadbookstocks())
+        bookdb = libraryfs.loadbookstocks()
+        measure(results, "savebookstocks", lambda _: libraryfs.savebookstocks(bookdb))
+        library = measure(results, "Library()",
+                          lambda _: Library("Benchmark Library", "bench"))
+
+        lookups = [generator.choice(names) for _ in range(queries)]
+        measure(results, "find_book",
+                lambda index: library.find_book(lookups[index].upper()), queries)
+        measure(results, "find_book_by_id",
+                lambda index: library.find_book_by_id(f"bk.{index % books}"), queries)
+        # Dropping a character from the names to make typos.
+        typos = [name[:len(name) // 2] + name[len(name) // 2 + 1:] for name in lookups]
+        measure(results, "find_similar_book",
+                lambda index: library.find_similar_book(typos[index]), queries)
+        measure(results, "TextIndex()", lambda _: TextIndex(library.bookdb))
+        # Two words of a name, the second one as a prefix.
+        words = [" ".join(name.split()[:2])[:-1] + "*" for name in lookups]
+        measure(results, "search_books",
+                lambda index: library.search_books(words[index], limit=20), queries)
+        measure(results, "get_sorted_indexes", lambda _: library.get_sorted_indexes())
+        # A decade of books under a price, sorted by price, one page at a time.
+        measure(results, "query_books",
+                lambda index: library.query_books(pub_date=(1900 + index % 110, 1910 + index % 110), price=(None, 20),
+                                                  sort_by="price", page_size=20, offset=20 * (index % 10)), queries)
+
+        measure(results, "rebuildnotescatalog",
+                lambda _: notesmanager.rebuildnotescatalog())
+        slugs = [noteid.rsplit("-", 1)[0] for noteid in noteids]
+        measure(results, "searchnotes",
+                lambda index: notesmanager.searchnotes(slugs[index % len(slugs)], True), queries)
+        measure(results, "create_notes",
+                lambda index: library.create_notes(noteids[index % len(noteids)]), queries)
+        measure(results, "circulation_report", lambda _: circulation_report("text"))
+
+        available = [name for name in lookups if library.find_book(name).remaining > 0]
+        borroweddate = datetime(2030, 1, 1)
+
+        def borrow_and_return(index):
+            noteid, _ = library.borrow_books(
+                f"Bench Borrower {index}", [available[index % len(available)]],
+                borroweddate + timedelta(seconds=index))
+            library.return_books(noteid)
+        measure(results, "borrow/return cycle", borrow_and_return, queries)
+        measure(results, "savebookdb", lambda _: library.savebookdb())
+    return results
+
+
+def compare_results(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """
+    Returns the benchmarks that got slower than the baseline by more than the threshold.
+
+    Parameters:
+    -----------
+    results : dict
+        timings of this run.
+    baseline : dict
+        timings of an earlier run.
+    threshold : float
+        allowed slowdown, 0.2 for 20%.
+
+    Returns:
+    --------
+    regressions : list[str]
+        descriptions of the regressions.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name in baseline and baseline[name]["per_call"] > 0:
+            change = result["per_call"] / baseline[name]["per_call"] - 1
+            if change > threshold:
+                regressions.append(f"{name}: {change:+.0%}")
+    return regressions
+
+
+def get_commit() -> str:
+    """
+    Returns the current git commit of the repository, or None outside of git.
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_PATH, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Library on synthetic data.")
+    parser.add_argument("--books", type=int, default=10000, help="books in the catalog")
+    parser.add_argument("--notes", type=int, default=1000, help="notes in the notes directory")
+    parser.add_argument("--queries", type=int, default=1000, help="calls per lookup benchmark")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the synthetic data")
+    parser.add_argument("--output", help="JSON file for the results (stdout by default)")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="allowed slowdown against --compare (default 0.2)")
+    args = parser.parse_args()
+
+    report = {
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "date": datetime.now().isoformat(),
+        "books": args.books,
+        "notes": args.notes,
+        "queries": args.queries,
+        "results": run_benchmarks(args.books, args.notes, args.queries, args.seed),
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare_results(report["results"], json.load(baseline)["results"],
+                                          args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
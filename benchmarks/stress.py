@@ -0,0 +1,216 @@
+"""
+Stress test of the Library's stock locking with many threads borrowing the same popular titles.
+
+The popular titles give up the thread between reading and changing their
+stock, so a reservation without the stock locks loses updates. With
+--unlocked the stock locks are replaced by ones that don't lock, and the
+test is expected to fail.
+
+Exits with status 1 if a stock was oversold or a borrow or return was lost.
+
+Usage: python benchmarks/stress.py [--threads 32] [--operations 2000] [--cycles 50] [--titles 5] [--stock 3] [--unlocked]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+from collections import Counter
+
+# The benchmarks package lives in the repository root.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import libraryfs
+from book import Book, STOCK_LOCKS
+from library import Library
+from errors import NoMoreStocks
+from benchmarks.generate import data_directory
+
+
+class YieldingBook(Book):
+    """
+    A book that gives up the thread whenever its remaining stock is read.
+
+    Another thread can then change the stock between the check and the
+    change of a reservation, which the stock locks have to prevent.
+    """
+
+    @property
+    def remaining(self) -> int:
+        remaining = self.__dict__["remaining"]
+        time.sleep(0)
+        return remaining
+
+    @remaining.setter
+    def remaining(self, value: int):
+        self.__dict__["remaining"] = value
+
+
+class UnlockedLock:
+    """
+    A stand-in for a stock lock that doesn't lock, to show the races of the reservations.
+    """
+
+    def acquire(self, *args) -> bool:
+        return True
+
+    def release(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+def run_threads(threads: int, target) -> list:
+    """
+    Runs the target in the given number of threads at once and returns their results.
+
+    Parameters:
+    -----------
+    threads : int
+        number of threads.
+    target : callable
+        function taking the thread index.
+    """
+    results = [None] * threads
+    start = threading.Barrier(threads)
+
+    def run(index):
+        start.wait()
+        results[index] = target(index)
+    workers = [threading.Thread(target=run, args=(index,)) for index in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return results
+
+
+def stress_reservations(library: Library, titles: list, threads: int, operations: int, seed: int) -> list[str]:
+    """
+    Returns the failures of borrowing and returning random sets of the titles from many threads, without saving.
+
+    Parameters:
+    -----------
+    library : Library
+        Library to borrow from, without saving.
+    titles : list[Book]
+        popular books borrowed by every thread.
+    threads : int
+        number of threads.
+    operations : int
+        borrows per thread.
+    seed : int
+        seed for the random generator.
+    """
+    initial = {book.lib_id: book.remaining for book in titles}
+
+    def borrow(index):
+        generator = random.Random(seed + index)
+        borrowed = Counter()
+        open_notes = []
+        for operation in range(operations):
+            # Returning an open note half of the time, to keep the stocks changing.
+            if open_notes and generator.random() < 0.5:
+                noteid, notes = open_notes.pop(generator.randrange(len(open_notes)))
+                _, returned_books = library.return_books(noteid, notes, save=False)
+                borrowed.subtract([book.lib_id for book in returned_books])
+                continue
+            books = generator.sample(titles, generator.randint(1, min(3, len(titles))))
+            try:
+                noteid, notes = library.borrow_books(f"Thread {index} {operation}",
+                                                     [book.lib_id for book in books], save=False)
+                borrowed.update([book.lib_id for book in notes.books])
+                open_notes.append((noteid, notes))
+            except NoMoreStocks:
+                pass
+        return borrowed
+    borrowed = Counter()
+    for counts in run_threads(threads, borrow):
+        borrowed.update(counts)
+    failures = []
+    for book in titles:
+        if book.remaining < 0 or book.remaining != initial[book.lib_id] - borrowed[book.lib_id]:
+            failures.append(f"{book.lib_id}: {initial[book.lib_id]} in stock, {borrowed[book.lib_id]} "
+                            f"borrowed, {book.remaining} remaining")
+    return failures
+
+
+def stress_cycles(library: Library, titles: list, threads: int, operations: int, seed: int) -> list[str]:
+    """
+    Returns the failures of saved borrow and return cycles of the titles from many threads.
+
+    Parameters:
+    -----------
+    library : Library
+        Library to borrow from and return to, with saving.
+    titles : list[Book]
+        popular books borrowed by every thread.
+    threads : int
+        number of threads.
+    operations : int
+        cycles per thread.
+    seed : int
+        seed for the random generator.
+    """
+    initial = {book.lib_id: book.remaining for book in titles}
+
+    def cycle(index):
+        generator = random.Random(seed + index)
+        for operation in range(operations):
+            books = generator.sample(titles, generator.randint(1, min(3, len(titles))))
+            try:
+                noteid, notes = library.borrow_books(f"Cycle {index} {operation}",
+                                                     [book.lib_id for book in books])
+            except NoMoreStocks:
+                continue
+            library.return_books(noteid, notes)
+    run_threads(threads, cycle)
+    failures = [f"{book.lib_id}: {initial[book.lib_id]} in stock, {book.remaining} remaining after the cycles"
+                for book in titles if book.remaining != initial[book.lib_id]]
+    # The saved stocks have to match the ones in memory.
+    saved = {book.lib_id: book.remaining for book in libraryfs.loadbookstocks()}
+    failures += [f"{book.lib_id}: {book.remaining} remaining, {saved[book.lib_id]} saved"
+                 for book in titles if saved[book.lib_id] != book.remaining]
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stress the Library's stock locking with many threads.")
+    parser.add_argument("--threads", type=int, default=32, help="concurrent threads")
+    parser.add_argument("--operations", type=int, default=2000, help="borrows per thread without saving")
+    parser.add_argument("--cycles", type=int, default=50, help="saved borrow/return cycles per thread")
+    parser.add_argument("--titles", type=int, default=5, help="popular titles borrowed by every thread")
+    parser.add_argument("--stock", type=int, default=3, help="copies of each popular title")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the random generator")
+    parser.add_argument("--unlocked", action="store_true", help="replace the stock locks by ones that don't lock")
+    args = parser.parse_args()
+    # Switching threads as often as possible to make races likely.
+    sys.setswitchinterval(1e-6)
+    if args.unlocked:
+        STOCK_LOCKS[:] = [UnlockedLock() for _ in STOCK_LOCKS]
+    with data_directory("lms-stress-", 1000, args.seed):
+        library = Library("Stress Library", "stress")
+        # Keeping the popular titles close to running out, and yielding between the check and the change.
+        titles = []
+        for index, book in enumerate(library.bookdb[:args.titles]):
+            title = YieldingBook(book.lib_id, book.name, book.author, book.publisher, book.pub_date,
+                                 args.stock, book.price, args.stock)
+            library.unindex_book(book)
+            library.bookdb[index] = title
+            library.index_book(title)
+            titles.append(title)
+        failures = stress_reservations(library, titles, args.threads, args.operations, args.seed)
+        # Putting the stock back for the saved cycles.
+        for book in titles:
+            book.remaining = book.total
+        libraryfs.savebookstocks(library.bookdb)
+        failures += stress_cycles(library, titles, args.threads, args.cycles, args.seed)
+    for failure in failures:
+        print(f"FAILED {failure}", file=sys.stderr)
+    print(f"{len(failures)} failures.", file=sys.stderr)
+    sys.exit(1 if failures else 0)
@@ -1,5 +1,13 @@
+import sys
+import weakref
+import threading
 from errors import NoMoreStocks, StockFull
 
+# Locks guarding the stock of the books, shared by the books with the same hash of their ID.
+STOCK_LOCKS = [threading.Lock() for _ in range(64)]
+# Indexes sorted by the remaining stock, told about every stock change.
+stock_indexes = weakref.WeakSet()
+
 
 class Book:
     """
@@ -30,6 +38,8 @@ class Book:
         Borrows the book i.e. reduces one from the remaining stock value.
     returned():
         Marks the book as returned i.e. adds one to the remaining stock value.
+    add_stock(count):
+        Adds to the remaining stock value without any checks.
     getAvailableText():
         Returns the remaining stock info of the book.
     getDisplayText():
@@ -38,6 +48,10 @@ class Book:
         Returns the book information for saving.
     """
 
+    # Fixed attributes without a per-object __dict__, for large catalogs.
+    __slots__ = ("lib_id", "name", "author", "publisher",
+                 "pub_date", "total", "price", "remaining")
+
     def __init__(self, lib_id: str, name: str, author: str, publisher: str, pub_date: str, total: int, price: float, remaining: int = None):
         """
         Constructor for the Book object.
@@ -63,9 +77,10 @@ class Book:
         """
         self.lib_id = lib_id
         self.name = name
-        self.author = author
-        self.publisher = publisher
-        self.pub_date = pub_date
+        # Interning the strings repeated across many books so that they are shared.
+        self.author = sys.intern(author)
+        self.publisher = sys.intern(publisher)
+        self.pub_date = sys.intern(pub_date)
         self.total = total
         self.price = price
         if remaining is None:
@@ -77,19 +92,37 @@ class Book:
         """
         Borrows the book i.e. reduces one from the remaining stock value.
         """
-        if self.remaining >= 1:
-            self.remaining -= 1
-        else:
-            raise NoMoreStocks(self.remaining, "Stock Empty.")
+        with stock_lock(self):
+            if self.remaining >= 1:
+                self.remaining -= 1
+            else:
+                raise NoMoreStocks(self.remaining, "Stock Empty.")
+        stock_changed(self)
 
     def returned(self):
         """
         Marks the book as returned i.e. adds one to the remaining stock value.
         """
-        if self.remaining < self.total:
-            self.remaining += 1
-        else:
-            raise StockFull(self.remaining, "Stock Already Full.")
+        with stock_lock(self):
+            if self.remaining < self.total:
+                self.remaining += 1
+            else:
+                raise StockFull(self.remaining, "Stock Already Full.")
+        stock_changed(self)
+
+    def add_stock(self, count: int):
+        """
+        Adds to the remaining stock value without any checks.
+        Used for the stock changes made by other processes.
+
+        Parameters:
+        -----------
+        count : int
+            number of books to add, negative to remove.
+        """
+        with stock_lock(self):
+            self.remaining += count
+        stock_changed(self)
 
     def getAvailableText(self) -> str:
         """
@@ -108,3 +141,87 @@ class Book:
         Returns the book information for saving.
         """
         return f"{self.lib_id},{self.name},{self.author},{self.publisher},{self.pub_date},{self.total},{self.remaining},{self.price}\n"
+
+
+def watch_stocks(index):
+    """
+    Registers an index to be told about the stock changes of the books.
+
+    Parameters:
+    -----------
+    index : SortedIndex
+        index with a mark(book) method, kept until it is garbage collected.
+    """
+    stock_indexes.add(index)
+
+
+def stock_changed(book: Book):
+    """
+    Tells the registered indexes that the remaining stock of the book changed.
+
+    Parameters:
+    -----------
+    book : Book
+        book with the changed stock.
+    """
+    for index in list(stock_indexes):
+        index.mark(book)
+
+
+def stock_lock(book: Book) -> threading.Lock:
+    """
+    Returns the lock guarding the stock of the book.
+
+    Parameters:
+    -----------
+    book : Book
+        book to lock.
+    """
+    return STOCK_LOCKS[hash(book.lib_id) % len(STOCK_LOCKS)]
+
+
+def reserve_books(books: list[Book]):
+    """
+    Borrows all the books or none of them.
+
+    The locks of the books are taken in a fixed order, so that reservations
+    of overlapping books from several threads can't deadlock.
+
+    Parameters:
+    -----------
+    books : list[Book]
+        different books to borrow one of each.
+
+    Raises:
+    -------
+    NoMoreStocks
+        If a book isn't available, with no stock changed.
+    """
+    locks = [STOCK_LOCKS[index] for index in
+             sorted({hash(book.lib_id) % len(STOCK_LOCKS) for book in books})]
+    for lock in locks:
+        lock.acquire()
+    try:
+        for book in books:
+            if book.remaining < 1:
+                raise NoMoreStocks(book.remaining, "Stock Empty.")
+        for book in books:
+            book.remaining -= 1
+    finally:
+        for lock in reversed(locks):
+            lock.release()
+    for book in books:
+        stock_changed(book)
+
+
+def release_books(books: list[Book]):
+    """
+    Puts back the books reserved with reserve_books.
+
+    Parameters:
+    -----------
+    books : list[Book]
+        books to put back one of each.
+    """
+    for book in books:
+        book.add_stock(1)
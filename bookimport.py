@@ -0,0 +1,157 @@
+"""
+Bulk import of books into the Library's Database from a CSV or JSON Lines file.
+
+Books file format (CSV with a header, or JSON Lines with the same keys):
+------------------------------------------------------------------------
+lib_id -> unique Library ID of the book
+name, author, publisher -> details of the book, without commas
+pub_date -> published year (YYYY)
+total -> total stock, an integer
+price -> price for borrowing the book (per 10 days)
+
+Usage: python bookimport.py books.csv [--report report.csv] [--user admin]
+"""
+import sys
+import csv
+import argparse
+from book import Book
+from batch import read_operations
+from library import Library, normalize_key
+from input_funcs import validate_pub_date
+from instrumentation import enable_from_environment
+
+# Text fields of a book, saved in the comma separated book stocks format.
+TEXT_FIELDS = ["lib_id", "name", "author", "publisher"]
+# Columns of the report.
+REPORT_FIELDS = ["row", "lib_id", "status", "message"]
+
+
+def parse_book(record: dict) -> Book:
+    """
+    Returns the Book object of a record, validated with the same rules as get_book_details_input.
+
+    Parameters:
+    -----------
+    record : dict
+        lib_id, name, author, publisher, pub_date, total and price of the book.
+
+    Returns:
+    --------
+    book : Book
+        Book object with all of its stock remaining.
+
+    Raises:
+    -------
+    ValueError
+        If a field is missing or invalid.
+    """
+    details = []
+    for field in TEXT_FIELDS:
+        value = str(record.get(field) or "").strip()
+        if not value:
+            raise ValueError(field, f"Missing {field}.")
+        # The book stocks file has one comma separated book per line.
+        if "," in value or "\n" in value:
+            raise ValueError(value, f"Commas and line breaks aren't allowed in {field}.")
+        details.append(value)
+    pub_date = str(record.get("pub_date") or "").strip()
+    try:
+        validate_pub_date(pub_date)
+    except ValueError:
+        raise ValueError(pub_date, "Invalid published date, use the YYYY format.")
+    try:
+        total = int(str(record.get("total") or "").strip())
+    except ValueError:
+        raise ValueError(record.get("total"), "Invalid total stock, use an integer value.")
+    try:
+        price = float(str(record.get("price") or "").strip())
+    except ValueError:
+        raise ValueError(record.get("price"), "Invalid price, use a float/integer value.")
+    return Book(*details, pub_date, total, price)
+
+
+def import_books(library: Library, records) -> list[dict]:
+    """
+    Returns the report of importing the books into the library.
+
+    The records are streamed and checked in one pass, with the IDs looked up
+    in the Library's indexes and in a set of the IDs seen in the file. The
+    valid books are then added with one journal write.
+
+    Parameters:
+    -----------
+    library : Library
+        Library to add the books to.
+    records : iterable of dict
+        records with the keys of parse_book.
+
+    Returns:
+    --------
+    report : list[dict]
+        row, lib_id, status (ok or error) and message of every record.
+    """
+    report = []
+    books = []
+    # Row of each ID in the file, keyed by the normalized ID.
+    seen = {}
+    for row, record in enumerate(records, 1):
+        lib_id = str(record.get("lib_id") or "").strip()
+        try:
+            book = parse_book(record)
+            key = normalize_key(book.lib_id)
+            if key in seen:
+                raise ValueError(lib_id, f"Same ID as row {seen[key]}.")
+            if library.check_duplicates(book.lib_id) is not None:
+                raise ValueError(lib_id, "ID already in the Library's Database.")
+            seen[key] = row
+            books.append(book)
+            report.append({"row": row, "lib_id": lib_id, "status": "ok", "message": ""})
+        except ValueError as e:
+            report.append({"row": row, "lib_id": lib_id, "status": "error", "message": str(e.args[-1])})
+    added = {id(book) for book in library.add_books(books)}
+    for book in books:
+        if id(book) not in added:
+            result = report[seen[normalize_key(book.lib_id)] - 1]
+            # Another process may have used the ID since it was checked, otherwise the journal couldn't be written.
+            if library.check_duplicates(book.lib_id) is not None:
+                result.update(status="error", message="ID added by another terminal meanwhile.")
+            else:
+                result.update(status="error", message="Couldn't record the book in the stock journal.")
+    return report
+
+
+def write_report(report: list[dict], report_file):
+    """
+    Writes the report as CSV.
+
+    Parameters:
+    -----------
+    report : list[dict]
+        report returned by import_books.
+    report_file : file
+        file to write the report to.
+    """
+    writer = csv.DictWriter(report_file, REPORT_FIELDS)
+    writer.writeheader()
+    writer.writerows(report)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import books from a CSV or JSON Lines file.")
+    parser.add_argument("books", help="CSV or JSON Lines file of books")
+    parser.add_argument("--report", help="CSV file for the report (stdout by default)")
+    parser.add_argument("--user", default="admin", help="user importing the books")
+    args = parser.parse_args()
+    # Recording the timings when LMS_METRICS is set.
+    enable_from_environment()
+    library = Library("Islington Library", args.user)
+    report = import_books(library, read_operations(args.books))
+    # Compacting the journal if the import made it large.
+    library.savebookdb()
+    if args.report:
+        with open(args.report, "w", newline="") as report_file:
+            write_report(report, report_file)
+    else:
+        write_report(report, sys.stdout)
+    errors = sum([1 for result in report if result["status"] == "error"])
+    print(f"Imported {len(report) - errors} books with {errors} errors.", file=sys.stderr)
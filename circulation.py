@@ -0,0 +1,360 @@
+"""
+Circulation history reports over all the loan records.
+
+The records are read and counted in a process pool, one chunk of them per
+task (a shard directory of notes files, a byte range of a loan log segment
+or a range of the loans table), and the counts of the chunks are merged.
+
+Reports:
+--------
+most borrowed titles -> times each book was borrowed
+busiest borrowers -> loans and books of each borrower
+revenue per month -> loans, books and fees by the borrow month, fines by the return month
+
+Usage: python circulation.py [--limit 10] [--workers 4] [--csv months.csv]
+"""
+import os
+import csv
+import sys
+import json
+import sqlite3
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from extras import print_table
+
+# Same fine as Note.
+FINE_PER_DAY = 10.0
+# Notes files of the flat layout counted by a worker at once.
+FILES_CHUNK = 2000
+# Bytes of a loan log segment counted by a worker at once.
+SEGMENT_CHUNK = 8 * 1024 * 1024
+# Loans of the loans table counted by a worker at once.
+LOANS_CHUNK = 20000
+# Columns of the revenue per month CSV.
+MONTH_FIELDS = ["month", "loans", "books", "fees", "fines", "revenue"]
+
+
+class Circulation:
+    """
+    A class to represent the counts of the loan records, mergeable across chunks.
+
+    Attributes:
+    -----------
+    titles : Counter
+        times each book was borrowed, keyed by the book name.
+    borrower_loans : Counter
+        loans of each borrower, keyed by the borrower name.
+    borrower_books : Counter
+        books borrowed by each borrower, keyed by the borrower name.
+    loans : Counter
+        loans started in each month, keyed by YYYY-MM.
+    books : Counter
+        books borrowed in each month, keyed by YYYY-MM.
+    fees : Counter
+        borrowing fees of the loans started in each month, keyed by YYYY-MM.
+    fines : Counter
+        fines of the books returned in each month, keyed by YYYY-MM.
+    skipped : int
+        lines and records that couldn't be read, left out of the counts.
+
+    Methods:
+    --------
+    add_note(note_lines):
+        Counts the lines of a note, or of one record of a note.
+    merge(other):
+        Adds the counts of another Circulation object.
+    top_titles(limit=10):
+        Returns the most borrowed titles with their counts.
+    top_borrowers(limit=10):
+        Returns the borrowers with the most loans, with their loans and books.
+    months():
+        Returns the loans, books, fees, fines and revenue of every month, oldest first.
+    """
+
+    def __init__(self):
+        """
+        Constructor for the Circulation object.
+        """
+        self.titles = Counter()
+        self.borrower_loans = Counter()
+        self.borrower_books = Counter()
+        self.loans = Counter()
+        self.books = Counter()
+        self.fees = Counter()
+        self.fines = Counter()
+        self.skipped = 0
+
+    def add_note(self, note_lines: list[str]):
+        """
+        Counts the lines of a note, or of one record of a note.
+
+        A note is counted as a loan if it has BORROW lines, so the borrow and
+        return records of a note can be counted separately. Lines that can't
+        be read are counted as skipped.
+
+        Parameters:
+        -----------
+        note_lines : list[str]
+            BORROW and RETURN lines in the notes file format.
+        """
+        borrower = None
+        for line in note_lines:
+            try:
+                if line.startswith("BORROW:"):
+                    # name,book name,borrowed date,return date,price, split from the right as old names may have commas.
+                    name, title, borroweddate, _, price = line[7:].rsplit(",", 4)
+                    price = float(price)
+                elif line.startswith("RETURN:"):
+                    # name,returned date,late days,final cost
+                    _, returneddate, late_days, _ = line[7:].rsplit(",", 3)
+                    fine = max(int(late_days), 0) * FINE_PER_DAY
+                else:
+                    continue
+            except ValueError:
+                # Leaving out a damaged line, the rest of the note is still counted.
+                self.skipped += 1
+                continue
+            if line.startswith("BORROW:"):
+                # Dates are in the ISO format, so the month is the first 7 characters.
+                month = borroweddate[:7]
+                borrower = name.strip().title()
+                self.titles[title] += 1
+                self.borrower_books[borrower] += 1
+                self.books[month] += 1
+                self.fees[month] += price
+            else:
+                self.fines[returneddate[:7]] += fine
+        if borrower is not None:
+            self.borrower_loans[borrower] += 1
+            self.loans[month] += 1
+
+    def merge(self, other):
+        """
+        Adds the counts of another Circulation object.
+
+        Parameters:
+        -----------
+        other : Circulation
+            counts of another chunk.
+        """
+        for name in ("titles", "borrower_loans", "borrower_books", "loans", "books", "fees", "fines"):
+            getattr(self, name).update(getattr(other, name))
+        self.skipped += other.skipped
+
+    def top_titles(self, limit: int = 10) -> list[tuple[str, int]]:
+        """
+        Returns the most borrowed titles with their counts.
+
+        Parameters:
+        -----------
+        limit : int, optional
+            maximum number of titles.
+        """
+        return self.titles.most_common(limit)
+
+    def top_borrowers(self, limit: int = 10) -> list[tuple[str, int, int]]:
+        """
+        Returns the borrowers with the most loans, with their loans and books.
+
+        Parameters:
+        -----------
+        limit : int, optional
+            maximum number of borrowers.
+        """
+        return [(borrower, loans, self.borrower_books[borrower])
+                for borrower, loans in self.borrower_loans.most_common(limit)]
+
+    def months(self) -> list[dict]:
+        """
+        Returns the loans, books, fees, fines and revenue of every month, oldest first.
+        """
+        rows = []
+        for month in sorted(set(self.loans) | set(self.fines)):
+            fees = self.fees[month]
+            fines = self.fines[month]
+            rows.append({"month": month, "loans": self.loans[month], "books": self.books[month],
+                         "fees": fees, "fines": fines, "revenue": fees + fines})
+        return rows
+
+
+def record_chunks(storage: str) -> list[tuple]:
+    """
+    Returns the chunks of the loan records of the storage backend, for count_chunk.
+
+    Parameters:
+    -----------
+    storage : str
+        text, sqlite or log, same as LMS_STORAGE.
+
+    Returns:
+    --------
+    chunks : list[tuple]
+        ("directory", path), ("files", paths), ("segment", path, start, stop) or ("loans", first, last).
+    """
+    chunks = []
+    if storage == "sqlite":
+        from sqlitestore import DB_PATH
+        db = sqlite3.connect(DB_PATH)
+        last = db.execute("SELECT max(rowid) FROM loans").fetchone()[0] or 0
+        db.close()
+        chunks += [("loans", DB_PATH, first, first + LOANS_CHUNK - 1) for first in range(1, last + 1, LOANS_CHUNK)]
+    elif storage == "log":
+        from loanlog import segments, segmentpath
+        for segment in segments():
+            path = segmentpath(segment)
+            size = os.path.getsize(path)
+            chunks += [("segment", path, start, start + SEGMENT_CHUNK) for start in range(0, size, SEGMENT_CHUNK)]
+    else:
+        from notesmanager import NOTES_DIR
+        files = []
+        with os.scandir(NOTES_DIR) as entries:
+            for entry in entries:
+                # Each shard directory is walked by a worker.
+                if entry.is_dir():
+                    chunks.append(("directory", entry.path))
+                elif entry.name.endswith(".data"):
+                    files.append(entry.path)
+        # Notes files left in the flat layout.
+        chunks += [("files", files[start:start + FILES_CHUNK]) for start in range(0, len(files), FILES_CHUNK)]
+    return chunks
+
+
+def count_chunk(chunk: tuple) -> Circulation:
+    """
+    Returns the counts of a chunk of the loan records, in a worker.
+
+    Parameters:
+    -----------
+    chunk : tuple
+        chunk returned by record_chunks.
+    """
+    counts = Circulation()
+    kind = chunk[0]
+    if kind == "directory":
+        for directory, _, filenames in os.walk(chunk[1]):
+            for filename in filenames:
+                if filename.endswith(".data"):
+                    count_file(counts, os.path.join(directory, filename))
+    elif kind == "files":
+        for path in chunk[1]:
+            count_file(counts, path)
+    elif kind == "segment":
+        _, path, start, stop = chunk
+        with open(path, "rb") as segment_file:
+            # The record going over the start belongs to the previous chunk.
+            segment_file.seek(max(start - 1, 0))
+            offset = start
+            if start > 0:
+                offset = start - 1 + len(segment_file.readline())
+            while offset < stop:
+                line = segment_file.readline()
+                if not line:
+                    break
+                offset += len(line)
+                # Skipping the records torn by a crash, same as loanlog.iterrecords.
+                try:
+                    record = json.loads(line) if line.endswith(b"\n") else None
+                except ValueError:
+                    record = None
+                if isinstance(record, dict) and isinstance(record.get("data"), str):
+                    counts.add_note(record["data"].splitlines())
+                elif line.endswith(b"\n"):
+                    # A complete line that isn't a record.
+                    counts.skipped += 1
+    elif kind == "loans":
+        _, path, first, last = chunk
+        db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        rows = db.execute(
+            "SELECT loan_lines.noteid, line FROM loans JOIN loan_lines ON loan_lines.noteid = loans.noteid "
+            "WHERE loans.rowid BETWEEN ? AND ? ORDER BY loans.rowid, line_no", (first, last))
+        noteid = None
+        note_lines = []
+        for row_noteid, line in rows:
+            if row_noteid != noteid:
+                counts.add_note(note_lines)
+                noteid, note_lines = row_noteid, []
+            note_lines.append(line)
+        counts.add_note(note_lines)
+        db.close()
+    return counts
+
+
+def count_file(counts: Circulation, path: str):
+    """
+    Counts a notes file, skipping it if it was removed meanwhile.
+
+    Parameters:
+    -----------
+    counts : Circulation
+        counts to add to.
+    path : str
+        path of the notes file.
+    """
+    try:
+        with open(path, "r") as notes_file:
+            counts.add_note(notes_file.read().splitlines())
+    except FileNotFoundError:
+        pass
+    except UnicodeDecodeError:
+        # A file that isn't text is left out as a whole.
+        counts.skipped += 1
+
+
+def circulation_report(storage: str = None, workers: int = None) -> Circulation:
+    """
+    Returns the counts of all the loan records, counted in a process pool.
+
+    The notes being moved by notesmanager.migratenotes can be counted twice,
+    so the report is best run when no migration is going on.
+
+    Parameters:
+    -----------
+    storage : str, optional
+        text, sqlite or log, LMS_STORAGE by default.
+    workers : int, optional
+        number of worker processes, the number of CPUs by default.
+
+    Returns:
+    --------
+    counts : Circulation
+        merged counts of all the chunks.
+    """
+    if storage is None:
+        storage = os.environ.get("LMS_STORAGE", "text")
+    counts = Circulation()
+    with ProcessPoolExecutor(workers) as executor:
+        for chunk_counts in executor.map(count_chunk, record_chunks(storage)):
+            counts.merge(chunk_counts)
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report the most borrowed titles, busiest borrowers and revenue.")
+    parser.add_argument("--limit", type=int, default=10, help="number of titles and borrowers to report")
+    parser.add_argument("--workers", type=int, help="worker processes (number of CPUs by default)")
+    parser.add_argument("--csv", help="CSV file for the revenue per month instead of the table")
+    args = parser.parse_args()
+    counts = circulation_report(workers=args.workers)
+    heading = f"|{'Book Name':<50}|{'Borrowed':<10}|"
+    rows = (f"|{title:<50}|{borrowed:<10}|" for title, borrowed in counts.top_titles(args.limit))
+    print_table("Most borrowed titles", heading, rows)
+    heading = f"|{'Borrower':<30}|{'Loans':<10}|{'Books':<10}|"
+    rows = (f"|{borrower:<30}|{loans:<10}|{books:<10}|"
+            for borrower, loans, books in counts.top_borrowers(args.limit))
+    print_table("Busiest borrowers", heading, rows)
+    months = counts.months()
+    if args.csv:
+        with open(args.csv, "w", newline="") as report_file:
+            writer = csv.DictWriter(report_file, MONTH_FIELDS)
+            writer.writeheader()
+            writer.writerows(months)
+    else:
+        heading = f"|{'Month':<10}|{'Loans':<10}|{'Books':<10}|{'Fees':<12}|{'Fines':<12}|{'Revenue':<12}|"
+        rows = (f"|{month['month']:<10}|{month['loans']:<10}|{month['books']:<10}|{month['fees']:<12.2f}|"
+                f"{month['fines']:<12.2f}|{month['revenue']:<12.2f}|" for month in months)
+        print_table("Revenue per month", heading, rows)
+    print(f"{sum(counts.loans.values())} loans, Rs.{sum([month['revenue'] for month in months]):.2f} revenue.",
+          file=sys.stderr)
+    if counts.skipped:
+        print(f"WARNING! Skipped {counts.skipped} damaged lines or records.", file=sys.stderr)
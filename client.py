@@ -0,0 +1,211 @@
+"""
+Front desk client for the Library service in server.py.
+
+Usage: python client.py [--host 127.0.0.1] [--port 8765] [--unix path]
+"""
+import json
+import socket
+import argparse
+from datetime import datetime
+from extras import print_table
+from input_funcs import get_login_menu, get_main_menu
+from server import HOST, PORT, LIST_LIMIT
+
+
+class LibraryClient:
+    """
+    A class to represent a connection to the Library service.
+
+    Attributes:
+    -----------
+    connection : socket.socket
+        connection to the service.
+    stream : file
+        buffered file over the connection.
+
+    Methods:
+    --------
+    request(action, **fields):
+        Sends a request and returns the response.
+    list_books(available=False):
+        Prints all the books, or the available ones.
+    choose_book():
+        Returns the ID of the book picked by the user.
+    borrow_book():
+        Creates a borrow record on the service.
+    return_book():
+        Creates a return record on the service.
+    close():
+        Closes the connection.
+    """
+
+    def __init__(self, host: str = HOST, port: int = PORT, unix: str = None):
+        """
+        Constructor for the LibraryClient object.
+
+        Parameters:
+        -----------
+        host : str, optional
+            address of the service.
+        port : int, optional
+            TCP port of the service.
+        unix : str, optional
+            Unix socket path of the service, used instead of TCP.
+        """
+        if unix:
+            self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.connection.connect(unix)
+        else:
+            self.connection = socket.create_connection((host, port))
+        self.stream = self.connection.makefile("rwb")
+
+    def request(self, action: str, **fields) -> dict:
+        """
+        Sends a request and returns the response.
+
+        Parameters:
+        -----------
+        action : str
+            action of the request.
+        **fields
+            other keys of the request.
+
+        Returns:
+        --------
+        response : dict
+            response of the service.
+        """
+        self.stream.write(json.dumps({"action": action, **fields}).encode() + b"\n")
+        self.stream.flush()
+        line = self.stream.readline()
+        if not line:
+            raise ConnectionError("The service closed the connection.")
+        return json.loads(line)
+
+    def list_books(self, available: bool = False):
+        """
+        Prints all the books, or the available ones.
+
+        Parameters:
+        -----------
+        available : bool, optional
+            Boolean value to only list the books with remaining stock.
+        """
+        heading = f"|{'Book ID':<10}|{'Book Name':<50}|{'Author':<20}|{'Remaining':<10}|{'Price':<10}|"
+
+        def rows():
+            offset = 0
+            while True:
+                response = self.request("list", available=available, offset=offset, limit=LIST_LIMIT)
+                for book in response["books"]:
+                    yield (f"|{book['lib_id']:<10}|{book['name']:<50}|{book['author']:<20}|"
+                           f"{book['remaining']:<10}|{book['price']:<10}|")
+                offset += len(response["books"])
+                if not response["books"] or offset >= response["total"]:
+                    break
+        title = "Available books to borrow in the Library" if available else "Books in the Library"
+        print_table(title, heading, rows())
+
+    def choose_book(self) -> str:
+        """
+        Returns the ID of the book picked by the user, or None.
+        """
+        bookarg = input("Enter the book name or ID: ")
+        response = self.request("search", query=bookarg)
+        if response["exact"]:
+            return response["books"][0]["lib_id"]
+        # Asking the user for confirmation on each suggestion, best first.
+        for book in response["books"]:
+            option = input(f"Did you mean {book['name']}? (Y/N): ").upper()
+            if option == "Y":
+                return book["lib_id"]
+        print("Please make sure the book name is correct.")
+        return None
+
+    def borrow_book(self):
+        """
+        Creates a borrow record on the service.
+        """
+        name = input("Enter the name of the borrower: ").lower().title()
+        bookids = []
+        while True:
+            bookid = self.choose_book()
+            if bookid in bookids:
+                print("The book has already been added to borrow list. Please use a different one.")
+            elif bookid is not None:
+                bookids.append(bookid)
+            option = input("Do you want to add more books? (Y/N): ").upper()
+            if option != "Y":
+                break
+        if not bookids:
+            print("No books were added to the borrow list.")
+            return
+        response = self.request("borrow", borrower=name, books=bookids)
+        if response["status"] == "ok":
+            print(response["invoice"])
+        else:
+            print(f"ERROR! {response['message']}")
+
+    def return_book(self):
+        """
+        Creates a return record on the service.
+        """
+        name = input("Enter the name of the borrower: ")
+        noteids = self.request("notes", borrower=name)["noteids"]
+        if not noteids:
+            print(f"No borrow notes were found for {name}. Please make sure that the name is spelled correctly.")
+            return
+        noteid = noteids[0]
+        if len(noteids) > 1:
+            print(f"{'S.No.':<6}Date")
+            for index, noteid in enumerate(noteids):
+                date = datetime.fromtimestamp(float(noteid.rsplit("-", 1)[1]))
+                print(f"{index+1:<6}{date.strftime('%A, %B %d, %Y %H:%M')}")
+            while True:
+                try:
+                    noteid = noteids[int(input(
+                        "Which transaction would you like to add return record for (Use S.No.)?: ")) - 1]
+                    break
+                except (ValueError, IndexError):
+                    print("Please enter correct value from the S.No.")
+        response = self.request("return", noteid=noteid)
+        if response["status"] == "ok":
+            print(response["invoice"])
+        else:
+            print(f"ERROR! {response['message']}")
+
+    def close(self):
+        """
+        Closes the connection.
+        """
+        self.stream.close()
+        self.connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Front desk client for the Library service.")
+    parser.add_argument("--host", default=HOST, help=f"address of the service (default {HOST})")
+    parser.add_argument("--port", type=int, default=PORT, help=f"TCP port (default {PORT})")
+    parser.add_argument("--unix", help="Unix socket path of the service")
+    args = parser.parse_args()
+    username = get_login_menu()
+    client = LibraryClient(args.host, args.port, args.unix)
+    print(f"Hello, {username}! Welcome to the Library's Main Menu.")
+    while True:
+        option = get_main_menu()
+        if option == "1":
+            client.list_books(available=True)
+        elif option == "2":
+            client.borrow_book()
+        elif option == "3":
+            client.return_book()
+        elif option == "7":
+            client.list_books()
+        elif option == "8":
+            print("The database is saved by the service.")
+        elif option in ("9", "exit"):
+            break
+        else:
+            print("This option is only available on the main terminal (main.py).")
+    client.close()
+    print("Exited successfully.")
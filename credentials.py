@@ -0,0 +1,238 @@
+"""
+Salted password hashes of the Library users, loaded once into a dict keyed by username.
+
+Credentials format:
+-------------------
+username,scrypt$n$r$p$salt$hash -> salt and hash in hex
+username,pbkdf2_sha256$iterations$salt$hash -> where hashlib has no scrypt
+
+Users are added or changed by appending a line, and the later line of a user wins.
+The plain text passwords of data/passwords.txt are imported on first use,
+after which data/passwords.txt should be deleted, as it still has them in plain text.
+
+Usage: python credentials.py import accounts.csv [--workers 4]
+       python credentials.py add username
+"""
+import os
+import sys
+import csv
+import hmac
+import getpass
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from errors import InvalidUsername
+
+# File keeping the password hashes.
+CREDENTIALS_PATH = "./data/credentials.txt"
+# Plain text passwords used before, username,password entries separated by "|".
+LEGACY_PATH = "./data/passwords.txt"
+# Cost of the hashes: scrypt takes about 16 MiB and 80 ms per hash.
+SCRYPT_PARAMS = {"n": 2 ** 14, "r": 8, "p": 1}
+PBKDF2_ITERATIONS = 600000
+SALT_SIZE = 16
+# Accounts hashed by a worker at once when importing.
+IMPORT_CHUNK = 64
+# In memory copy of the credentials, loaded on first use.
+credentials = None
+
+
+def hashpassword(password: str, salt: bytes = None) -> str:
+    """
+    Returns the salted hash of the password, with its scheme and parameters.
+
+    Parameters:
+    -----------
+    password : str
+        password to hash.
+    salt : bytes, optional
+        salt of the hash, random by default.
+    """
+    if salt is None:
+        salt = os.urandom(SALT_SIZE)
+    if hasattr(hashlib, "scrypt"):
+        digest = hashlib.scrypt(password.encode(), salt=salt, **SCRYPT_PARAMS)
+        return (f"scrypt${SCRYPT_PARAMS['n']}${SCRYPT_PARAMS['r']}${SCRYPT_PARAMS['p']}"
+                f"${salt.hex()}${digest.hex()}")
+    # hashlib.scrypt needs OpenSSL 1.1 or later.
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, PBKDF2_ITERATIONS)
+    return f"pbkdf2_sha256${PBKDF2_ITERATIONS}${salt.hex()}${digest.hex()}"
+
+
+def verifypassword(password: str, stored: str) -> bool:
+    """
+    Returns True if the password matches the stored hash.
+
+    Parameters:
+    -----------
+    password : str
+        password to check.
+    stored : str
+        hash saved by hashpassword.
+    """
+    scheme, *params = stored.split("$")
+    if scheme == "scrypt":
+        n, r, p, salt, expected = params
+        digest = hashlib.scrypt(password.encode(), salt=bytes.fromhex(salt), n=int(n), r=int(r), p=int(p))
+    elif scheme == "pbkdf2_sha256":
+        iterations, salt, expected = params
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode(), bytes.fromhex(salt), int(iterations))
+    else:
+        return False
+    # Comparing in constant time.
+    return hmac.compare_digest(digest.hex(), expected)
+
+
+def loadcredentials() -> dict:
+    """
+    Returns the password hashes keyed by username, reading only the lines added since the last call.
+
+    Returns:
+    --------
+    credentials : dict[str, str]
+        hash of each user.
+    """
+    global credentials
+    # Importing the plain text passwords the first time.
+    if not os.path.isfile(CREDENTIALS_PATH):
+        if os.path.isfile(LEGACY_PATH):
+            importusers(readlegacy())
+            print(f"Imported the passwords of {LEGACY_PATH}, please delete it now.", file=sys.stderr)
+        else:
+            importusers([])
+    size = os.path.getsize(CREDENTIALS_PATH)
+    if credentials is None or size < credentials["offset"]:
+        credentials = {"users": {}, "offset": 0}
+    if size > credentials["offset"]:
+        with open(CREDENTIALS_PATH, "rb") as credentials_file:
+            credentials_file.seek(credentials["offset"])
+            lines = credentials_file.read()
+        # Leaving a partially written last line for the next read.
+        complete = lines.rfind(b"\n") + 1
+        credentials["offset"] += complete
+        for line in lines[:complete].decode().splitlines():
+            username, stored = line.rsplit(",", 1)
+            credentials["users"][username] = stored
+    return credentials["users"]
+
+
+def readlegacy(path: str = LEGACY_PATH) -> list[tuple[str, str]]:
+    """
+    Returns the usernames and passwords of the plain text passwords file.
+
+    Parameters:
+    -----------
+    path : str, optional
+        file with username,password entries separated by "|" or line breaks.
+    """
+    with open(path, "r") as pw_file:
+        entries = pw_file.read().replace("\n", "|").split("|")
+    accounts = []
+    for number, entry in enumerate(entries, 1):
+        entry = entry.strip()
+        if not entry:
+            continue
+        # Skipping the entries without a password, not printed as they may be one.
+        if "," not in entry:
+            print(f"WARNING! Skipped entry {number} of {path}, it has no comma.", file=sys.stderr)
+            continue
+        username, password = entry.split(",", 1)
+        # Skipping the usernames importusers would refuse, as one bad entry would stop the whole import.
+        try:
+            checkusername(username)
+        except InvalidUsername:
+            print(f"WARNING! Skipped entry {number} of {path}, its username is invalid.", file=sys.stderr)
+            continue
+        accounts.append((username, password))
+    return accounts
+
+
+def checkusername(username: str):
+    """
+    Raises InvalidUsername if the username can't be saved.
+
+    Parameters:
+    -----------
+    username : str
+        username to check.
+    """
+    if not username or "," in username or "\n" in username or username != username.strip():
+        raise InvalidUsername(username, "Usernames can't be empty or contain commas, line breaks or outer spaces.")
+
+
+def adduser(username: str, password: str):
+    """
+    Adds a user, or changes the password of an existing one.
+
+    Parameters:
+    -----------
+    username : str
+        username of the user.
+    password : str
+        password of the user.
+    """
+    importusers([(username, password)])
+
+
+def hashaccounts(accounts: list) -> list[str]:
+    """
+    Returns the credentials lines of the accounts, in an import worker.
+
+    Parameters:
+    -----------
+    accounts : list[tuple[str, str]]
+        username and password of each account.
+    """
+    return [f"{username},{hashpassword(password)}\n" for username, password in accounts]
+
+
+def importusers(accounts: list, workers: int = None) -> int:
+    """
+    Adds the users and returns their number, hashing the passwords with a process pool.
+
+    All the lines are appended in one write after hashing, so the credentials
+    file never has part of an import. A single account is hashed in this process.
+
+    Parameters:
+    -----------
+    accounts : list[tuple[str, str]]
+        username and password of each account, later accounts win.
+    workers : int, optional
+        number of worker processes, the number of CPUs by default.
+
+    Raises:
+    -------
+    InvalidUsername
+        If a username can't be saved, before anything is written.
+    """
+    for username, _ in accounts:
+        checkusername(username)
+    if len(accounts) <= 1:
+        lines = hashaccounts(accounts)
+    else:
+        chunks = [accounts[start:start + IMPORT_CHUNK] for start in range(0, len(accounts), IMPORT_CHUNK)]
+        with ProcessPoolExecutor(workers) as executor:
+            lines = [line for chunk in executor.map(hashaccounts, chunks) for line in chunk]
+    with open(CREDENTIALS_PATH, "a") as credentials_file:
+        credentials_file.write("".join(lines))
+    return len(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the Library users.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    bulk = commands.add_parser("import", help="import accounts from a username,password CSV file")
+    bulk.add_argument("path", help="CSV file with a username,password header")
+    bulk.add_argument("--workers", type=int, help="worker processes (number of CPUs by default)")
+    single = commands.add_parser("add", help="add a user or change a password")
+    single.add_argument("username", help="username of the user")
+    args = parser.parse_args()
+    # Creating the credentials from the old passwords file first, so that it isn't imported later.
+    loadcredentials()
+    if args.command == "import":
+        with open(args.path, newline="") as accounts_file:
+            accounts = [(row["username"], row["password"]) for row in csv.DictReader(accounts_file)]
+        print(f"Imported {importusers(accounts, args.workers)} users to {CREDENTIALS_PATH}.")
+    else:
+        adduser(args.username, getpass.getpass("Password: "))
+        print(f"Saved the password of {args.username}.")
@@ -10,8 +10,17 @@ class NoMoreStocks(BookError):
 class StockFull(BookError):
     pass
 
+class BookNotFound(BookError):
+    pass
+
+class NoteNotFound(Exception):
+    pass
+
 class NoTerminalFound(Exception):
     pass
 
 class FileDoesNotExist(Exception):
+    pass
+
+class InvalidUsername(Exception):
     pass
\ No newline at end of file
@@ -1,13 +1,72 @@
+import sys
+from itertools import islice
 from os import get_terminal_size
 from errors import NoTerminalFound
 
-def get_terminal_columns() -> int:
+# Columns used when the output isn't a terminal.
+DEFAULT_COLUMNS = 120
+# Rows written to the output at once by print_table.
+ROWS_PER_WRITE = 1000
+
+def get_terminal_columns(fallback: int = None) -> int:
     """
     Returns the total columns in the terminal.
     Used for centering texts.
+
+    Parameters:
+    -----------
+    fallback : int, optional
+        columns to return when there is no terminal, raises NoTerminalFound if None.
     """
     try:
         #Gets the columns attribute of terminal size from the os module.
         return get_terminal_size().columns
     except OSError:
-        raise NoTerminalFound("Please run the script in a terminal") #An error in case the script isn't running in a terminal
\ No newline at end of file
+        if fallback is not None:
+            return fallback
+        raise NoTerminalFound("Please run the script in a terminal") #An error in case the script isn't running in a terminal
+
+def print_table(title: str, heading: str, rows, page_size: int = None, offset: int = 0, output=None) -> int:
+    """
+    Prints a centered table with the rows written in large chunks.
+    Returns the number of rows printed.
+
+    The terminal size is looked up once, so this also works when the output isn't a terminal.
+
+    Parameters:
+    -----------
+    title : str
+        title printed above the table.
+    heading : str
+        heading row of the table, also used for the width of the separators.
+    rows : iterable of str
+        rows of the table.
+    page_size : int, optional
+        maximum number of rows to print, all of them if None.
+    offset : int, optional
+        number of rows to skip before printing.
+    output : file, optional
+        file to print to, sys.stdout by default.
+    """
+    if output is None:
+        output = sys.stdout
+    # Computing the layout once for the whole table.
+    columns = get_terminal_columns(DEFAULT_COLUMNS)
+    width = max(columns, len(heading))
+    padding = " " * ((width - len(heading)) // 2)
+    separator = padding + "-" * len(heading) + "\n"
+    output.write(title.center(columns).rstrip() + "\n")
+    output.write(separator + padding + heading + "\n")
+    stop = None if page_size is None else offset + page_size
+    page = islice(rows, offset, stop)
+    printed = 0
+    # Writing the rows in chunks instead of one print per row.
+    while True:
+        chunk = [padding + row + "\n" for row in islice(page, ROWS_PER_WRITE)]
+        if not chunk:
+            break
+        output.write("".join(chunk))
+        printed += len(chunk)
+    output.write(separator)
+    output.flush()
+    return printed
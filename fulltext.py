@@ -0,0 +1,234 @@
+import re
+from bisect import bisect_left
+from heapq import nsmallest
+
+# Fields of a book covered by the index.
+TEXT_FIELDS = ("name", "author", "publisher")
+# Splits the text into words.
+WORD_PATTERN = re.compile(r"\w+")
+
+
+class TextIndex:
+    """
+    A class to represent an inverted word index over the names, authors and publishers of the books.
+
+    A query matches the books having all of its words. A word ending with "*"
+    matches as a prefix, and "name:", "author:" or "publisher:" before a word
+    only matches it in that field, like "author:rowl* potter".
+
+    Attributes:
+    -----------
+    postings : dict[str, dict[str, set[Book]]]
+        Books having each word, keyed by the word and then by the field.
+    words : list[str]
+        Indexed words in sorted order, for the prefix lookups.
+    unsorted : set[str]
+        Words added since the words were last sorted.
+    stale : int
+        Words of the sorted list without postings anymore.
+
+    Methods:
+    --------
+    add(book):
+        Adds a book to the index.
+    remove(book):
+        Removes a book from the index.
+    sorted_words():
+        Returns the indexed words in sorted order.
+    expand(prefix):
+        Returns all the indexed words starting with the prefix.
+    complete(prefix, limit=10):
+        Returns the indexed words starting with the prefix, in sorted order.
+    search(query):
+        Returns the books matching all the words of the query.
+    """
+
+    def __init__(self, books: list = None):
+        """
+        Constructor for the TextIndex object.
+
+        Parameters:
+        -----------
+        books : list[Book], optional
+            Books to be indexed initially.
+        """
+        self.postings: dict[str, dict[str, set]] = {}
+        self.words: list[str] = []
+        self.unsorted: set[str] = set()
+        self.stale = 0
+        if books is not None:
+            for book in books:
+                self.add(book)
+
+    def add(self, book):
+        """
+        Adds a book to the index.
+
+        Parameters:
+        -----------
+        book : Book
+            Book object to be indexed.
+        """
+        for field in TEXT_FIELDS:
+            for word in WORD_PATTERN.findall(getattr(book, field).casefold()):
+                fields = self.postings.get(word)
+                if fields is None:
+                    fields = self.postings[word] = {}
+                    # A word removed earlier may still be in the sorted list.
+                    position = bisect_left(self.words, word)
+                    if position < len(self.words) and self.words[position] == word:
+                        self.stale -= 1
+                    else:
+                        self.unsorted.add(word)
+                books = fields.get(field)
+                if books is None:
+                    books = fields[field] = set()
+                books.add(book)
+
+    def remove(self, book):
+        """
+        Removes a book from the index.
+
+        Parameters:
+        -----------
+        book : Book
+            Book object to be removed.
+        """
+        for field in TEXT_FIELDS:
+            for word in WORD_PATTERN.findall(getattr(book, field).casefold()):
+                fields = self.postings.get(word, {})
+                books = fields.get(field)
+                if books is None:
+                    continue
+                books.discard(book)
+                if books:
+                    continue
+                del fields[field]
+                if fields:
+                    continue
+                del self.postings[word]
+                # The sorted words are only cleaned up on the next sort.
+                if word in self.unsorted:
+                    self.unsorted.discard(word)
+                else:
+                    self.stale += 1
+
+    def sorted_words(self) -> list[str]:
+        """
+        Returns the indexed words in sorted order, sorting the words added since the last call.
+        """
+        if self.unsorted or self.stale > len(self.words) // 2:
+            words = self.words
+            if self.stale:
+                words = [word for word in words if word in self.postings]
+            # The words are mostly sorted already, which sorted() merges quickly.
+            self.words = sorted(words + list(self.unsorted))
+            self.unsorted = set()
+            self.stale = 0
+        return self.words
+
+    def expand(self, prefix: str) -> list[str]:
+        """
+        Returns all the indexed words starting with the prefix.
+
+        Parameters:
+        -----------
+        prefix : str
+            Normalized start of the words.
+        """
+        return self.complete(prefix, None)
+
+    def complete(self, prefix: str, limit: int = 10) -> list[str]:
+        """
+        Returns the indexed words starting with the prefix, in sorted order.
+
+        Parameters:
+        -----------
+        prefix : str
+            Start of the words.
+        limit : int, optional
+            Maximum number of words to return, all of them if None.
+
+        Returns:
+        --------
+        words : list[str]
+            Matching words.
+        """
+        words = self.sorted_words()
+        prefix = prefix.casefold()
+        matches = []
+        for position in range(bisect_left(words, prefix), len(words)):
+            word = words[position]
+            if len(matches) == limit or not word.startswith(prefix):
+                break
+            # Skipping the removed words still in the sorted list.
+            if word in self.postings:
+                matches.append(word)
+        return matches
+
+    def search(self, query: str) -> set:
+        """
+        Returns the books matching all the words of the query.
+
+        The books of the words are intersected starting with the word having
+        the fewest books, so the sets stay as small as the rarest word.
+
+        Parameters:
+        -----------
+        query : str
+            Words to search for, with optional "*" prefixes and field names.
+
+        Returns:
+        --------
+        books : set[Book]
+            Books matching the query, none if the query has no words.
+
+        Raises:
+        -------
+        ValueError
+            If the query uses an unknown field.
+        """
+        terms = []
+        for token in query.split():
+            field, _, text = token.rpartition(":")
+            field = field.casefold()
+            if field and field not in TEXT_FIELDS:
+                raise ValueError(field, f"Unknown field, use one of {', '.join(TEXT_FIELDS)}.")
+            # A token like "j.k." has a word for each part.
+            for word in WORD_PATTERN.findall(text.casefold()):
+                words = self.expand(word) if text.endswith("*") else [word]
+                # Books of every matching word in the field, or in any field.
+                postings = [books for match in words for name, books in self.postings.get(match, {}).items()
+                            if not field or name == field]
+                terms.append(postings)
+        if not terms:
+            return set()
+        terms.sort(key=lambda postings: sum([len(books) for books in postings]))
+        books = set().union(*terms[0])
+        for postings in terms[1:]:
+            if not books:
+                break
+            if len(postings) == 1:
+                books &= postings[0]
+            else:
+                books &= set().union(*postings)
+        return books
+
+
+def rank_books(books, limit: int = None, offset: int = 0) -> list:
+    """
+    Returns the books sorted by name and ID, only sorting the requested page.
+
+    Parameters:
+    -----------
+    books : iterable of Book
+        books to sort.
+    limit : int, optional
+        maximum number of books to return, all of them if None.
+    offset : int, optional
+        number of books to skip.
+    """
+    key = lambda book: (book.name.casefold(), book.lib_id.casefold())
+    if limit is None:
+        return sorted(books, key=key)[offset:]
+    return nsmallest(offset + limit, books, key=key)[offset:]
@@ -0,0 +1,155 @@
+from heapq import nlargest
+from collections import Counter
+from difflib import SequenceMatcher
+
+# Trigrams in more names than this (or 5% of the names) are skipped when counting candidates.
+COMMON_POSTINGS = 1000
+
+
+class TrigramIndex:
+    """
+    A class to represent an inverted trigram index over book names.
+
+    Attributes:
+    -----------
+    postings : dict[str, set[str]]
+        Names containing each trigram, keyed by the trigram.
+    name_grams : dict[str, set[str]]
+        Trigrams of each indexed name, keyed by the name.
+    name_counts : dict[str, int]
+        Number of times each name was added to the index.
+
+    Methods:
+    --------
+    add(name):
+        Adds a name to the index.
+    remove(name):
+        Removes a name from the index.
+    search(query, limit=3, cutoff=0.6):
+        Returns the names most similar to the query, best match first.
+    """
+
+    def __init__(self, names: list[str] = None):
+        """
+        Constructor for the TrigramIndex object.
+
+        Parameters:
+        -----------
+        names : list[str], optional
+            Names to be indexed initially.
+        """
+        self.postings: dict[str, set[str]] = {}
+        self.name_grams: dict[str, set[str]] = {}
+        self.name_counts: dict[str, int] = {}
+        if names is not None:
+            for name in names:
+                self.add(name)
+
+    def add(self, name: str):
+        """
+        Adds a name to the index.
+
+        Parameters:
+        -----------
+        name : str
+            Normalized name to be indexed.
+        """
+        # Only counting the name again if it was already indexed.
+        if name in self.name_counts:
+            self.name_counts[name] += 1
+            return
+        self.name_counts[name] = 1
+        grams = get_trigrams(name)
+        self.name_grams[name] = grams
+        for gram in grams:
+            self.postings.setdefault(gram, set()).add(name)
+
+    def remove(self, name: str):
+        """
+        Removes a name from the index.
+
+        Parameters:
+        -----------
+        name : str
+            Normalized name to be removed.
+        """
+        if name not in self.name_counts:
+            return
+        self.name_counts[name] -= 1
+        # Keeping the postings while another book still has the name.
+        if self.name_counts[name] > 0:
+            return
+        del self.name_counts[name]
+        for gram in self.name_grams.pop(name):
+            names = self.postings[gram]
+            names.discard(name)
+            if not names:
+                del self.postings[gram]
+
+    def search(self, query: str, limit: int = 3, cutoff: float = 0.6) -> list[str]:
+        """
+        Returns the names most similar to the query, best match first.
+
+        Only the names sharing trigrams with the query are scored, and the
+        trigrams found in most names are left out when counting them.
+
+        Parameters:
+        -----------
+        query : str
+            Normalized name to search for.
+        limit : int, optional
+            Maximum number of names to return.
+        cutoff : float, optional
+            Minimum similarity ratio (0 to 1) for a name to be returned.
+
+        Returns:
+        --------
+        matches : list[str]
+            Matching names, best match first.
+        """
+        query_grams = get_trigrams(query)
+        postings = [self.postings[gram] for gram in query_grams if gram in self.postings]
+        # Skipping the trigrams common to a large share of the names (like " th"),
+        # unless the query has nothing rarer.
+        common_size = max(COMMON_POSTINGS, len(self.name_counts) // 20)
+        rare_postings = [names for names in postings if len(names) <= common_size]
+        if rare_postings:
+            postings = rare_postings
+        # Counting the shared trigrams for every candidate name.
+        shared = Counter()
+        for names in postings:
+            shared.update(names)
+        # Ranking the candidates by trigram (Jaccard) similarity.
+        candidates = nlargest(
+            max(limit * 10, 30), shared,
+            key=lambda name: shared[name] / (len(query_grams) + len(self.name_grams[name]) - shared[name]))
+        # Scoring only the best candidates with the same ratio as difflib.
+        matcher = SequenceMatcher()
+        matcher.set_seq2(query)
+        scored = []
+        for name in candidates:
+            matcher.set_seq1(name)
+            if matcher.real_quick_ratio() >= cutoff and matcher.quick_ratio() >= cutoff:
+                ratio = matcher.ratio()
+                if ratio >= cutoff:
+                    scored.append((ratio, name))
+        scored.sort(key=lambda match: match[0], reverse=True)
+        return [name for _, name in scored[:limit]]
+
+
+def get_trigrams(text: str) -> set[str]:
+    """
+    Returns the trigrams of the text, padded at both ends.
+
+    Parameters:
+    -----------
+    text : str
+        Text to split into trigrams.
+
+    Returns:
+    --------
+    trigrams : set[str]
+        Set of the three character substrings.
+    """
+    padded = f"  {text} "
+    return {padded[i:i+3] for i in range(len(padded) - 2)}
@@ -1,5 +1,6 @@
 from datetime import datetime
 from extras import get_terminal_columns
+from credentials import loadcredentials, verifypassword
 
 
 def get_login_menu():
@@ -12,31 +13,22 @@ def get_login_menu():
     # A welcome message to print in the center.
     print("Welcome to Utsav's Library Management System.".center(columns))
     print("Please enter your login credentials:")  # Login Creds input.
-    # Loading the file containing all the passwords.
-    with open("./data/passwords.txt", "r") as pw_file:
-        pws = pw_file.read().split("|")  # Splitting the passwords.
     while True:
         # Asking the user to input username and password.
         username = input("Username: ")
         password = input("Password: ")
-
-        # Looping through all the usernames and passwords saved.
-        for pass_line in pws:
-            # Splitting the string to username and password.
-            user, pw = pass_line.split(",")
-            if user == username:  # A check if the username matches.
-                if password == pw:  # A check if the password matched.
-                    # Printing login success message
-                    print("Login successful.")
-                    # Returning the username that was used for login.
-                    return username
-                else:
-                    # Error message if the password was wrong.
-                    print("ERROR! Invalid Password.")
-                    break
-            # A check if the object was last in the list.
-            elif pws.index(pass_line) == (len(pws) - 1):
-                print("ERROR! User Not Found.")
+        # Looking up the user's password hash, with the users added since the last attempt.
+        stored = loadcredentials().get(username)
+        if stored is None:
+            print("ERROR! User Not Found.")
+        elif verifypassword(password, stored):  # A check if the password matched.
+            # Printing login success message
+            print("Login successful.")
+            # Returning the username that was used for login.
+            return username
+        else:
+            # Error message if the password was wrong.
+            print("ERROR! Invalid Password.")
 
 
 def get_main_menu():
@@ -56,11 +48,13 @@ Options:
 7: Display all the books in the database.
 8: Save the book stocks manually.
 9 or exit: To exit the management system.
+10: Show the stock report.
+11: Search the books by title, author or publisher.
 """
     # Printing the text.
     print(main_menu_text)
     # A list of all valid options
-    valid_options_list = ["1", "2", "3", "4", "5", "6", "7", "8", "9", "exit"]
+    valid_options_list = ["1", "2", "3", "4", "5", "6", "7", "8", "9", "exit", "10", "11"]
     # A infinite loop for getting correct input
     while True:
         # Asking the user to enter an option
@@ -86,7 +80,7 @@ def get_book_details_input():
         pub_date = input("Enter the book's published date (YYYY): ")
         try:
             # A check for valid date. This won't store value since I want it as a string.
-            datetime.strptime(pub_date, "%Y")
+            validate_pub_date(pub_date)
             break  # Breaks if the date is in proper format
         except ValueError:
             # Loops around if it is wrong.
@@ -115,3 +109,21 @@ def get_book_details_input():
             continue
 
     return bookname, author, publisher, pub_date, total, price
+
+
+def validate_pub_date(pub_date: str) -> str:
+    """
+    Returns the published date if it is a valid year (YYYY).
+
+    Parameters:
+    -----------
+    pub_date : str
+        published date of the book.
+
+    Raises:
+    -------
+    ValueError
+        If the date isn't a valid year.
+    """
+    datetime.strptime(pub_date, "%Y")
+    return pub_date
@@ -0,0 +1,373 @@
+"""
+Opt-in timing and I/O counters for the Library.
+
+Set the LMS_METRICS environment variable to enable it when running main.py:
+LMS_METRICS=1 prints a latency summary on exit, and any other value is used
+as the path of a JSON metrics file written on exit.
+
+The SQLite backend is timed, but its I/O isn't counted, as sqlite3 reads
+and writes the database itself instead of through open().
+"""
+import os
+import sys
+import json
+import math
+import time
+import atexit
+import builtins
+import threading
+import functools
+from lrucache import notes_caches
+
+# Library methods that are timed.
+LIBRARY_METHODS = ["borrow_book", "return_book", "available_books", "show_all_books", "add_book",
+                   "remove_book", "print_notes", "create_notes", "savebookdb", "borrow_books",
+                   "return_books"]
+# Storage modules whose public functions are timed and whose file I/O is counted.
+# Only the migration of sqlitestore opens files, the database I/O isn't counted.
+STORAGE_MODULES = ["libraryfs", "notesmanager", "loanlog", "sqlitestore", "storage"]
+
+# Metrics being recorded, None until enable() is called.
+metrics = None
+# Time spent blocked in input() by the current thread.
+blocked = threading.local()
+# The builtin input(), replaced by timed_input() while enabled.
+original_input = builtins.input
+
+
+class Metrics:
+    """
+    A class to represent the recorded timings and I/O counters.
+
+    Attributes:
+    -----------
+    operations : dict[str, dict]
+        calls, total seconds, max seconds and histogram of each operation.
+    io : dict[str, int]
+        bytes read, bytes written and files opened.
+
+    The hit and miss statistics of the notes caches are added to the report.
+
+    Methods:
+    --------
+    record(name, seconds):
+        Records a call of the operation.
+    count_io(read=0, written=0, opened=0):
+        Adds to the I/O counters.
+    to_dict():
+        Returns the metrics with the estimated percentiles.
+    summary():
+        Returns the metrics as a text table.
+    """
+
+    def __init__(self):
+        """
+        Constructor for the Metrics object.
+        """
+        self.operations = {}
+        self.io = {"bytes_read": 0, "bytes_written": 0, "files_opened": 0}
+        self.lock = threading.Lock()
+
+    def record(self, name: str, seconds: float):
+        """
+        Records a call of the operation.
+
+        The histogram counts the calls in powers of two microseconds.
+
+        Parameters:
+        -----------
+        name : str
+            name of the operation.
+        seconds : float
+            wall time of the call, without the time blocked in input().
+        """
+        bucket = max(0, math.ceil(math.log2(max(seconds * 1e6, 1))))
+        with self.lock:
+            operation = self.operations.setdefault(
+                name, {"calls": 0, "seconds": 0.0, "max": 0.0, "histogram": {}})
+            operation["calls"] += 1
+            operation["seconds"] += seconds
+            operation["max"] = max(operation["max"], seconds)
+            operation["histogram"][bucket] = operation["histogram"].get(bucket, 0) + 1
+
+    def count_io(self, read: int = 0, written: int = 0, opened: int = 0):
+        """
+        Adds to the I/O counters.
+
+        Parameters:
+        -----------
+        read : int, optional
+            bytes read.
+        written : int, optional
+            bytes written.
+        opened : int, optional
+            files opened.
+        """
+        with self.lock:
+            self.io["bytes_read"] += read
+            self.io["bytes_written"] += written
+            self.io["files_opened"] += opened
+
+    def to_dict(self) -> dict:
+        """
+        Returns the metrics with the estimated percentiles.
+
+        Returns:
+        --------
+        metrics : dict
+            operations with calls, seconds, mean, p50, p95, p99, max and histogram, the I/O counters
+            and the statistics of the notes caches.
+        """
+        operations = {}
+        for name, operation in sorted(self.operations.items()):
+            operations[name] = {
+                "calls": operation["calls"],
+                "seconds": operation["seconds"],
+                "mean": operation["seconds"] / operation["calls"],
+                "p50": percentile(operation["histogram"], 0.50),
+                "p95": percentile(operation["histogram"], 0.95),
+                "p99": percentile(operation["histogram"], 0.99),
+                "max": operation["max"],
+                # Upper bound of each bucket in microseconds.
+                "histogram_us": {str(2 ** bucket): calls for bucket, calls in sorted(operation["histogram"].items())},
+            }
+        return {"operations": operations, "io": dict(self.io),
+                "notes_caches": [cache.stats() for cache in list(notes_caches)]}
+
+    def summary(self) -> str:
+        """
+        Returns the metrics as a text table.
+        """
+        data = self.to_dict()
+        lines = [f"{'Operation':<36}{'Calls':>8}{'Total(s)':>10}{'Mean(ms)':>10}"
+                 f"{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'Max(ms)':>10}"]
+        for name, operation in data["operations"].items():
+            lines.append(f"{name:<36}{operation['calls']:>8}{operation['seconds']:>10.3f}"
+                         f"{operation['mean'] * 1e3:>10.3f}{operation['p50'] * 1e3:>10.3f}"
+                         f"{operation['p95'] * 1e3:>10.3f}{operation['p99'] * 1e3:>10.3f}"
+                         f"{operation['max'] * 1e3:>10.3f}")
+        lines.append(f"Bytes read: {data['io']['bytes_read']}, bytes written: {data['io']['bytes_written']}, "
+                     f"files opened: {data['io']['files_opened']}")
+        for stats in data["notes_caches"]:
+            lines.append(f"Notes cache: {stats['hits']} hits, {stats['misses']} misses "
+                         f"({stats['hit_ratio']:.1%} hit ratio), {stats['evictions']} evictions, "
+                         f"{stats['size']}/{stats['maxsize']} notes")
+        return "\n".join(lines)
+
+
+class CountingFile:
+    """
+    A class to represent a file object that counts the bytes read and written.
+
+    Every other attribute is taken from the wrapped file.
+    """
+
+    def __init__(self, file):
+        """
+        Constructor for the CountingFile object.
+
+        Parameters:
+        -----------
+        file : file
+            file object to wrap.
+        """
+        self.file = file
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return self.file.__exit__(*exc_info)
+
+    def __iter__(self):
+        for line in self.file:
+            metrics.count_io(read=data_size(line))
+            yield line
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    def read(self, *args):
+        data = self.file.read(*args)
+        metrics.count_io(read=data_size(data))
+        return data
+
+    def readline(self, *args):
+        data = self.file.readline(*args)
+        metrics.count_io(read=data_size(data))
+        return data
+
+    def readlines(self, *args):
+        lines = self.file.readlines(*args)
+        metrics.count_io(read=sum([data_size(line) for line in lines]))
+        return lines
+
+    def write(self, data):
+        metrics.count_io(written=data_size(data))
+        return self.file.write(data)
+
+    def writelines(self, lines):
+        lines = list(lines)
+        metrics.count_io(written=sum([data_size(line) for line in lines]))
+        return self.file.writelines(lines)
+
+
+def data_size(data) -> int:
+    """
+    Returns the size of the data in bytes, encoding text as UTF-8.
+    """
+    return len(data.encode()) if isinstance(data, str) else len(data)
+
+
+def percentile(histogram: dict, fraction: float) -> float:
+    """
+    Returns the estimated percentile in seconds from the histogram buckets.
+
+    Parameters:
+    -----------
+    histogram : dict[int, int]
+        calls keyed by the power of two microseconds bucket.
+    fraction : float
+        percentile as a fraction, 0.95 for p95.
+
+    Returns:
+    --------
+    seconds : float
+        upper bound of the bucket holding the percentile.
+    """
+    total = sum(histogram.values())
+    seen = 0
+    for bucket, calls in sorted(histogram.items()):
+        seen += calls
+        if seen >= total * fraction:
+            return 2 ** bucket / 1e6
+    return 0.0
+
+
+def counting_open(*args, **kwargs):
+    """
+    Opens a file like open() and counts it with its bytes read and written.
+    """
+    metrics.count_io(opened=1)
+    return CountingFile(builtins.open(*args, **kwargs))
+
+
+def counting_read(function):
+    """
+    Returns the function reading bytes without open() wrapped to count the bytes it returns.
+
+    Parameters:
+    -----------
+    function : callable
+        function returning the bytes read.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        data = function(*args, **kwargs)
+        metrics.count_io(read=len(data))
+        return data
+    return wrapper
+
+
+def timed_input(prompt: str = "") -> str:
+    """
+    Asks for input like input() and records the time blocked in it for the current thread.
+    """
+    start = time.perf_counter()
+    try:
+        return original_input(prompt)
+    finally:
+        blocked.seconds = getattr(blocked, "seconds", 0.0) + time.perf_counter() - start
+
+
+def timed(name: str, function):
+    """
+    Returns the function wrapped to record its wall time, without the time blocked in input().
+
+    Parameters:
+    -----------
+    name : str
+        name of the operation.
+    function : callable
+        function to time.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        blocked_before = getattr(blocked, "seconds", 0.0)
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.record(name, elapsed - (getattr(blocked, "seconds", 0.0) - blocked_before))
+    wrapper.instrumented = True
+    return wrapper
+
+
+def enable(path: str = None) -> Metrics:
+    """
+    Starts recording the timings and the I/O counters, and reports them on exit.
+
+    Parameters:
+    -----------
+    path : str, optional
+        path of the JSON metrics file, the summary is printed if None.
+
+    Returns:
+    --------
+    metrics : Metrics
+        metrics being recorded.
+    """
+    global metrics
+    if metrics is not None:
+        return metrics
+    metrics = Metrics()
+    import library
+    builtins.input = timed_input
+    for method in LIBRARY_METHODS:
+        setattr(library.Library, method,
+                timed(f"Library.{method}", getattr(library.Library, method)))
+    for module_name in STORAGE_MODULES:
+        module = sys.modules.get(module_name)
+        # Skipping the backends that aren't used.
+        if module is None:
+            continue
+        module.open = counting_open
+        if module_name == "loanlog":
+            # The segments are read with os.pread instead of open.
+            module.readsegment = counting_read(module.readsegment)
+        for name, function in list(vars(module).items()):
+            if callable(function) and getattr(function, "__module__", None) == module_name \
+                    and not isinstance(function, type) and not name.startswith("_"):
+                wrapper = timed(f"{module_name}.{name}", function)
+                # Replacing the function wherever it was imported with "from module import *".
+                for other in list(sys.modules.values()):
+                    if getattr(other, name, None) is function:
+                        setattr(other, name, wrapper)
+    atexit.register(report, path)
+    return metrics
+
+
+def report(path: str = None):
+    """
+    Writes the metrics to the JSON file, or prints the summary if there is no path.
+
+    Parameters:
+    -----------
+    path : str, optional
+        path of the JSON metrics file.
+    """
+    if path:
+        with builtins.open(path, "w") as metrics_file:
+            json.dump(metrics.to_dict(), metrics_file, indent=2)
+    else:
+        print(metrics.summary(), file=sys.stderr)
+
+
+def enable_from_environment():
+    """
+    Enables the metrics if the LMS_METRICS environment variable is set.
+    """
+    setting = os.environ.get("LMS_METRICS")
+    if setting:
+        enable(None if setting == "1" else setting)
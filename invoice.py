@@ -0,0 +1,244 @@
+"""
+Invoices of the notes, rendered on demand from the saved notes lines.
+
+Only the notes lines are saved, so an invoice is rendered whenever it is
+printed or exported. Exporting renders the invoices in a process pool.
+
+Usage: python invoice.py DIRECTORY [--borrower name] [--workers 4] [--library "Islington Library"] [--user name]
+"""
+import os
+import sys
+import argparse
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from note import Note
+
+# Width of the invoices that aren't printed to a terminal.
+INVOICE_COLUMNS = 120
+# Row of the books table of the invoice.
+BOOK_ROW = "|{:<10} | {:<50} | {:<20} | {:<10}|".format
+# Notes rendered by a worker at once when exporting.
+EXPORT_CHUNK = 500
+# Books keyed by their normalized name, library name and user of the export workers.
+worker_state = {}
+
+
+class InvoiceTemplate:
+    """
+    A class to represent the invoice layout for a width, with the fixed lines rendered once.
+
+    Attributes:
+    -----------
+    columns : int
+        width of the invoice.
+    rule : str
+        full width separator.
+    table_rule : str
+        centered separator of the books table.
+    header : str
+        centered heading of the books table.
+    footer : str
+        lines after the books table.
+
+    Methods:
+    --------
+    render(library_name, user, notes):
+        Returns the invoice of the notes.
+    """
+
+    def __init__(self, columns: int):
+        """
+        Constructor for the InvoiceTemplate object.
+
+        Parameters:
+        -----------
+        columns : int
+            width of the invoice.
+        """
+        self.columns = columns
+        heading = BOOK_ROW("Book ID", "Book Name", "Author", "Price")
+        self.rule = "-" * columns
+        self.table_rule = self.center("-" * len(heading))
+        self.header = self.center(heading)
+        self.footer = "\n".join([self.table_rule, self.rule,
+                                 "Kindly return the book before or at the due date.",
+                                 "Note: You will be fined Rs.10 per day for late return.", ""])
+
+    def center(self, line: str) -> str:
+        """
+        Returns the line centered in the width, without the trailing spaces.
+
+        Parameters:
+        -----------
+        line : str
+            line to center.
+        """
+        return line.center(self.columns).rstrip()
+
+    def render(self, library_name: str, user: str, notes: Note) -> str:
+        """
+        Returns the invoice of the notes.
+
+        Parameters:
+        -----------
+        library_name : str
+            Name of the Library.
+        user : str
+            User sending the invoice.
+        notes : Note
+            Note object to render.
+
+        Returns:
+        --------
+        invoice : str
+            lines of the invoice, each ending with a line break.
+        """
+        lines = [self.center(library_name), f"Sender: {user}".rjust(self.columns), self.rule, "Invoice",
+                 f"Receiver: {notes.name}",
+                 f"Date: {notes.borroweddate.strftime('%d %B, %Y')}",
+                 f"Return Due: {notes.returndate.strftime('%d %B, %Y')}"]
+        if notes.returned:
+            lines.append(f"Returned Date: {notes.returneddate.strftime('%d %B, %Y')}")
+        lines += [self.table_rule, self.header]
+        lines += [self.center(BOOK_ROW(book.lib_id, book.name, book.author, book.price)) for book in notes.books]
+        if notes.returned:
+            lines.append(self.center(BOOK_ROW("", "", "Fine", notes.fine)))
+            lines.append(self.center(BOOK_ROW("", "", "Total", notes.final_cost)))
+        else:
+            lines.append(self.center(BOOK_ROW("", "", "Initial Total", notes.cost)))
+        lines.append(self.footer)
+        return "\n".join(lines)
+
+
+@lru_cache(maxsize=8)
+def invoice_template(columns: int) -> InvoiceTemplate:
+    """
+    Returns the invoice template for the width, created once.
+
+    Parameters:
+    -----------
+    columns : int
+        width of the invoice.
+    """
+    return InvoiceTemplate(columns)
+
+
+def render_invoice(library_name: str, user: str, notes: Note, columns: int = INVOICE_COLUMNS) -> str:
+    """
+    Returns the invoice of the notes.
+
+    Parameters:
+    -----------
+    library_name : str
+        Name of the Library.
+    user : str
+        User sending the invoice.
+    notes : Note
+        Note object to render.
+    columns : int, optional
+        width of the invoice.
+    """
+    return invoice_template(columns).render(library_name, user, notes)
+
+
+def start_worker(books: dict, library_name: str, user: str):
+    """
+    Keeps the books and the sender details in the export worker.
+
+    Parameters:
+    -----------
+    books : dict[str, Book]
+        books keyed by their normalized name.
+    library_name : str
+        Name of the Library.
+    user : str
+        User sending the invoices.
+    """
+    worker_state.update(books=books, library_name=library_name, user=user)
+
+
+def write_invoices(directory: str, notes_lines: list) -> int:
+    """
+    Renders the invoices of the notes to text files in the directory, in an export worker.
+
+    Parameters:
+    -----------
+    directory : str
+        directory of the invoices.
+    notes_lines : list[tuple[str, list[str]]]
+        note ID and lines of each note.
+
+    Returns:
+    --------
+    total : int
+        Total number of invoices written, the notes that can't be read are skipped.
+    """
+    books = worker_state["books"]
+    total = 0
+    for noteid, note_lines in notes_lines:
+        try:
+            notes = Note.from_lines(note_lines, lambda name: books.get(name.casefold()))
+        except (ValueError, IndexError):
+            # Skipping a damaged note instead of failing the whole export.
+            continue
+        with open(os.path.join(directory, f"{noteid}.txt"), "w") as invoice:
+            invoice.write(render_invoice(worker_state["library_name"], worker_state["user"], notes))
+        total += 1
+    return total
+
+
+def export_invoices(library, noteids: list, directory: str, workers: int = None) -> int:
+    """
+    Renders the invoices of the notes to text files in the directory, with a process pool.
+
+    The notes are read in this process and parsed and rendered by the workers,
+    EXPORT_CHUNK notes at a time.
+
+    Parameters:
+    -----------
+    library : Library
+        Library the notes belong to.
+    noteids : list[str]
+        IDs of the notes.
+    directory : str
+        directory of the invoices, created if needed.
+    workers : int, optional
+        number of worker processes, the number of CPUs by default.
+
+    Returns:
+    --------
+    total : int
+        Total number of invoices written, without the notes that couldn't be read.
+    """
+    from storage import loadnotes
+    os.makedirs(directory, exist_ok=True)
+    # Same lookup as Library.find_book, the first book with the name.
+    books = {key: matches[0] for key, matches in library.name_index.items() if matches}
+    # Skipping the notes removed since they were listed.
+    notes_lines = [(noteid, loadnotes(noteid)) for noteid in noteids]
+    notes_lines = [(noteid, note_lines) for noteid, note_lines in notes_lines if note_lines is not None]
+    chunks = [notes_lines[start:start + EXPORT_CHUNK] for start in range(0, len(notes_lines), EXPORT_CHUNK)]
+    with ProcessPoolExecutor(workers, initializer=start_worker,
+                             initargs=(books, library.name, library.user)) as executor:
+        return sum(executor.map(write_invoices, [directory] * len(chunks), chunks))
+
+
+if __name__ == "__main__":
+    from library import Library
+    from storage import listnotes, searchnotes
+    parser = argparse.ArgumentParser(description="Export the invoices of the notes to text files.")
+    parser.add_argument("directory", help="directory of the invoices")
+    parser.add_argument("--borrower", help="only export the notes of the borrower")
+    parser.add_argument("--workers", type=int, help="worker processes (number of CPUs by default)")
+    parser.add_argument("--library", default="Islington Library", help="name of the Library on the invoices")
+    parser.add_argument("--user", default="Library", help="sender on the invoices")
+    args = parser.parse_args()
+    library = Library(args.library, args.user)
+    if args.borrower:
+        noteids = searchnotes(args.borrower.strip().lower().replace(" ", "-"), False)
+    else:
+        noteids = listnotes()
+    total = export_invoices(library, noteids, args.directory, args.workers)
+    print(f"Exported {total} invoices to {args.directory}.")
+    if total < len(noteids):
+        print(f"WARNING! Skipped {len(noteids) - total} notes that couldn't be read.", file=sys.stderr)
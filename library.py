@@ -1,12 +1,20 @@
 from note import Note
-from book import Book
-from libraryfs import *
-from notesmanager import *
+from book import Book, reserve_books, release_books, watch_stocks
+from storage import *
 from datetime import datetime
-from difflib import get_close_matches
-from extras import get_terminal_columns
-from errors import NoMoreStocks, StockFull
+from contextlib import nullcontext
+from fuzzysearch import TrigramIndex
+from fulltext import TextIndex, rank_books
+from sortedindex import SortedIndex, SORT_FIELDS, SORT_KEYS, select_books
+from lrucache import LRUCache
+from invoice import INVOICE_COLUMNS, render_invoice
+from extras import get_terminal_columns, print_table
+from errors import NoMoreStocks, StockFull, BookNotFound, NoteNotFound
 from input_funcs import get_book_details_input
+from stockanalytics import stock_report
+
+# Parsed notes kept in memory by each Library.
+NOTES_CACHE_SIZE = 1024
 
 
 class Library:
@@ -21,39 +29,89 @@ class Library:
         User who logged into the library system.
     bookdb :list[Book]
         A list of Book objects that are in the library.
+    id_index : dict[str, Book]
+        Book objects keyed by their normalized lib_id.
+    name_index : dict[str, list[Book]]
+        Book objects keyed by their normalized name.
+    trigram_index : TrigramIndex
+        Trigram index over the normalized book names.
+    text_index : TextIndex or None
+        Word index over the names, authors and publishers of the books, built on the first search.
+    sorted_indexes : dict[str, SortedIndex] or None
+        Books sorted by each of SORT_FIELDS, built on the first query.
+    notes_cache : LRUCache
+        Note objects keyed by note ID, checked against the version of the notes.
 
     Methods:
     --------
     add_book():
         Add a book to the Library's Database.
+    add_books(books):
+        Adds the books to the Library's Database with one journal write and returns the ones added.
     remove_book():
         Remove a book from the Library's Database.
-    available_books():
+    remove_books(books):
+        Removes the books from the Library's Database with one journal write and returns the ones removed.
+    available_books(page_size=None, offset=0):
         List out the books that are available for borrow.
-    show_all_books():
+    show_all_books(page_size=None, offset=0):
         List out all the books in the Library's Database.
     borrow_book():
         Creates a borrow record and updates Library's Database.
     return_book():
         Creates a return record and updates Library's Database.
+    borrow_books(name, bookargs, borroweddate=None, save=True):
+        Creates a borrow record without prompting and returns its note ID and Note object.
+    move_reservation(books):
+        Returns the reserved books as they are in the Library's Database, moving the reservation after a reload.
+    return_books(noteid, notes=None, returneddate=None, save=True):
+        Creates a return record without prompting and returns the Note object and the restocked books.
     get_noteid(checkReturned=True):
         Returns the note ID based on user's input and choice.
     create_notes(noteid):
         Returns a Note object based on the notes file.
-    get_note_text(notes):
-        Returns formatted text to write in text file.
+    get_note_text(notes, columns=INVOICE_COLUMNS):
+        Returns the invoice of the notes.
     find_book_by_id(bookid):
         Returns a Book object with lib_id attribute same as the bookid.
     find_book(bookname):
         Returns a Book object with name attribute same as the bookname.
+    find_book_by_arg(bookarg):
+        Returns a Book object with lib_id or name attribute same as the bookarg.
     find_similar_book(bookname):
         Returns a Book object with name attribute similar to the bookname.
+    find_similar_books(bookname, limit=3):
+        Returns Book objects with name attribute similar to the bookname, best match first.
+    choose_similar_book(bookname):
+        Returns the similar Book object confirmed by the user.
+    search_books(query, limit=None, offset=0):
+        Returns the Book objects matching all the words of the query, sorted by name.
+    match_books(query):
+        Returns the Book objects matching all the words of the query, in no order.
+    search_catalog():
+        Prints the books matching the words entered by the user.
+    query_books(pub_date=None, price=None, remaining=None, author=None, sort_by="author", descending=False, page_size=None, offset=0):
+        Returns a page of the Book objects in the ranges, sorted by a field.
+    get_sorted_indexes():
+        Returns the sorted indexes, building them on first use.
     check_duplicates(bookid):
         Returns a Book object with lib_id attribute same as the bookid.
     print_notes(notes = None):
         Prints the transaction with proper formatting.
     savebookdb():
         Saves the Library's Database to file.
+    sync_stocks():
+        Applies the stock changes saved by other processes to the Library's Database.
+    apply_stock_change(action, book):
+        Updates the lookup indexes for a book added or removed by another process.
+    show_stock_report():
+        Prints the stock analytics of the Library's Database.
+    build_indexes():
+        Rebuilds the lookup indexes from the Library's Database.
+    index_book(book):
+        Adds a book to the lookup indexes.
+    unindex_book(book):
+        Removes a book from the lookup indexes.
     """
 
     def __init__(self, name: str, user: str):
@@ -70,6 +128,10 @@ class Library:
         self.name = name
         self.user = user
         self.bookdb: list[Book] = loadbookstocks()
+        self.build_indexes()
+        self.notes_cache = LRUCache(NOTES_CACHE_SIZE)
+        # Dropping the notes from the cache whenever they are written.
+        registernotescache(self.notes_cache)
 
     def add_book(self):
         """
@@ -81,24 +143,57 @@ class Library:
         while True:
             # asking the user for bookid of the book
             bookid = input("Enter the book's unique Library ID: ")
-            # Checkign if there is any book with same id.
-            book_dupli = self.check_duplicates(bookid)
-            if (book_dupli is None):
-                break
-            else:
-                # Showing a error message with book name
-                print(
-                    f"The book titled {book_dupli.name} already has this ID.\n Please use other one.")
-                continue
-        # Creating a book object
-        new_book = Book(bookid, bookname, author,
-                        publisher, pub_date, total, price)
-        # Adding the book to the database
-        self.bookdb.append(new_book)
+            # Checking the ID against the books added by other terminals too.
+            with lockedstocks():
+                self.sync_stocks()
+                # Checkign if there is any book with same id.
+                book_dupli = self.check_duplicates(bookid)
+                if (book_dupli is None):
+                    # Creating a book object
+                    new_book = Book(bookid, bookname, author,
+                                    publisher, pub_date, total, price)
+                    # Adding the book to the database
+                    self.bookdb.append(new_book)
+                    # Recording the addition in the stock journal
+                    journalstock("ADD", new_book.getStockText())
+                    # Adding the book to the lookup indexes
+                    self.index_book(new_book)
+                    break
+            # Showing a error message with book name
+            print(
+                f"The book titled {book_dupli.name} already has this ID.\n Please use other one.")
         # Printing the output
         print(
             f"The book titled {new_book.name} has been added to the database.")
 
+    def add_books(self, books: list[Book]) -> list[Book]:
+        """
+        Adds the books to the Library's Database with one journal write and returns the ones added.
+
+        The books whose ID was taken by another process meanwhile are skipped,
+        and none are added if the journal can't be written.
+
+        Parameters:
+        -----------
+        books : list[Book]
+            Book objects with IDs not used in the Library's Database or among them.
+
+        Returns:
+        --------
+        added : list[Book]
+            Book objects that were added.
+        """
+        with lockedstocks():
+            self.sync_stocks()
+            books = [book for book in books if self.check_duplicates(book.lib_id) is None]
+            # Recording all the additions in the stock journal at once, before changing the database.
+            if books and not journalstocks([("ADD", book.getStockText()) for book in books]):
+                return []
+            self.bookdb.extend(books)
+            for book in books:
+                self.index_book(book)
+        return books
+
     def remove_book(self):
         """
         Remove a book from the Library's Database.
@@ -115,65 +210,85 @@ class Library:
                 return  # Proceeds if user entered "exit"
             else:
                 # Proceeds otherwise
-                matching_book = self.find_similar_book()
-                # Finding similar books for the bookname
-                if matching_book is None:
-                    print("Please make sure the book name is correct.")
-                else:
-                    option = input(
-                        f"Did you mean {matching_book.name}? (Y/N): ").upper()
-                    if option == "Y":
-                        book = matching_book
-                        break
-                    else:
-                        print("Please make sure the book name is correct.")
-        self.bookdb.remove(book)  # Removing the book from the database
+                book = self.choose_similar_book(bookname)
+                if book is not None:
+                    break
+        # Another terminal may have removed the book meanwhile.
+        if not self.remove_books([book]):
+            print("The book couldn't be removed, another terminal may have removed it already.")
+            return
         # Printing proper output
         print(
             f"The book titled {book.name} by {book.author} has been removed from the database.")
 
-    def available_books(self):
+    def remove_books(self, books: list[Book]) -> list[Book]:
         """
-        List out the books that are available for borrow.
+        Removes the books from the Library's Database with one journal write and returns the ones removed.
+
+        The books removed by another process meanwhile are skipped, and none
+        are removed if the journal can't be written.
+
+        Parameters:
+        -----------
+        books : list[Book]
+            Book objects of the Library's Database.
+
+        Returns:
+        --------
+        removed : list[Book]
+            Book objects that were removed.
         """
-        columns = get_terminal_columns()  # Getting terminal columns size
+        with lockedstocks():
+            self.sync_stocks()
+            # Looking the books up again, as the sync may have replaced or removed them.
+            found = {}
+            for book in books:
+                book = self.find_book_by_id(book.lib_id)
+                if book is not None:
+                    found[book.lib_id] = book
+            books = list(found.values())
+            # Recording all the removals in the stock journal before changing the database.
+            if books and not journalstocks([("REMOVE", book.lib_id) for book in books]):
+                return []
+            for book in books:
+                self.bookdb.remove(book)
+                self.unindex_book(book)
+        return books
 
-        # Title for the display
-        title = "Available books to borrow in the Library"
-        print(title.center(columns))
+    def available_books(self, page_size: int = None, offset: int = 0):
+        """
+        List out the books that are available for borrow.
+
+        Parameters:
+        -----------
+        page_size : int, optional
+            Maximum number of books to list, all of them if None.
+        offset : int, optional
+            Number of available books to skip.
+        """
         # Heading for the diplsay
         heading = f"|{'Book ID':<10}|{'Book Name':<50}|{'Author':<20}|{'Remaining':<10}|{'Price':<10}|"
-        print_center(
-            f"{''.join(['-' for x in range(len(heading))])}")
-        print_center(heading)
-        # Iterating through all the books in database.
-        for book in self.bookdb:
-            # Checking if the book is avaiable with proper stock.
-            if book.remaining > 0:
-                print_center(book.getAvailableText())
-        print_center(
-            f"{''.join(['-' for x in range(len(heading))])}")
+        # Books in the database that are avaiable with proper stock.
+        rows = (book.getAvailableText() for book in self.bookdb if book.remaining > 0)
+        print_table("Available books to borrow in the Library",
+                    heading, rows, page_size, offset)
 
-    def show_all_books(self):
+    def show_all_books(self, page_size: int = None, offset: int = 0):
         """
         List out all the books in the Library's Database.
-        """
-        columns = get_terminal_columns()  # Getting terminal columns
 
-        # Title for the display.
-        title = "Books in the Library"
-        print(title.center(columns))
+        Parameters:
+        -----------
+        page_size : int, optional
+            Maximum number of books to list, all of them if None.
+        offset : int, optional
+            Number of books to skip.
+        """
         # Heading for the display.
         heading = f"|{'Book ID':<7}|{'Book Name':<45}|{'Author':<20}|{'Publisher':<22}|{'Year':<5}|{'Total':<5}|{'Price':<6}|"
-        print_center(
-            f"{''.join(['-' for x in range(len(heading))])}")
-        print_center(heading)
-        # Iterating through all the books in database.
-        for book in self.bookdb:
-            # Getting the book display text with the help of method.
-            print_center(book.getDisplayText())
-        print_center(
-            f"{''.join(['-' for x in range(len(heading))])}")
+        # Getting the book display text with the help of method.
+        rows = (book.getDisplayText() for book in self.bookdb)
+        print_table("Books in the Library", heading, rows, page_size, offset)
 
     def borrow_book(self):
         """
@@ -206,24 +321,10 @@ class Library:
                         if book is not None:
                             break
                         else:
-                            # Finding similar named books with the method.
-                            matching_book = self.find_similar_book(bookarg)
-                            # Printing a message if the matching book is also None.
-                            if matching_book is None:
-                                print("Please make sure the book name is correct.")
-                            else:
-                                # Asking the user for confirmation
-                                option = input(
-                                    f"Did you mean {matching_book.name}? (Y/N): ").upper()
-                                if option == "Y":
-                                    # Assigning book with the matching book value after confirmation
-                                    book = matching_book
-                                    # Breaking the loop
-                                    break
-                                else:
-                                    # Printing a message asking correct input.
-                                    print(
-                                        "Please make sure the book name is correct.")
+                            # Letting the user pick from similar named books.
+                            book = self.choose_similar_book(bookarg)
+                            if book is not None:
+                                break
                 # Checking if the book is already in the list.
                 if book in total_borrowing_books:
                     # Printing a message if it is.
@@ -232,25 +333,42 @@ class Library:
                 else:
                     # Breaking the loop
                     break
-            try:
-                # Marking the book as borrowed and replacing the old object in the list.
-                index = self.bookdb.index(book)
-                book.borrow()
-                self.bookdb[index] = book
-            except NoMoreStocks as e:
+            if book.remaining < 1:
                 # An error message in case there is no stock available.
-                print(e.args[1], "The book isn't avaiable for borrowing.")
+                print("Stock Empty.", "The book isn't avaiable for borrowing.")
             else:
-                # Adding the book to the list
+                # Adding the book to the list, it is borrowed once the list is complete.
                 total_borrowing_books.append(book)
             option1 = input("Do you want to add more books? (Y/N): ").upper()
             if option1 == "Y":
                 continue
             else:
                 break
-        notes = Note(name, total_borrowing_books, datetime.now())
-        self.print_notes(notes)
-        savenotes(noteid, self.get_note_text(notes), notes.get_borrow_notes())
+        # Borrowing against the latest stocks, as other terminals may have borrowed the books meanwhile.
+        with lockedstocks():
+            self.sync_stocks()
+            borrowed_books = []
+            for book in total_borrowing_books:
+                current_book = self.find_book_by_id(book.lib_id)
+                try:
+                    if current_book is None:
+                        raise NoMoreStocks(0, "Book Removed.")
+                    # Marking the book as borrowed.
+                    current_book.borrow()
+                    borrowed_books.append(current_book)
+                except NoMoreStocks as e:
+                    # An error message in case the stock ran out meanwhile.
+                    print(e.args[1], f"The book titled {book.name} isn't avaiable for borrowing anymore.")
+            notes = Note(name, borrowed_books, datetime.now())
+            # Saving the note and the stock changes together.
+            saved = saveborrow(noteid, notes.get_borrow_notes(), [book.lib_id for book in borrowed_books])
+            if not saved:
+                # Putting back the borrowed books.
+                release_books(borrowed_books)
+        if saved:
+            self.print_notes(notes)
+        else:
+            print("ERROR! The borrow record couldn't be saved, please try again.")
 
     def return_book(self):
         """
@@ -268,29 +386,217 @@ class Library:
             option = input(
                 "Please confirm that this is the correct transaction. (Y/N): ").upper()
             if option == "Y":
-                # Proceeding if the correct note was selected.
+                # Books whose stock was updated.
+                returned_books = []
+                # Returning against the latest stocks, as other terminals may have changed them meanwhile.
+                with lockedstocks():
+                    self.sync_stocks()
+                    # Proceeding if the correct note was selected.
+                    for book in notes.books:
+                        # Books removed since the borrow have no stock to return to.
+                        if not book.lib_id:
+                            continue
+                        try:
+                            # Marking the book as returned.
+                            book = self.find_book_by_id(book.lib_id) or book
+                            book.returned()
+                            returned_books.append(book)
+                        except StockFull as e:
+                            # An error message in case the stock is full.
+                            print(
+                                e.args[1], f"The book stocks for {book.name} is already full. Please check it physically.")
+                    # Marking the note as returned.
+                    notes.mark_returned()
+                    # Calculating the cost.
+                    notes.calculate_cost()
+                    # Saving the return notes and the stock changes together.
+                    saved = savereturn(noteid, notes.get_return_notes(), [book.lib_id for book in returned_books])
+                    if not saved:
+                        # Taking back the returned books.
+                        for book in returned_books:
+                            book.add_stock(-1)
+                    # The cached note was changed in place, so it is parsed again next time.
+                    self.notes_cache.pop(noteid)
+                if saved:
+                    # Printing the date
+                    self.print_notes(notes)
+                else:
+                    print("ERROR! The return record couldn't be saved, please try again.")
+            else:
+                # Aborting in case the user doesn't want to proceed.
+                print("Aborting the process.")
+
+    def borrow_books(self, name: str, bookargs: list, borroweddate: datetime = None, save: bool = True) -> tuple:
+        """
+        Creates a borrow record without prompting and returns its note ID and Note object.
+
+        Either all the books are borrowed or none of them are. The books are
+        reserved with their own locks only, so many threads can borrow at once.
+        When saving, the reservation is checked against the stock changes of
+        the other processes under the stocks lock, otherwise the caller has to
+        hold the lock.
+
+        Parameters:
+        -----------
+        name : str
+            Name of the borrower.
+        bookargs : list[str]
+            Names or IDs of the books to borrow.
+        borroweddate : datetime, optional
+            Date when the books were borrowed, now by default.
+        save : bool, optional
+            Boolean value to save the record or leave it to the caller.
+
+        Returns:
+        --------
+        noteid, notes : tuple[str, Note]
+            Note ID and Note object of the borrow record.
+
+        Raises:
+        -------
+        BookNotFound
+            If a book doesn't exist or is repeated.
+        NoMoreStocks
+            If a book isn't available for borrowing.
+        IOError
+            If the record couldn't be saved, with the books put back.
+        """
+        if borroweddate is None:
+            borroweddate = datetime.now()
+        name = name.lower().title()
+        # Creating the noteid
+        noteid = f"{name.lower().replace(' ', '-')}-{int(borroweddate.timestamp())}"
+        books = []
+        for bookarg in bookargs:
+            book = self.find_book_by_arg(bookarg)
+            if book is None or book in books:
+                raise BookNotFound(bookarg, "Book Not Found or Repeated.")
+            books.append(book)
+        # Reserving every book or none of them.
+        reserve_books(books)
+        try:
+            notes = Note(name, books, borroweddate)
+            if save:
+                with lockedstocks():
+                    self.sync_stocks()
+                    # A reload replaces the Book objects, and the reservation has to follow them.
+                    reserved = self.move_reservation(books)
+                    if reserved != books:
+                        books = reserved
+                        notes = Note(name, books, borroweddate)
+                    for book in books:
+                        # Another process may have borrowed the last copy meanwhile.
+                        if book.remaining < 0:
+                            raise NoMoreStocks(book.remaining, "Stock Empty.")
+                    if not saveborrow(noteid, notes.get_borrow_notes(), [book.lib_id for book in books]):
+                        raise IOError(noteid, "Not Saved.")
+        except Exception:
+            # Putting back the reservation, whatever went wrong.
+            release_books(books)
+            raise
+        return noteid, notes
+
+    def move_reservation(self, books: list[Book]) -> list[Book]:
+        """
+        Returns the reserved books as they are in the Library's Database, moving the
+        reservation onto the Book objects that replaced them in a reload.
+
+        Either the whole reservation is moved or it is left on the given books.
+
+        Parameters:
+        -----------
+        books : list[Book]
+            books reserved with reserve_books.
+
+        Returns:
+        --------
+        books : list[Book]
+            Book objects now holding the reservation, in the same order.
+
+        Raises:
+        -------
+        NoMoreStocks
+            If a book was removed or a reloaded book has no stock left, with the reservation unchanged.
+        """
+        current = [book if book in self.name_index.get(normalize_key(book.name), [])
+                   else self.find_book_by_id(book.lib_id) for book in books]
+        if None in current:
+            # Another process removed a book meanwhile.
+            raise NoMoreStocks(0, "Book Removed.")
+        moved = [(book, found) for book, found in zip(books, current) if found is not book]
+        if moved:
+            # Reserving the reloaded books first, so nothing changes if one of them is out of stock.
+            reserve_books([found for _, found in moved])
+            release_books([book for book, _ in moved])
+        return current
+
+    def return_books(self, noteid: str, notes: Note = None, returneddate: datetime = None, save: bool = True) -> tuple:
+        """
+        Creates a return record without prompting and returns the Note object and the restocked books.
+
+        When saving, the stocks are synced and the record is saved under the
+        stocks lock, otherwise the caller has to hold the lock.
+
+        Parameters:
+        -----------
+        noteid : str
+            File name of the note.
+        notes : Note, optional
+            Note object of the note ID, loaded from the notes by default.
+        returneddate : datetime, optional
+            Date when the books were returned, now by default.
+        save : bool, optional
+            Boolean value to save the record or leave it to the caller.
+
+        Returns:
+        --------
+        notes, returned_books : tuple[Note, list[Book]]
+            Note object after the return and the books whose stock was updated.
+
+        Raises:
+        -------
+        NoteNotFound
+            If there is no open note with the note ID.
+        IOError
+            If the record couldn't be saved, with the books taken back.
+        """
+        with lockedstocks() if save else nullcontext():
+            if save:
+                self.sync_stocks()
+            if notes is None:
+                if loadnotes(noteid) is None:
+                    raise NoteNotFound(noteid, "Note Not Found.")
+                notes = self.create_notes(noteid)
+            if notes.returned:
+                raise NoteNotFound(noteid, "Note Already Returned.")
+            returned_books = []
+            try:
                 for book in notes.books:
+                    # Books removed since the borrow have no stock to return to.
+                    if not book.lib_id:
+                        continue
                     try:
-                        # Marking the book as returned and replacing the old object in the list.
-                        index = self.bookdb.index(book)
                         book.returned()
-                        self.bookdb[index] = book
-                    except StockFull as e:
-                        # An error message in case the stock is full.
-                        print(
-                            e.args[1], f"The book stocks for {book.name} is already full. Please check it physically.")
-                # Marking the note as returned.
-                notes.mark_returned()
-                # Calculating the cost.
+                        returned_books.append(book)
+                    except StockFull:
+                        # The stock is kept full, same as the interactive return.
+                        pass
+                notes.mark_returned(returneddate)
                 notes.calculate_cost()
-                # Printing the date
-                self.print_notes(notes)
-                # Adding the return notes to the file.
-                addtonotes(noteid, self.get_note_text(
-                    notes), notes.get_return_notes())
-            else:
-                # Aborting in case the user doesn't want to proceed.
-                print("Aborting the process.")
+                if save and not savereturn(noteid, notes.get_return_notes(),
+                                           [book.lib_id for book in returned_books]):
+                    raise IOError(noteid, "Not Saved.")
+            except Exception:
+                # Taking back the returned books and leaving the note open, whatever went wrong.
+                for book in returned_books:
+                    book.add_stock(-1)
+                notes.returned = False
+                notes.returneddate = None
+                raise
+            finally:
+                # The cached note was changed in place, so it is parsed again next time.
+                self.notes_cache.pop(noteid)
+        return notes, returned_books
 
     def get_noteid(self, checkReturned=True) -> str:
         """
@@ -324,10 +630,12 @@ class Library:
             # Printing all the notes found with cartain details.
             print(f"{'S.No.':<6}{'Name':<20}{'Books Borrowed':<15}Date")
             for index, notes in enumerate(notes_list):
-                notes_lines = loadnotes(notes)
-                # Calculating the total books with list comprehension
-                total_books = sum(
-                    [1 for note_line in notes_lines if note_line.startswith("BORROW:")])
+                # Getting the total books from the parsed note, cached for the chosen one.
+                try:
+                    total_books = len(self.create_notes(notes).books)
+                except (ValueError, IndexError):
+                    # A damaged note is still listed.
+                    total_books = "?"
                 name, timestamp = notes.rsplit("-", 1)
                 # Formatting the name properly.
                 name = name.replace("-", " ").title()
@@ -357,6 +665,8 @@ class Library:
         """
         Returns a Note object based on the notes file.
 
+        The parsed notes are cached until the notes file changes.
+
         Paramters:
         ----------
         noteid : str
@@ -367,89 +677,33 @@ class Library:
         note : Note
             Note object based on the notes textfile.
         """
-        # Loading the notes from the noteid/filename.
-        note_lines = loadnotes(noteid)
-        # Some default values
-        returned = False
-        returneddate = None
-        late_days = 0
-        final_cost = 0.0
-        books = []  # Books list of book object that was borrowed.
-        for note_line in note_lines:
-            if note_line.startswith("BORROW:"):
-                # Getting borrow values from the line accordingly.
-                note_line = note_line[7:]
-                note_args = note_line.split(",")
-                name = note_args[0]
-                bookname = note_args[1]
-                borroweddate = datetime.fromisoformat(note_args[2])
-                book = self.find_book(bookname)
-                books.append(book)
-            elif note_line.startswith("RETURN:"):
-                # Getting return values from the line accordingly
-                note_line = note_line[8:]
-                note_args = note_line.split(",")
-                returned = True
-                returneddate = datetime.fromisoformat(note_args[1])
-                late_days = int(note_args[2])
-                final_cost = float(note_args[3])
-        # Creating note object based on the file values
-        note = Note(name, books, borroweddate, returned,
-                    returneddate, late_days, final_cost)
+        # Using the cached note if the notes haven't changed since it was parsed.
+        version = notesversion(noteid)
+        note = self.notes_cache.get(noteid, version)
+        if note is not None:
+            return note
+        # Loading the notes from the noteid/filename and creating the note object from its lines.
+        note = Note.from_lines(loadnotes(noteid), self.find_book)
+        self.notes_cache.put(noteid, version, note)
         return note  # Returns the note object created
 
-    def get_note_text(self, notes: Note) -> str:
+    def get_note_text(self, notes: Note, columns: int = INVOICE_COLUMNS) -> str:
         """
-        Returns formatted text to write in text file
+        Returns the invoice of the notes, rendered with the invoice template.
 
         Parameters:
         -----------
         notes : Note
-            Note object to write.
+            Note object to render.
+        columns : int, optional
+            width of the invoice.
 
         Returns:
         --------
         note_text : str
             Formatted text.
         """
-        columns = 120
-        note_text = ""
-        note_text += f"{self.name}".center(columns)
-        note_text += "\n"
-        note_text += f"Sender: {self.user}".rjust(columns)
-        note_text += "\n"
-        note_text += f"{''.join(['-' for x in range(columns)])}\n"
-        note_text += "Invoice\n"
-        note_text += f"Receiver: {notes.name}\n"
-        note_text += f"Date: {notes.borroweddate.strftime('%d %B, %Y')}\n"
-        note_text += f"Return Due: {notes.returndate.strftime('%d %B, %Y')}\n"
-        if notes.returned:
-            note_text += f"Returned Date: {notes.returneddate.strftime('%d %B, %Y')}\n"
-        header = f"|{'Book ID':<10} | {'Book Name':<50} | {'Author':<20} | {'Price':<10}|"
-        note_text += f"{''.join(['-' for x in range(len(header))])}".center(columns)
-        note_text += "\n"
-        note_text += header.center(columns)
-        note_text += "\n"
-        for book in notes.books:
-            note_text += f"|{book.lib_id:<10} | {book.name:<50} | {book.author:<20} | {book.price:<10}|".center(
-                columns)
-            note_text += "\n"
-        if notes.returned:
-            note_text += f"|{'':<10} | {'':<50} | {'Fine':<20} | {notes.fine:<10}|".center(
-                columns)
-            note_text += "\n"
-            note_text += f"|{'':<10} | {'':<50} | {'Total':<20} | {notes.final_cost:<10}|".center(
-                columns)
-        else:
-            note_text += f"|{'':<10} | {'':<50} | {'Initial Total':<20} | {notes.cost:<10}|".center(
-                columns)
-        note_text += "\n"
-        note_text += f"{''.join(['-' for x in range(len(header))])}".center(columns)
-        note_text += "\n"
-        note_text += f"{''.join(['-' for x in range(columns)])}\n"
-        note_text += "Kindly return the book before or at the due date.\n"
-        note_text += "Note: You will be fined Rs.10 per day for late return.\n"
-        return note_text
+        return render_invoice(self.name, self.user, notes, columns)
 
     def find_book_by_id(self, bookid) -> Book:
         """
@@ -464,12 +718,8 @@ class Library:
         book : Book or None
             Book with lib_id attribute same as the bookid.
         """
-        # Iterating through all the books in the list.
-        for book in self.bookdb:
-            # Check for bookid
-            if (bookid.lower() == book.lib_id.lower()):
-                return book  # Returns book if bookid matches lib_id.
-        return None  # Returns None if nothing was found in the end.
+        # Looking up the book in the id index.
+        return self.id_index.get(normalize_key(bookid))
 
     def find_book(self, bookname) -> Book:
         """
@@ -485,12 +735,30 @@ class Library:
         book : Book or None
             Book with name attribute same as the bookname.
         """
-        # Iterating through all the books in the list.
-        for book in self.bookdb:
-            # Check for bookname
-            if (bookname.lower() == book.name.lower()):
-                return book  # Returns book if bookname matches name.
-        return None  # Returns None if nothing was found in the end.
+        # Looking up the books in the name index.
+        books = self.name_index.get(normalize_key(bookname))
+        if books:
+            return books[0]  # Returns the first book with the name.
+        return None  # Returns None if nothing was found.
+
+    def find_book_by_arg(self, bookarg) -> Book:
+        """
+        Returns a Book object with lib_id or name attribute same as the bookarg.
+
+        Parameters:
+        -----------
+        bookarg : str
+            ID or name of the book.
+
+        Returns:
+        --------
+        book : Book or None
+            Book with lib_id or name attribute same as the bookarg.
+        """
+        book = self.find_book_by_id(bookarg)
+        if book is None:
+            book = self.find_book(bookarg)
+        return book
 
     def find_similar_book(self, bookname) -> Book:
         """
@@ -506,16 +774,188 @@ class Library:
         book : Book or None
             Book with name attribute similar to the bookname.
         """
-        # List comprehension to get all book names in lowercase.
-        book_names = [book.name.lower() for book in self.bookdb]
-        # Getting closed match from the list.
-        matches = get_close_matches(bookname, book_names)
+        # Getting the best match from the trigram index.
+        matches = self.find_similar_books(bookname, limit=1)
         # CHeck for matches length
         if len(matches) > 0:
-            return self.find_book(matches[0])  # Returns the first match
+            return matches[0]  # Returns the first match
         else:
             return None  # Returns None if there are no matches
 
+    def find_similar_books(self, bookname, limit=3) -> list[Book]:
+        """
+        Returns Book objects with name attribute similar to the bookname, best match first.
+
+        Parameters:
+        -----------
+        bookname : str
+            Name of the book.
+        limit : int, optional
+            Maximum number of books to return.
+
+        Returns:
+        --------
+        books : list[Book]
+            Books with name attribute similar to the bookname.
+        """
+        # Getting the ranked matches from the trigram index.
+        matches = self.trigram_index.search(normalize_key(bookname), limit)
+        return [self.name_index[match][0] for match in matches]
+
+    def choose_similar_book(self, bookname) -> Book:
+        """
+        Returns the similar Book object confirmed by the user.
+
+        Parameters:
+        -----------
+        bookname : str
+            Name of the book.
+
+        Returns:
+        --------
+        book : Book or None
+            Book confirmed by the user.
+        """
+        # Asking the user for confirmation on each suggestion, best first.
+        for matching_book in self.find_similar_books(bookname):
+            option = input(
+                f"Did you mean {matching_book.name}? (Y/N): ").upper()
+            if option == "Y":
+                return matching_book
+        # Printing a message asking correct input.
+        print("Please make sure the book name is correct.")
+        return None
+
+    def search_books(self, query: str, limit: int = None, offset: int = 0) -> list[Book]:
+        """
+        Returns the Book objects matching all the words of the query, sorted by name.
+
+        Parameters:
+        -----------
+        query : str
+            Words to search for in the names, authors and publishers. A word ending
+            with "*" matches as a prefix, and "name:", "author:" or "publisher:"
+            before a word only matches it in that field.
+        limit : int, optional
+            Maximum number of books to return, all of them if None.
+        offset : int, optional
+            Number of matching books to skip.
+
+        Returns:
+        --------
+        books : list[Book]
+            Books matching the query.
+
+        Raises:
+        -------
+        ValueError
+            If the query uses an unknown field.
+        """
+        # Only sorting the requested page of the matches.
+        return rank_books(self.match_books(query), limit, offset)
+
+    def match_books(self, query: str) -> set[Book]:
+        """
+        Returns the Book objects matching all the words of the query, in no order.
+
+        Parameters:
+        -----------
+        query : str
+            Words to search for, same as search_books.
+
+        Returns:
+        --------
+        books : set[Book]
+            Books matching the query.
+
+        Raises:
+        -------
+        ValueError
+            If the query uses an unknown field.
+        """
+        if self.text_index is None:
+            self.text_index = TextIndex(self.bookdb)
+        return self.text_index.search(query)
+
+    def search_catalog(self):
+        """
+        Prints the books matching the words entered by the user.
+        """
+        query = input('Enter the words to search for (e.g. "author:rowl* potter"): ')
+        try:
+            books = self.search_books(query)
+        except ValueError as e:
+            print(e.args[-1])
+            return
+        if not books:
+            print("No books were found.")
+            return
+        # Same layout as show_all_books.
+        heading = f"|{'Book ID':<7}|{'Book Name':<45}|{'Author':<20}|{'Publisher':<22}|{'Year':<5}|{'Total':<5}|{'Price':<6}|"
+        rows = (book.getDisplayText() for book in books)
+        print_table(f"Books matching {query.strip()} ({len(books)} found)", heading, rows)
+
+    def query_books(self, pub_date: tuple = None, price: tuple = None, remaining: tuple = None,
+                    author: str = None, sort_by: str = "author", descending: bool = False,
+                    page_size: int = None, offset: int = 0) -> list[Book]:
+        """
+        Returns a page of the Book objects in the ranges, sorted by a field.
+
+        e.g. query_books(pub_date=(1990, 2000), price=(None, 50), sort_by="price", page_size=20, offset=40)
+        for the third page of the books published from 1990 to 2000 under Rs.50.
+
+        Parameters:
+        -----------
+        pub_date : tuple[int, int], optional
+            first and last published year, None for no bound.
+        price : tuple[float, float], optional
+            lowest and highest price, None for no bound.
+        remaining : tuple[int, int], optional
+            lowest and highest remaining stock, None for no bound.
+        author : str, optional
+            Author of the books, in any case.
+        sort_by : str, optional
+            pub_date, price, remaining or author.
+        descending : bool, optional
+            whether to start with the largest values.
+        page_size : int, optional
+            Maximum number of books to return, all of them if None.
+        offset : int, optional
+            Number of matching books to skip.
+
+        Returns:
+        --------
+        books : list[Book]
+            Books of the page.
+
+        Raises:
+        -------
+        ValueError
+            If sort_by isn't one of the sorted fields.
+        """
+        if sort_by not in SORT_FIELDS:
+            raise ValueError(sort_by, f"Invalid sort field, use one of {', '.join(SORT_FIELDS)}.")
+        ranges = {"pub_date": pub_date, "price": price, "remaining": remaining}
+        ranges = {field: bounds for field, bounds in ranges.items() if bounds is not None}
+        if author is not None:
+            ranges["author"] = (author.casefold(), author.casefold())
+        return select_books(self.get_sorted_indexes(), ranges, sort_by, descending, page_size, offset)
+
+    def get_sorted_indexes(self) -> dict[str, SortedIndex]:
+        """
+        Returns the sorted indexes, building them on first use.
+
+        Returns:
+        --------
+        sorted_indexes : dict[str, SortedIndex]
+            Books sorted by each of SORT_FIELDS.
+        """
+        if self.sorted_indexes is None:
+            self.sorted_indexes = {field: SortedIndex(SORT_KEYS[field], self.bookdb) for field in SORT_FIELDS}
+            # Moving the books in the remaining index whenever their stock changes.
+            watch_stocks(self.sorted_indexes["remaining"])
+        return self.sorted_indexes
+
     def check_duplicates(self, bookid) -> Book:
         """
         Returns a Book object with lib_id attribute same as the bookid.
@@ -531,12 +971,8 @@ class Library:
             Book with lib_id attribute same as the bookid.
 
         """
-        # Iterating through all the books in the list.
-        for book in self.bookdb:
-            # Check for bookid
-            if (bookid == book.lib_id):
-                return book  # Returns book is bookid matches lib_id
-        return None  # Returns None if nothing was found in the end
+        # Looking up the book in the id index, same as find_book_by_id.
+        return self.id_index.get(normalize_key(bookid))
 
     def print_notes(self, notes: Note = None):
         """
@@ -552,63 +988,150 @@ class Library:
             # Gets notes from the user
             noteid = self.get_noteid(checkReturned=False)
             notes = self.create_notes(noteid)
-        columns = get_terminal_columns()  # Getting terminal columns
-        # A lot of printing with a lot of formatting.
-        print(f"{self.name}".center(columns))
-        print(f"Sender: {self.user}".rjust(columns))
-        print(f"{''.join(['-' for x in range(columns)])}")
-        print("Invoice")
-        print(f"Receiver: {notes.name}")
-        print(f"Date: {notes.borroweddate.strftime('%d %B, %Y')}")
-        print(f"Return Due: {notes.returndate.strftime('%d %B, %Y')}")
-        # Printing returned date as well if notes are returned
-        if notes.returned:
-            print(f"Returned Date: {notes.returneddate.strftime('%d %B, %Y')}")
-        # Printing transaction table
-        header = f"|{'Book ID':<10} | {'Book Name':<50} | {'Author':<20} | {'Price':<10}|"
-        print_center(
-            f"{''.join(['-' for x in range(len(header))])}")
-        print_center(header)
-        for book in notes.books:
-            print_center(
-                f"|{book.lib_id:<10} | {book.name:<50} | {book.author:<20} | {book.price:<10}|")
-        if notes.returned:
-            print_center(
-                f"|{'':<10} | {'':<50} | {'Fine':<20} | {notes.fine:<10}|")
-            print_center(
-                f"|{'':<10} | {'':<50} | {'Total':<20} | {notes.final_cost:<10}|")
-        else:
-            print_center(
-                f"|{'':<10} | {'':<50} | {'Initial Total':<20} | {notes.cost:<10}|")
-        print(f"{''.join(['-' for x in range(len(header))])}".center(columns))
-        # Transaction table end
-        # Some end notes printing
-        print(f"{''.join(['-' for x in range(columns)])}")
-        print("Kindly return the book before or at the due date.")
-        print("Note: You will be fined Rs.10 per day for late return.")
+        # Rendering the invoice for the width of the terminal in one write.
+        print(self.get_note_text(notes, get_terminal_columns()), end="")
 
     def savebookdb(self):
         """
         Saves the Library's Database to file.
         """
-        # Calling the save function from libraryfs module
-        savebookstocks(self.bookdb)
+        # Every change is already in the stock journal, so the snapshot is
+        # only rewritten once the journal grows large, with the changes of
+        # the other processes included.
+        with lockedstocks():
+            self.sync_stocks()
+            compactbookstocks(self.bookdb)
 
+    def sync_stocks(self):
+        """
+        Applies the stock changes saved by other processes to the Library's Database.
 
-def print_center(to_print: str):
+        Stock checks are only reliable when this is called under lockedstocks().
+        """
+        syncbookstocks(self.bookdb, self.find_book_by_id, self.apply_stock_change)
+
+    def apply_stock_change(self, action: str, book: Book):
+        """
+        Updates the lookup indexes for a book added or removed by another process.
+
+        Parameters:
+        -----------
+        action : str
+            ADD, REMOVE, or RELOAD when the whole database was loaded again.
+        book : Book or None
+            Book object added or removed.
+        """
+        if action == "ADD":
+            self.index_book(book)
+        elif action == "REMOVE":
+            self.unindex_book(book)
+        elif action == "RELOAD":
+            self.build_indexes()
+            # Cached notes hold the books from before the reload.
+            self.notes_cache.clear()
+
+    def show_stock_report(self):
+        """
+        Prints the stock analytics of the Library's Database.
+        """
+        try:
+            report = stock_report(self.bookdb)
+        except ImportError as e:
+            print(f"ERROR! {e.args[0]}")
+            return
+        print(f"Titles: {report['titles']}, copies: {report['copies']}, borrowed: {report['borrowed']}")
+        print(f"Available titles: {report['available_titles']}, out of stock: {report['out_of_stock']}")
+        print(f"Average utilization: {report['mean_utilization']:.1%}, "
+              f"fully borrowed titles: {report['fully_borrowed_share']:.1%}")
+        for key, title in [("authors", "Author"), ("publishers", "Publisher")]:
+            heading = f"|{title:<30}|{'Potential (per 10 days)':<25}|{'Current (per 10 days)':<25}|"
+            rows = (f"|{name:<30}|{potential:<25.2f}|{current:<25.2f}|"
+                    for name, potential, current in report[key])
+            print_table(f"Revenue by {title.lower()}", heading, rows)
+        # Grouping the years by decade for the display.
+        decades = {}
+        for year, count in report["years"].items():
+            decades[year // 10 * 10] = decades.get(year // 10 * 10, 0) + count
+        heading = f"|{'Decade':<10}|{'Books':<10}|"
+        rows = (f"|{f'{decade}s':<10}|{count:<10}|" for decade, count in sorted(decades.items()))
+        print_table("Books by publication decade", heading, rows)
+
+    def build_indexes(self):
+        """
+        Rebuilds the lookup indexes from the Library's Database.
+        """
+        self.id_index: dict[str, Book] = {}
+        self.name_index: dict[str, list[Book]] = {}
+        self.trigram_index = TrigramIndex()
+        # Building the word index only when searching, as it isn't needed to log in.
+        self.text_index = None
+        self.sorted_indexes = None
+        # Indexing the books in the database order.
+        for book in self.bookdb:
+            self.index_book(book)
+
+    def index_book(self, book: Book):
+        """
+        Adds a book to the lookup indexes.
+
+        Parameters:
+        -----------
+        book : Book
+            Book object to be indexed.
+        """
+        # The first book with an id keeps it, same as the old linear scan.
+        self.id_index.setdefault(normalize_key(book.lib_id), book)
+        self.name_index.setdefault(normalize_key(book.name), []).append(book)
+        self.trigram_index.add(normalize_key(book.name))
+        if self.text_index is not None:
+            self.text_index.add(book)
+        if self.sorted_indexes is not None:
+            for index in self.sorted_indexes.values():
+                index.add(book)
+
+    def unindex_book(self, book: Book):
+        """
+        Removes a book from the lookup indexes.
+
+        Parameters:
+        -----------
+        book : Book
+            Book object to be removed from the indexes.
+        """
+        id_key = normalize_key(book.lib_id)
+        if self.id_index.get(id_key) is book:
+            del self.id_index[id_key]
+        name_key = normalize_key(book.name)
+        books = self.name_index.get(name_key, [])
+        if book in books:
+            books.remove(book)
+            self.trigram_index.remove(name_key)
+        if not books:
+            self.name_index.pop(name_key, None)
+        if self.text_index is not None:
+            self.text_index.remove(book)
+        if self.sorted_indexes is not None:
+            for index in self.sorted_indexes.values():
+                index.remove(book)
+        # Cached notes may hold the removed book.
+        self.notes_cache.clear()
+
+
+def normalize_key(key: str) -> str:
     """
-    Prints the string in center.
+    Returns the key used for the lookup indexes.
 
     Parameters:
     -----------
-    to_print : str
-        String to be printed in the center.
+    key : str
+        Book ID or book name.
+
+    Returns:
+    --------
+    key : str
+        Case folded key.
     """
-    # Getting the terminal columns
-    columns = get_terminal_columns()
-    # Printing the string with no line break in the end.
-    # There is no line break here due to formatting errors.
-    print(to_print.center(columns), end="")
+    return key.casefold()
 
 
 # Program testing purposes.
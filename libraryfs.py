@@ -1,10 +1,78 @@
+import os
+import zlib
+import struct
+import marshal
+import threading
+from contextlib import contextmanager
 from book import Book
 
+try:
+    import fcntl
+except ImportError:
+    # Advisory file locks aren't available on Windows.
+    fcntl = None
 
-def loadbookstocks() -> dict:
+# Snapshot of the book stocks, rewritten only on compaction.
+STOCKS_PATH = "./data/bookstocks.txt"
+# Binary copy of the snapshot for faster loading.
+BINARY_PATH = "./data/bookstocks.bin"
+# Binary snapshot header: magic, version, payload checksum, text checksum, text mtime, text size.
+BINARY_HEADER = struct.Struct("<8sHIIqq")
+BINARY_MAGIC = b"PYLMSBK\0"
+BINARY_VERSION = 1
+# Journal of the stock changes made after the snapshot.
+JOURNAL_PATH = "./data/bookstocks.journal"
+# Number of journal entries after which savebookdb compacts the journal.
+COMPACT_THRESHOLD = 1000
+# Lock file held while the book stocks files are read or changed.
+LOCK_PATH = "./data/bookstocks.lock"
+# State of the journal followed by this process.
+journal_state = {
+    # Checksum of the snapshot the in-memory books were loaded from.
+    "checksum": None,
+    # Entries in the journal, None until there is a valid journal for the snapshot.
+    "entries": None,
+    # Open journal being followed and the bytes of it applied to the books.
+    "file": None,
+    "offset": 0,
+    # Byte ranges (start to end, keyed by journal inode and start) written
+    # by this process, which aren't applied again when following the journal.
+    "own": {},
+}
+# Lock file and nesting depth of lockedstocks() in this process.
+lock_state = {"file": None, "depth": 0, "lock": threading.RLock()}
+
+
+@contextmanager
+def lockedstocks():
+    """
+    Holds the exclusive lock on the book stocks files.
+
+    The lock is an advisory fcntl lock shared with the other processes using
+    the same data directory. It can be nested, and only the outermost use
+    takes the file lock. Without fcntl only the threads are locked.
+    """
+    with lock_state["lock"]:
+        if lock_state["depth"] == 0 and fcntl is not None:
+            lock_state["file"] = open(LOCK_PATH, "a")
+            fcntl.flock(lock_state["file"].fileno(), fcntl.LOCK_EX)
+        lock_state["depth"] += 1
+        try:
+            yield
+        finally:
+            lock_state["depth"] -= 1
+            if lock_state["depth"] == 0 and lock_state["file"] is not None:
+                fcntl.flock(lock_state["file"].fileno(), fcntl.LOCK_UN)
+                lock_state["file"].close()
+                lock_state["file"] = None
+
+
+def loadbookstocks() -> list:
     """
     Returns the books stocks details as list.
 
+    The snapshot is loaded first and the journal is replayed on top of it.
+
     Book details format:
     --------------------
     bookid,bookname,author,publisher,pub_date,totalqnty,remaining,price(per 10 days)
@@ -14,33 +82,342 @@ def loadbookstocks() -> dict:
     bookdb : list
         contains book objects containing the book details.
     """
-
-    # This will be the Python dictionary containing all the book details with their id as its key.
-    bookdb = []
-    # Opening the book stocks file inside a context manager
-    with open("./data/bookstocks.txt", "r") as bookstocks:
-        # Reading all the lines from the file
-        books_detail = bookstocks.readlines()
-    # Iterating through the lines one by one.
-    for book_details in books_detail:
-        # Removing the last line break escape sequence at the end
-        book_details = book_details.strip("\n")
-        # Splitting and assigning them to proper variables
-        bookid, bookname, author, publisher, pub_date, total, remaining, price = book_details.split(
-            ",")
-        # Creating an object of the book.
-        book_to_add = Book(bookid, bookname, author, publisher,
-                           pub_date, int(total), float(price), int(remaining))
-        # Adding the book to the list.
-        bookdb.append(book_to_add)
+    with lockedstocks():
+        # Using the binary snapshot when it is up to date with the text file.
+        bookdb = loadbinarystocks()
+        if bookdb is None:
+            # This will be the Python dictionary containing all the book details with their id as its key.
+            bookdb = []
+            # Opening the book stocks file inside a context manager
+            with open(STOCKS_PATH, "rb") as bookstocks:
+                # Reading the whole snapshot for the checksum.
+                snapshot = bookstocks.read()
+            journal_state["checksum"] = zlib.crc32(snapshot)
+            # Iterating through the lines one by one.
+            for book_details in snapshot.decode().splitlines():
+                # Creating an object of the book and adding it to the list.
+                bookdb.append(parsebook(book_details))
+            # Regenerating the binary snapshot for the next start.
+            savebinarystocks(bookdb, journal_state["checksum"])
+        # Applying the changes made after the snapshot.
+        journal_state["entries"] = replayjournal(bookdb)
     # Returns the main list after adding all the book details.
     return bookdb
 
 
+def parsebook(book_details: str) -> Book:
+    """
+    Returns a Book object from a line of the book stocks file.
+
+    Parameters:
+    -----------
+    book_details : str
+        book details in the book stocks format, without the line break.
+
+    Returns:
+    --------
+    book : Book
+        book object containing the book details.
+    """
+    # Splitting and assigning them to proper variables
+    bookid, bookname, author, publisher, pub_date, total, remaining, price = book_details.split(
+        ",")
+    return Book(bookid, bookname, author, publisher,
+                pub_date, int(total), float(price), int(remaining))
+
+
+def replayjournal(bookdb: list) -> int:
+    """
+    Returns the number of journal entries applied to the book list, or None without a valid journal.
+
+    Journal format:
+    ---------------
+    SNAPSHOT:checksum,previous -> first line, checksum of the snapshot the journal belongs to
+                                  and of the snapshot before it
+    BORROW:bookid -> on borrow
+    RETURN:bookid -> on return
+    ADD:bookdetails -> on addition, in the book stocks format
+    REMOVE:bookid -> on removal
+
+    A journal belonging to another snapshot is ignored, since the snapshot
+    already has its changes. The journal is kept open to follow the entries
+    added by other processes with syncbookstocks.
+
+    Parameters:
+    -----------
+    bookdb : list
+        contains book objects loaded from the snapshot.
+
+    Returns:
+    --------
+    entries : int or None
+        number of entries applied.
+    """
+    closejournal()
+    journal, checksum, _, header_size = openjournal()
+    if journal is None or checksum != journal_state["checksum"]:
+        if journal is not None:
+            journal.close()
+        return None
+    # Dropping a partially written last entry, so that new entries start on a new line.
+    entries = journal.read()
+    complete = entries.rfind(b"\n") + 1
+    if complete < len(entries):
+        os.truncate(JOURNAL_PATH, header_size + complete)
+    journal_state.update(file=journal, offset=header_size, entries=0)
+    # Books keyed by their ID for applying the entries.
+    books = {}
+    for book in bookdb:
+        books.setdefault(book.lib_id, book)
+
+    def update_books(action, book):
+        if action == "ADD":
+            books.setdefault(book.lib_id, book)
+        elif action == "REMOVE":
+            books.pop(book.lib_id, None)
+    readjournal(bookdb, books.get, update_books)
+    return journal_state["entries"]
+
+
+def openjournal() -> tuple:
+    """
+    Returns the journal opened for reading with the checksums in its first line.
+
+    Returns:
+    --------
+    journal, checksum, previous, header_size : tuple
+        open journal positioned after the first line, snapshot checksum, checksum
+        of the snapshot before it and size of the first line, or Nones if there
+        isn't a valid journal.
+    """
+    try:
+        journal = open(JOURNAL_PATH, "rb")
+    except IOError:
+        return None, None, None, 0
+    header = journal.readline()
+    try:
+        if not (header.startswith(b"SNAPSHOT:") and header.endswith(b"\n")):
+            raise ValueError(header)
+        # Journals without the previous checksum were started without a compaction.
+        checksums = header[9:].decode().split(",")
+        checksum = int(checksums[0])
+        previous = int(checksums[1]) if len(checksums) > 1 else checksum
+    except ValueError:
+        journal.close()
+        return None, None, None, 0
+    return journal, checksum, previous, len(header)
+
+
+def closejournal():
+    """
+    Stops following the journal.
+    """
+    if journal_state["file"] is not None:
+        journal_state["file"].close()
+    journal_state.update(file=None, offset=0)
+
+
+def readjournal(bookdb: list, lookup, onchange=None):
+    """
+    Applies the complete entries added to the followed journal since the last read.
+
+    Parameters:
+    -----------
+    bookdb : list
+        contains book objects to apply the entries to.
+    lookup : callable
+        returns the Book object with the given ID, or None.
+    onchange : callable, optional
+        called with the action and the Book object for every ADD and REMOVE.
+    """
+    journal = journal_state["file"]
+    inode = os.fstat(journal.fileno()).st_ino
+    journal.seek(journal_state["offset"])
+    entries = journal.read()
+    # Leaving a partially written last entry for the next read.
+    entries = entries[:entries.rfind(b"\n") + 1]
+    position = journal_state["offset"]
+    own = journal_state["own"]
+    for entry in entries.splitlines(keepends=True):
+        start = position
+        position += len(entry)
+        # Skipping the entries written by this process.
+        if (inode, start) in own or any(key[0] == inode and key[1] < start < end
+                                        for key, end in own.items()):
+            continue
+        action, detail = entry.decode().rstrip("\n").split(":", 1)
+        book = applyentry(bookdb, lookup, action, detail)
+        journal_state["entries"] += 1
+        if book is not None and onchange is not None and action in ("ADD", "REMOVE"):
+            onchange(action, book)
+    journal_state["offset"] = position
+    # Forgetting the ranges that have been passed.
+    for key in [key for key in own if key[0] == inode and own[key] <= position]:
+        del own[key]
+
+
+def applyentry(bookdb: list, lookup, action: str, detail: str) -> Book:
+    """
+    Returns the Book object changed by the journal entry, or None if the book isn't there.
+
+    Parameters:
+    -----------
+    bookdb : list
+        contains book objects to apply the entry to.
+    lookup : callable
+        returns the Book object with the given ID, or None.
+    action : str
+        BORROW, RETURN, ADD or REMOVE.
+    detail : str
+        book ID, or the book details in the book stocks format for ADD.
+    """
+    if action == "ADD":
+        book = parsebook(detail)
+        bookdb.append(book)
+        return book
+    book = lookup(detail)
+    if book is None:
+        return None
+    if action == "BORROW":
+        book.add_stock(-1)
+    elif action == "RETURN":
+        book.add_stock(1)
+    elif action == "REMOVE":
+        bookdb.remove(book)
+    return book
+
+
+def syncbookstocks(bookdb: list, lookup, onchange=None) -> bool:
+    """
+    Applies the stock changes journalled by other processes to the book list.
+
+    Returns False if the list had to be reloaded from the snapshot instead,
+    which happens when another process compacted more than one journal since
+    the last sync. onchange is then called with "RELOAD" and None.
+
+    Parameters:
+    -----------
+    bookdb : list
+        contains book objects to apply the changes to.
+    lookup : callable
+        returns the Book object with the given ID, or None.
+    onchange : callable, optional
+        called with the action and the Book object for every ADD and REMOVE.
+
+    Returns:
+    --------
+    True/False : bool
+        bool value depending on whether the changes were applied or the list was reloaded.
+    """
+    with lockedstocks():
+        following = journal_state["file"] is not None
+        if following:
+            readjournal(bookdb, lookup, onchange)
+        try:
+            inode = os.stat(JOURNAL_PATH).st_ino
+        except OSError:
+            return True
+        if following and os.fstat(journal_state["file"].fileno()).st_ino == inode:
+            return True
+        journal, checksum, previous, header_size = openjournal()
+        if journal is None:
+            return True
+        if checksum == journal_state["checksum"] or (following and previous == journal_state["checksum"]):
+            # A journal for the same snapshot was started, or the followed journal
+            # was compacted into a new snapshot after all of it was read above.
+            closejournal()
+            journal_state.update(file=journal, offset=header_size, checksum=checksum, entries=0)
+            readjournal(bookdb, lookup, onchange)
+            return True
+        # Some entries were compacted without being read, so loading everything again.
+        journal.close()
+        bookdb[:] = loadbookstocks()
+        if onchange is not None:
+            onchange("RELOAD", None)
+        return False
+
+
+def journalstock(action: str, detail: str) -> bool:
+    """
+    Returns True when the stock change has been added to the journal.
+
+    Parameters:
+    -----------
+    action : str
+        BORROW, RETURN, ADD or REMOVE.
+    detail : str
+        book ID, or the book details in the book stocks format for ADD.
+
+    Returns:
+    --------
+    True/False : bool
+        bool value depending on the success or failure.
+    """
+    return journalstocks([(action, detail)])
+
+
+def journalstocks(changes: list) -> bool:
+    """
+    Returns True when all the stock changes have been added to the journal in one write.
+
+    The changes are written under the lock and are never applied again by this
+    process. Stock checks against the other processes need syncbookstocks first.
+
+    Parameters:
+    -----------
+    changes : list[tuple[str, str]]
+        pairs of action and detail, same as journalstock.
+
+    Returns:
+    --------
+    True/False : bool
+        bool value depending on the success or failure.
+    """
+    # Removing the line break at the end of the book details.
+    data = "".join([f"{action}:{detail}".rstrip("\n") + "\n" for action, detail in changes]).encode()
+    try:
+        with lockedstocks():
+            if journal_state["file"] is None:
+                journal, checksum, _, header_size = openjournal()
+                if journal is not None and checksum == journal_state["checksum"]:
+                    # Following the journal another process started for the snapshot.
+                    journal_state.update(file=journal, offset=header_size, entries=0)
+                else:
+                    if journal is not None:
+                        journal.close()
+                    # Starting a new journal for the current snapshot if there isn't a valid one.
+                    header = f"SNAPSHOT:{journal_state['checksum']},{journal_state['checksum']}\n".encode()
+                    writeatomic(JOURNAL_PATH, header + data)
+                    journal_state.update(file=open(JOURNAL_PATH, "rb"), offset=len(header) + len(data),
+                                         entries=len(changes))
+                    return True
+            with open(JOURNAL_PATH, "ab") as journal:
+                position = journal.tell()
+                journal.write(data)
+                # The change is only recorded once it is on the disk, same as the snapshot.
+                journal.flush()
+                os.fsync(journal.fileno())
+                inode = os.fstat(journal.fileno()).st_ino
+            if inode == os.fstat(journal_state["file"].fileno()).st_ino and position == journal_state["offset"]:
+                journal_state["offset"] += len(data)
+            else:
+                # Remembering the entries so that they aren't applied again when read.
+                journal_state["own"][(inode, position)] = position + len(data)
+            journal_state["entries"] += len(changes)
+        return True
+    except IOError:
+        return False
+
+
 def savebookstocks(bookdb: list) -> bool:
     """
     Returns True when saving is complete.
 
+    This writes a new snapshot and starts an empty journal for it. Both are
+    written to temporary files and renamed into place, so a crash leaves
+    either the old snapshot with its journal or the new one. The list needs
+    to be synced with syncbookstocks first when other processes share the files.
+
     Book details format:
     --------------------
     bookid,bookname,author,publisher,pub_date,totalqnty,remaining,price(per 10 days)
@@ -57,11 +434,18 @@ def savebookstocks(bookdb: list) -> bool:
     """
 
     # A list comprehension to get all the details for saving.
-    stringToWrite = [book.getStockText() for book in bookdb]
+    stringToWrite = "".join([book.getStockText() for book in bookdb]).encode()
+    checksum = zlib.crc32(stringToWrite)
     # Attempt to write the data into the bookstocks.txt file
     try:
-        with open("./data/bookstocks.txt", "w") as bookstocks:
-            bookstocks.writelines(stringToWrite)
+        with lockedstocks():
+            writeatomic(STOCKS_PATH, stringToWrite)
+            savebinarystocks(bookdb, checksum)
+            header = f"SNAPSHOT:{checksum},{journal_state['checksum']}\n".encode()
+            writeatomic(JOURNAL_PATH, header)
+            closejournal()
+            journal_state.update(checksum=checksum, entries=0, file=open(JOURNAL_PATH, "rb"),
+                                 offset=len(header), own={})
         # Returns True when everything went smooth.
         return True
     except IOError:
@@ -69,6 +453,115 @@ def savebookstocks(bookdb: list) -> bool:
         return False
 
 
+def loadbinarystocks() -> list:
+    """
+    Returns the books from the binary snapshot, or None if it is missing or out of date.
+
+    The binary snapshot is out of date when the text file has been changed
+    after it was written, or when its checksum doesn't match.
+
+    Returns:
+    --------
+    bookdb : list or None
+        contains book objects containing the book details.
+    """
+    try:
+        stocks_stat = os.stat(STOCKS_PATH)
+        with open(BINARY_PATH, "rb") as binary:
+            header = binary.read(BINARY_HEADER.size)
+            payload = binary.read()
+    except IOError:
+        return None
+    if len(header) != BINARY_HEADER.size:
+        return None
+    magic, version, payload_checksum, text_checksum, text_mtime, text_size = BINARY_HEADER.unpack(
+        header)
+    # Checking that the snapshot is valid and made from the current text file.
+    if (magic != BINARY_MAGIC or version != BINARY_VERSION
+            or text_mtime != stocks_stat.st_mtime_ns or text_size != stocks_stat.st_size
+            or zlib.crc32(payload) != payload_checksum):
+        return None
+    journal_state["checksum"] = text_checksum
+    return [Book(*book_details) for book_details in marshal.loads(payload)]
+
+
+def savebinarystocks(bookdb: list, text_checksum: int) -> bool:
+    """
+    Returns True when the binary snapshot has been written.
+
+    Binary snapshot format:
+    -----------------------
+    header -> magic, version, payload checksum, text checksum, text mtime, text size
+    payload -> marshalled list of (bookid,bookname,author,publisher,pub_date,total,price,remaining)
+
+    Parameters:
+    -----------
+    bookdb : list
+        contains book objects, same as the text file.
+    text_checksum : int
+        checksum of the text file, used by the journal.
+
+    Returns:
+    --------
+    True/False : bool
+        bool value depending on the success or failure.
+    """
+    payload = marshal.dumps([(book.lib_id, book.name, book.author, book.publisher, book.pub_date,
+                              book.total, book.price, book.remaining) for book in bookdb])
+    try:
+        stocks_stat = os.stat(STOCKS_PATH)
+        header = BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, zlib.crc32(payload),
+                                    text_checksum, stocks_stat.st_mtime_ns, stocks_stat.st_size)
+        writeatomic(BINARY_PATH, header + payload)
+        return True
+    except IOError:
+        return False
+
+
+def compactbookstocks(bookdb: list, threshold: int = COMPACT_THRESHOLD) -> bool:
+    """
+    Returns True when the journal is compacted into a new snapshot.
+
+    The changes are already saved in the journal, so the snapshot is only
+    rewritten once the journal has grown past the threshold.
+
+    Parameters:
+    -----------
+    bookdb : list
+        contains book objects containing the book details.
+    threshold : int, optional
+        number of journal entries needed for compaction.
+
+    Returns:
+    --------
+    True/False : bool
+        bool value depending on whether the compaction was done.
+    """
+    with lockedstocks():
+        if (journal_state["entries"] or 0) < threshold:
+            return False
+        return savebookstocks(bookdb)
+
+
+def writeatomic(path: str, data: bytes):
+    """
+    Writes the data to a temporary file and renames it over the path.
+
+    Parameters:
+    -----------
+    path : str
+        path of the file to write.
+    data : bytes
+        contents of the file.
+    """
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as temp_file:
+        temp_file.write(data)
+        temp_file.flush()
+        os.fsync(temp_file.fileno())
+    os.replace(temp_path, path)
+
+
 if __name__ == "__main__":
     books = loadbookstocks()
     print(books)
@@ -0,0 +1,530 @@
+"""
+Loan records kept in a few append-only segment files instead of two files per note.
+
+Every borrow and return appends one record to the active segment, which is
+rotated once it grows past SEGMENT_SIZE. The index maps each note ID to the
+segment, offset and length of its records, so a note is read with one pread
+per record, and reports can scan the segments in order.
+
+Set the LMS_STORAGE environment variable to "log" to use it, after importing
+the existing notes with: python loanlog.py migrate
+"""
+import os
+import sys
+import json
+import threading
+from libraryfs import lockedstocks
+from lrucache import invalidatenotes
+from notesmanager import catalognote, iternotes
+
+# Directory of the segment files and their index.
+LOG_DIR = "./data/loanlog"
+# Size in bytes after which a new segment is started.
+SEGMENT_SIZE = 64 * 1024 * 1024
+# Index of the records: noteid,segment,offset,length,OPEN,cost or noteid,segment,offset,length,RETURNED
+INDEX_PATH = "./data/loanlog/index.txt"
+# In memory copy of the index, loaded on first use.
+loan_index = None
+# Read only file descriptors of the segments, opened on first read.
+segment_fds = {}
+segment_lock = threading.Lock()
+
+
+def segmentpath(segment: int) -> str:
+    """
+    Returns the path of the segment file.
+
+    Parameters:
+    -----------
+    segment : int
+        number of the segment.
+    """
+    return os.path.join(LOG_DIR, f"segment-{segment:06d}.log")
+
+
+def segments() -> list[int]:
+    """
+    Returns the numbers of the segment files, oldest first.
+    """
+    if not os.path.isdir(LOG_DIR):
+        return []
+    return sorted([int(filename[8:-4]) for filename in os.listdir(LOG_DIR)
+                   if filename.startswith("segment-") and filename.endswith(".log")])
+
+
+def loadloanindex() -> dict:
+    """
+    Returns the index of the loan records, reading only the entries added since the last call.
+
+    When the index is read from the start, the records that a crash left
+    in the newest segment without their index entries are indexed too.
+
+    Returns:
+    --------
+    index : dict
+        "locations" maps the note ID to the segment, offset and length of its records, oldest first.
+        "borrowers", "returned", "timestamps" and "costs" are the same as in loadnotescatalog.
+        "ends" maps the segment to the end offset of its last indexed record.
+    """
+    global loan_index
+    if not os.path.isfile(INDEX_PATH):
+        rebuildloanindex()
+    index_size = os.path.getsize(INDEX_PATH)
+    # Reading the index again if it is new or was rebuilt by another process.
+    fresh = loan_index is None or index_size < loan_index["offset"]
+    if fresh:
+        loan_index = {"locations": {}, "borrowers": {}, "returned": {},
+                      "timestamps": {}, "costs": {}, "ends": {}, "offset": 0}
+    if index_size != loan_index["offset"]:
+        loadindexentries(loan_index)
+    if fresh:
+        indextail(loan_index)
+    return loan_index
+
+
+def loadindexentries(index: dict):
+    """
+    Adds the entries written to the index file after the offset of the in memory index.
+
+    Parameters:
+    -----------
+    index : dict
+        in memory index returned by loadloanindex.
+    """
+    with open(INDEX_PATH, "rb") as index_file:
+        index_file.seek(index["offset"])
+        entries = index_file.read()
+    # Leaving a partially written last entry for the next read.
+    complete = entries.rfind(b"\n") + 1
+    index["offset"] += complete
+    unsorted = set()
+    for entry in entries[:complete].decode().splitlines():
+        # Splitting from the right, as the note ID may have commas.
+        fields = entry.rsplit(",", 4)
+        cost = None
+        if fields[-1] != "RETURNED":
+            # Open loans have their cost after the status.
+            fields = entry.rsplit(",", 5)
+            cost = float(fields.pop())
+        noteid, segment, offset, length, status = fields
+        segment, offset, length = int(segment), int(offset), int(length)
+        index["locations"].setdefault(noteid, []).append((segment, offset, length))
+        index["ends"][segment] = max(index["ends"].get(segment, 0), offset + length)
+        catalognote(index, noteid, status == "RETURNED", cost, unsorted)
+    for slug in unsorted:
+        index["borrowers"][slug].sort(key=index["timestamps"].get)
+
+
+def indextail(index: dict) -> int:
+    """
+    Indexes the records of the newest segment after its last index entry, and returns their number.
+
+    appendrecords writes the records before their index entries, so a crash
+    in between leaves records in the segment that the index doesn't list.
+
+    Parameters:
+    -----------
+    index : dict
+        in memory index returned by loadloanindex.
+    """
+    numbers = segments()
+    if not numbers or os.path.getsize(segmentpath(numbers[-1])) <= index["ends"].get(numbers[-1], 0):
+        return 0
+    segment = numbers[-1]
+    entries = []
+    noteids = []
+    with lockedstocks():
+        # An append may have been finishing meanwhile, its entries aren't missing.
+        loadindexentries(index)
+        offset = index["ends"].get(segment, 0)
+        with open(segmentpath(segment), "rb") as segment_file:
+            segment_file.seek(offset)
+            for line in segment_file:
+                try:
+                    record = json.loads(line) if line.endswith(b"\n") else None
+                except ValueError:
+                    record = None
+                # Skipping the records torn by a crash, same as iterrecords.
+                if record is not None:
+                    entries.append(indexentry(record, segment, offset, len(line)))
+                    noteids.append(record["noteid"])
+                offset += len(line)
+        if entries:
+            with open(INDEX_PATH, "a") as index_file:
+                index_file.write("".join(entries))
+                index_file.flush()
+                os.fsync(index_file.fileno())
+            loadindexentries(index)
+    if noteids:
+        print(f"WARNING! Indexed {len(entries)} loan records missing from the index after a crash.",
+              file=sys.stderr)
+        invalidatenotes(noteids)
+    return len(entries)
+
+
+def indexentry(record: dict, segment: int, offset: int, length: int) -> str:
+    """
+    Returns the line of the index for a record.
+
+    Parameters:
+    -----------
+    record : dict
+        record written to the segment.
+    segment : int
+        number of the segment.
+    offset : int
+        offset of the record in the segment.
+    length : int
+        length of the record in bytes.
+    """
+    if record["returned"]:
+        return f"{record['noteid']},{segment},{offset},{length},RETURNED\n"
+    return f"{record['noteid']},{segment},{offset},{length},OPEN,{record['cost']}\n"
+
+
+def appendrecords(records: list):
+    """
+    Appends the records to the active segment and their entries to the index.
+
+    The records of one call always go to the same segment, in one write.
+
+    Parameters:
+    -----------
+    records : list[dict]
+        note ID, returned status, cost and data file notes of each record.
+    """
+    lines = [json.dumps(record).encode() + b"\n" for record in records]
+    with lockedstocks():
+        # Creating the index from the existing segments before the first entry.
+        if not os.path.isfile(INDEX_PATH):
+            rebuildloanindex()
+        # Indexing the records of an append that crashed before writing its entries.
+        indextail(loadloanindex())
+        numbers = segments() or [1]
+        segment = numbers[-1]
+        offset = os.path.getsize(segmentpath(segment)) if os.path.isfile(segmentpath(segment)) else 0
+        # Rotating the segment once it is full, a segment always gets at least one write.
+        if offset and offset + sum([len(line) for line in lines]) > SEGMENT_SIZE:
+            segment += 1
+            offset = 0
+        # Ending a record torn by a crash, so that it stays on a line of its own.
+        prefix = b""
+        if offset and readsegment(segment, offset - 1, 1) != b"\n":
+            prefix = b"\n"
+            offset += 1
+        entries = []
+        for record, line in zip(records, lines):
+            entries.append(indexentry(record, segment, offset, len(line)))
+            offset += len(line)
+        with open(segmentpath(segment), "ab") as segment_file:
+            segment_file.write(prefix + b"".join(lines))
+        with open(INDEX_PATH, "a") as index_file:
+            index_file.write("".join(entries))
+    invalidatenotes([record["noteid"] for record in records])
+
+
+def segmentfd(segment: int) -> int:
+    """
+    Returns the read only file descriptor of the segment, opened on first use.
+
+    Parameters:
+    -----------
+    segment : int
+        number of the segment.
+    """
+    with segment_lock:
+        if segment not in segment_fds:
+            segment_fds[segment] = os.open(segmentpath(segment), os.O_RDONLY)
+        return segment_fds[segment]
+
+
+def readrecord(segment: int, offset: int, length: int) -> dict:
+    """
+    Returns the record at the offset of the segment.
+
+    Parameters:
+    -----------
+    segment : int
+        number of the segment.
+    offset : int
+        offset of the record in the segment.
+    length : int
+        length of the record in bytes.
+    """
+    return json.loads(readsegment(segment, offset, length))
+
+
+def readsegment(segment: int, offset: int, length: int) -> bytes:
+    """
+    Returns the bytes at the offset of the segment.
+
+    Parameters:
+    -----------
+    segment : int
+        number of the segment.
+    offset : int
+        offset of the bytes in the segment.
+    length : int
+        number of bytes to read.
+    """
+    # pread doesn't move a shared file position, so the threads can share the descriptor.
+    return os.pread(segmentfd(segment), length, offset)
+
+
+def iterrecords():
+    """
+    Yields every record with its segment, offset and length, in the order they were written.
+
+    Records torn by a crash are skipped.
+    """
+    for segment in segments():
+        offset = 0
+        with open(segmentpath(segment), "rb") as segment_file:
+            for line in segment_file:
+                try:
+                    record = json.loads(line) if line.endswith(b"\n") else None
+                except ValueError:
+                    record = None
+                if record is not None:
+                    yield record, segment, offset, len(line)
+                offset += len(line)
+
+
+def rebuildloanindex() -> int:
+    """
+    Rebuilds the index from the segment files.
+
+    The new index is written to a temporary file and renamed over the old one.
+
+    Returns:
+    --------
+    total : int
+        Total number of records in the rebuilt index.
+    """
+    global loan_index
+    os.makedirs(LOG_DIR, exist_ok=True)
+    # Holding the lock so that no record is appended while the segments are scanned.
+    with lockedstocks():
+        entries = [indexentry(*record) for record in iterrecords()]
+        temp_path = f"{INDEX_PATH}.tmp"
+        with open(temp_path, "w") as index_file:
+            index_file.writelines(entries)
+            index_file.flush()
+            os.fsync(index_file.fileno())
+        os.replace(temp_path, INDEX_PATH)
+    # Forgetting the in memory copy so that it is read again.
+    loan_index = None
+    return len(entries)
+
+
+def loadnotes(noteid: str) -> list[str]:
+    """
+    Returns the notes about a person, same as notesmanager.loadnotes.
+
+    Parameters:
+    -----------
+    noteid : str
+        id for uniquely identifying the notes.
+
+    Returns:
+    --------
+    notes : list[str]
+        lines of the data file notes, None if the note doesn't exist.
+    """
+    locations = loadloanindex()["locations"].get(noteid)
+    if locations is None:
+        return None
+    return "".join([readrecord(*location)["data"] for location in locations]).splitlines()
+
+
+def notesversion(noteid: str) -> tuple:
+    """
+    Returns the version of the notes, which changes whenever a record is added.
+
+    Parameters:
+    -----------
+    noteid : str
+        id for uniquely identifying the notes.
+
+    Returns:
+    --------
+    version : tuple or None
+        segment, offset and length of the last record, None if the note doesn't exist.
+    """
+    locations = loadloanindex()["locations"].get(noteid)
+    return locations[-1] if locations else None
+
+
+def searchnotes(keyword: str, checkReturned: bool) -> list:
+    """
+    Returns a list of note IDs of the borrower from the index.
+
+    Parameters:
+    -----------
+    keyword : str
+        borrower slug (name in lowercase with hyphens) to search for.
+    checkReturned : bool
+        to skip returned notes or not.
+
+    Returns:
+    --------
+    search_results : list
+        list of all the note IDs of the borrower, oldest first.
+    """
+    index = loadloanindex()
+    borrower_notes = index["borrowers"].get(keyword, [])
+    if checkReturned:
+        return [noteid for noteid in borrower_notes if not index["returned"][noteid]]
+    return list(borrower_notes)
+
+
+def listnotes() -> list:
+    """
+    Returns the note IDs of all the notes in the index.
+    """
+    return list(loadloanindex()["returned"])
+
+
+def openloans() -> tuple:
+    """
+    Returns the note IDs, borrow timestamps and costs of all the open notes, from the index.
+
+    Returns:
+    --------
+    noteids, timestamps, costs : tuple[list[str], list[int], list[float]]
+        open notes with their borrow timestamps and costs without fine.
+    """
+    index = loadloanindex()
+    noteids = [noteid for noteid, returned in index["returned"].items() if not returned]
+    return noteids, [index["timestamps"][noteid] for noteid in noteids], [index["costs"][noteid] for noteid in noteids]
+
+
+def noterecord(noteid: str, returned: bool, note_data_file: str) -> dict:
+    """
+    Returns the record of a borrow or a return.
+
+    Parameters:
+    -----------
+    noteid : str
+        id for uniquely identifying the notes.
+    returned : bool
+        Boolean value representing if it is a return.
+    note_data_file : str
+        data file notes added by the borrow or return.
+    """
+    # Same cost as notesmanager.notescost, only needed for the open notes.
+    cost = None if returned else sum([float(line.rsplit(",", 1)[1]) for line in note_data_file.splitlines()
+                                      if line.startswith("BORROW:")])
+    return {"noteid": noteid, "returned": returned, "cost": cost, "data": note_data_file}
+
+
+def savenotes(noteid: str, note_data_file: str) -> bool:
+    """
+    Returns True when the borrow record is saved, same as notesmanager.savenotes.
+
+    Parameters:
+    -----------
+    noteid : str
+        id for uniquely identifying the notes.
+    note_data_file : str
+        notes to add to the new data file.
+
+    Returns:
+    --------
+    True/False : bool
+        Boolean Value depending on the success or failure.
+    """
+    try:
+        appendrecords([noterecord(noteid, False, note_data_file)])
+        return True
+    except IOError:
+        return False
+
+
+def addtonotes(noteid: str, note_data_file: str) -> bool:
+    """
+    Returns True when the return record is saved, same as notesmanager.addtonotes.
+
+    Parameters:
+    -----------
+    noteid : str
+        id for uniquely identifying the notes.
+    note_data_file : str
+        notes to add to the existing data file.
+
+    Returns:
+    --------
+    True/False : bool
+        Boolean Value depending on the success or failure.
+    """
+    try:
+        appendrecords([noterecord(noteid, True, note_data_file)])
+        return True
+    except IOError:
+        return False
+
+
+def savenotesbatch(borrows: list, returns: list) -> bool:
+    """
+    Returns True when all the borrow and return records of a batch are saved with one write.
+
+    Parameters:
+    -----------
+    borrows : list[tuple[str, str]]
+        note ID and data file notes of each borrow, same as savenotes.
+    returns : list[tuple[str, str]]
+        note ID and data file notes of each return, same as addtonotes.
+
+    Returns:
+    --------
+    True/False : bool
+        Boolean Value depending on the success or failure.
+    """
+    try:
+        # Borrows go first, so a note borrowed and returned in the batch ends up returned.
+        appendrecords([noterecord(noteid, False, note_data_file) for noteid, note_data_file in borrows] +
+                      [noterecord(noteid, True, note_data_file) for noteid, note_data_file in returns])
+        return True
+    except IOError:
+        return False
+
+
+def migrate() -> int:
+    """
+    Returns the number of notes copied from the notes directory into the segments.
+
+    Each note becomes one record with its whole data file. Notes
+    already in the index are skipped, so it can be run again safely.
+
+    Returns:
+    --------
+    total : int
+        Total number of notes migrated.
+    """
+    known = set(loadloanindex()["locations"])
+    records = []
+    for noteid, path in iternotes():
+        if noteid in known:
+            continue
+        with open(path) as note:
+            note_data_file = note.read()
+        lines = note_data_file.splitlines()
+        records.append(noterecord(noteid, bool(lines) and lines[-1].startswith("RETURN:"), note_data_file))
+        # Writing in chunks to keep the memory use bounded.
+        if len(records) == 10000:
+            appendrecords(records)
+            records = []
+    if records:
+        appendrecords(records)
+    return len(loadloanindex()["locations"]) - len(known)
+
+
+# Importing the notes files with: python loanlog.py migrate
+# Rebuilding the index with: python loanlog.py rebuild
+if __name__ == "__main__":
+    if sys.argv[1:] == ["migrate"]:
+        print(f"Migrated {migrate()} notes to {LOG_DIR}.")
+    elif sys.argv[1:] == ["rebuild"]:
+        print(f"Rebuilt the loan log index with {rebuildloanindex()} records.")
+    else:
+        print("Usage: python loanlog.py migrate|rebuild")
@@ -0,0 +1,159 @@
+import weakref
+import threading
+from collections import OrderedDict
+
+# Caches of parsed notes, told about every note written by this process, whichever the backend.
+notes_caches = weakref.WeakSet()
+
+
+class LRUCache:
+    """
+    A class to represent a bounded cache dropping the least recently used entries.
+
+    Every entry is stored with a version, and a lookup with another version is a miss.
+
+    Attributes:
+    -----------
+    maxsize : int
+        Maximum number of entries.
+    entries : OrderedDict
+        Versions and values keyed by the key, least recently used first.
+    hits : int
+        Lookups that found the entry with the same version.
+    misses : int
+        Lookups that didn't.
+    evictions : int
+        Entries dropped to keep the size.
+
+    Methods:
+    --------
+    get(key, version):
+        Returns the value stored with the version, or None.
+    put(key, version, value):
+        Stores the value with its version.
+    pop(key):
+        Removes the entry.
+    clear():
+        Removes all the entries.
+    stats():
+        Returns the hit and miss statistics.
+    """
+
+    def __init__(self, maxsize: int):
+        """
+        Constructor for the LRUCache object.
+
+        Parameters:
+        -----------
+        maxsize : int
+            Maximum number of entries.
+        """
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, version):
+        """
+        Returns the value stored with the version, or None.
+
+        Parameters:
+        -----------
+        key : hashable
+            Key of the entry.
+        version : any
+            Version the value has to be stored with.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version, value):
+        """
+        Stores the value with its version.
+
+        Parameters:
+        -----------
+        key : hashable
+            Key of the entry.
+        version : any
+            Version of the value, None to leave it uncached.
+        value : any
+            Value to store.
+        """
+        if version is None:
+            self.pop(key)
+            return
+        with self.lock:
+            self.entries[key] = (version, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        """
+        Removes the entry.
+
+        Parameters:
+        -----------
+        key : hashable
+            Key of the entry.
+        """
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        """
+        Removes all the entries.
+        """
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Returns the hit and miss statistics.
+
+        Returns:
+        --------
+        stats : dict
+            hits, misses, hit ratio, evictions, size and maxsize.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses,
+                    "hit_ratio": self.hits / lookups if lookups else 0.0,
+                    "evictions": self.evictions, "size": len(self.entries), "maxsize": self.maxsize}
+
+
+def registernotescache(cache: LRUCache):
+    """
+    Registers a cache of parsed notes to drop the notes written by this process.
+
+    Parameters:
+    -----------
+    cache : LRUCache
+        cache keyed by note ID, kept until it is garbage collected.
+    """
+    notes_caches.add(cache)
+
+
+def invalidatenotes(noteids: list):
+    """
+    Drops the written notes from the registered caches.
+
+    Parameters:
+    -----------
+    noteids : list[str]
+        ids of the written notes.
+    """
+    for cache in list(notes_caches):
+        for noteid in noteids:
+            cache.pop(noteid)
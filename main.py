@@ -1,8 +1,11 @@
 from library import Library
 from input_funcs import get_login_menu, get_main_menu
 from time import sleep
+from instrumentation import enable_from_environment
 
 
+# Recording the timings when LMS_METRICS is set.
+enable_from_environment()
 username = get_login_menu()
 my_library = Library("Islington Library", username)
 print(f"Hello, {username}! Welcome to the {my_library.name}'s Main Menu.")
@@ -25,6 +28,10 @@ while True:
     elif option == "8":
         my_library.savebookdb()
         print("The database has been saved.")
+    elif option == "10":
+        my_library.show_stock_report()
+    elif option == "11":
+        my_library.search_catalog()
     else:
         print("Saving the database...")
         my_library.savebookdb()
@@ -32,7 +32,7 @@ class Note:
     
     Methods:
     --------
-    mark_returned():
+    mark_returned(returneddate=None):
         Mark the note as returned.
     calculate_cost():
         Calculate the total cost, after adding fine.
@@ -40,6 +40,8 @@ class Note:
         Returns the borrow notes to be written in data file.
     get_return_notes():
         Returns the borrow notes to be written in data file.
+    from_lines(note_lines, find_book):
+        Returns a Note object based on the lines of the data file.
     """
     def __init__(self, name: str, books: list[Book], borroweddate: datetime.datetime, returned: bool = False, returneddate: datetime.datetime = None, late_days: int = 0, final_cost: float = 0.0):
         """
@@ -74,11 +76,70 @@ class Note:
         if final_cost != 0.0:
             self.fine = final_cost - self.cost
 
-    def mark_returned(self):
+    @classmethod
+    def from_lines(cls, note_lines: list[str], find_book):
+        """
+        Returns a Note object based on the lines of the data file.
+
+        Parameters:
+        -----------
+        note_lines : list[str]
+            lines of the data file, same as loadnotes.
+        find_book : callable
+            function returning the Book object with the given name, or None.
+
+        Returns:
+        --------
+        note : Note
+            Note object based on the lines.
+
+        Raises:
+        -------
+        ValueError
+            If the lines have no borrow line or a value can't be read.
+        """
+        # Some default values
+        returned = False
+        returneddate = None
+        late_days = 0
+        final_cost = 0.0
+        books = []  # Books list of book object that was borrowed.
+        for note_line in note_lines:
+            if note_line.startswith("BORROW:"):
+                # Getting borrow values from the line accordingly.
+                note_args = note_line[7:].split(",")
+                name = note_args[0]
+                borroweddate = datetime.datetime.fromisoformat(note_args[2])
+                book = find_book(note_args[1])
+                if book is None:
+                    # A stand-in for a book removed since the borrow, with the name and price of the line.
+                    # It has no ID and no stock, so returning it changes no stock.
+                    book = Book("", note_args[1], "", "", "", 0, float(note_args[-1]))
+                books.append(book)
+            elif note_line.startswith("RETURN:"):
+                # Getting return values from the line accordingly
+                note_args = note_line[8:].split(",")
+                returned = True
+                returneddate = datetime.datetime.fromisoformat(note_args[1])
+                late_days = int(note_args[2])
+                final_cost = float(note_args[3])
+        if not books:
+            raise ValueError(note_lines, "No Borrow Lines.")
+        # Creating note object based on the file values
+        return cls(name, books, borroweddate, returned, returneddate, late_days, final_cost)
+
+    def mark_returned(self, returneddate: datetime.datetime = None):
         """
         Mark the note as returned.
+
+        Parameters:
+        -----------
+        returneddate : datetime.datetime, optional
+            Date when the book was returned, now by default.
         """
-        self.returneddate = datetime.datetime.now()
+        if returneddate is None:
+            returneddate = datetime.datetime.now()
+        self.returneddate = returneddate
         self.returned = True
 
     def calculate_cost(self):
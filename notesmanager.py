@@ -1,4 +1,21 @@
 import os
+import sys
+import hashlib
+# Shared by the backends, and exported to storage with the other functions.
+from lrucache import registernotescache, invalidatenotes
+
+# Directory of the notes, in the flat or the sharded layout.
+NOTES_DIR = "./data/notes"
+# Nested directories of the sharded layout, and hex digits of the borrower hash naming each of them.
+SHARD_DEPTH = 2
+SHARD_WIDTH = 2
+# Flags to open an existing note file with, by mode.
+OPEN_FLAGS = {"r": os.O_RDONLY, "w": os.O_WRONLY | os.O_TRUNC, "a": os.O_WRONLY | os.O_APPEND}
+
+# File keeping the catalog of all the notes and their status.
+CATALOG_PATH = "./data/notescatalog.txt"
+# In memory copy of the catalog, loaded on first use.
+notes_catalog = None
 
 
 def loadnotes(noteid: str) -> list[str]:
@@ -23,7 +40,7 @@ def loadnotes(noteid: str) -> list[str]:
     # A try catch block for errors.
     try:
         # Opening the file in a context manager
-        with open(f"./data/notes/{noteid}.data", "r") as usernotes:
+        with opennote(noteid, "data", "r") as usernotes:
             notes = usernotes.readlines()  # Loading the file with lines
         notess = [note.strip("\n") for note in notes]
         return notess  # Returning the lines list.
@@ -31,7 +48,7 @@ def loadnotes(noteid: str) -> list[str]:
         return None  # Returns None in case of IOError
 
 
-def addtonotes(noteid: str, note_file_text:str ,note_data_file: str) -> bool:
+def addtonotes(noteid: str, note_data_file: str) -> bool:
     """
     Returns True when addition is complete.
 
@@ -41,8 +58,6 @@ def addtonotes(noteid: str, note_file_text:str ,note_data_file: str) -> bool:
     -----------
     noteid : str
         id for uniquely identifying the notes.
-    note_file_text : str
-        notes to write for the text file.
     note_data_file : str
         notes to add to the existing data file.
 
@@ -54,66 +69,413 @@ def addtonotes(noteid: str, note_file_text:str ,note_data_file: str) -> bool:
     # A try block to catch any errors in case there is one.
     try:
         # Opening the file in a context manager
-        with open(f"./data/notes/{noteid}.txt", "w") as usernotes:
-            # Writing the notes to the end of the file.
-            usernotes.write(note_file_text)
-        with open(f"./data/notes/{noteid}.data", "a") as usernotesdata:
+        with opennote(noteid, "data", "a") as usernotesdata:
             # Writing the notes to the end of the file.
             usernotesdata.write(note_data_file)
+        # Marking the note as returned in the catalog.
+        addtocatalog(noteid, True)
+        invalidatenotes([noteid])
         return True  # Returns True after everything goes properly
     except IOError:
         return False  # Returns False in case of IOError.
 
 
+def sharddirectory(slug: str) -> str:
+    """
+    Returns the directory of the borrower's notes in the sharded layout.
+
+    Parameters:
+    -----------
+    slug : str
+        borrower slug (name in lowercase with hyphens).
+
+    Returns:
+    --------
+    directory : str
+        nested directories named after the hash of the slug, like ./data/notes/3f/a2.
+    """
+    digest = hashlib.md5(slug.encode()).hexdigest()
+    return os.path.join(NOTES_DIR, *[digest[level * SHARD_WIDTH:(level + 1) * SHARD_WIDTH]
+                                     for level in range(SHARD_DEPTH)])
+
+
+def notepath(noteid: str, extension: str, sharded: bool = True) -> str:
+    """
+    Returns the path of a note file in the sharded or the flat layout.
+
+    Parameters:
+    -----------
+    noteid : str
+        id for uniquely identifying the notes.
+    extension : str
+        "txt" or "data".
+    sharded : bool, optional
+        Boolean value to get the path in the sharded layout instead of the flat one.
+    """
+    if sharded:
+        return os.path.join(sharddirectory(noteid.rsplit("-", 1)[0]), f"{noteid}.{extension}")
+    return os.path.join(NOTES_DIR, f"{noteid}.{extension}")
+
+
+def opennote(noteid: str, extension: str, mode: str = "r"):
+    """
+    Opens a note file in whichever layout it is, new files are created in the sharded layout.
+
+    Existing files are opened without creating them, so a file moved by the
+    migration in between is found at its new path instead of being created again.
+
+    Parameters:
+    -----------
+    noteid : str
+        id for uniquely identifying the notes.
+    extension : str
+        "txt" or "data".
+    mode : str, optional
+        "r", "w" or "a".
+
+    Returns:
+    --------
+    file : file
+        the opened note file.
+
+    Raises:
+    -------
+    FileNotFoundError
+        If the file doesn't exist in either layout and the mode is "r".
+    """
+    # The sharded path is tried again last, in case the migration moved the file in between.
+    for sharded in (True, False, True):
+        try:
+            # Opening with the module open, so the instrumentation counts it too.
+            return open(notepath(noteid, extension, sharded), mode,
+                        opener=lambda path, _: os.open(path, OPEN_FLAGS[mode]))
+        except FileNotFoundError:
+            pass
+    path = notepath(noteid, extension)
+    if mode == "r":
+        raise FileNotFoundError(f"No such note: {path}")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return open(path, mode)
+
+
+def iternotes():
+    """
+    Yields the note ID and data file path of every note, in both layouts.
+
+    A note being moved by the migration can be yielded from both layouts.
+    """
+    for directory, _, filenames in os.walk(NOTES_DIR):
+        for filename in filenames:
+            if filename.endswith(".data"):
+                yield filename[:-5], os.path.join(directory, filename)
+
+
+def migratenotes() -> int:
+    """
+    Moves the notes of the flat layout into the sharded layout.
+
+    It is safe to run while the Library is in use: every file is linked into
+    the shard before its flat path is removed, so it is always found in one of
+    the layouts, and files opened before the move keep writing to the same file.
+
+    Returns:
+    --------
+    total : int
+        Total number of files moved.
+    """
+    moved = 0
+    with os.scandir(NOTES_DIR) as entries:
+        for entry in entries:
+            if not entry.is_file() or not entry.name.endswith((".txt", ".data")):
+                continue
+            noteid, extension = entry.name.rsplit(".", 1)
+            target = notepath(noteid, extension)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            try:
+                os.link(entry.path, target)
+            except FileExistsError:
+                # Left by an interrupted migration, and the sharded file is the one read first.
+                pass
+            os.unlink(entry.path)
+            moved += 1
+    return moved
+
+
+def notesversion(noteid: str) -> tuple:
+    """
+    Returns the version of the notes, which changes whenever the data file is written.
+
+    Parameters:
+    -----------
+    noteid : str
+        id for uniquely identifying the notes.
+
+    Returns:
+    --------
+    version : tuple or None
+        modification time and size of the data file, None if it doesn't exist.
+    """
+    # The sharded path is tried again last, in case the migration moved the file in between.
+    for sharded in (True, False, True):
+        try:
+            stat = os.stat(notepath(noteid, "data", sharded))
+            return (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            pass
+    return None
+
+
 def searchnotes(keyword: str, checkReturned: bool) -> list:
     """
-    Returns a list of names of files that match the keyword form the notes directory.
+    Returns a list of note IDs of the borrower from the notes catalog.
 
     Parameters:
     -----------
     keyword : str
-        keyword to search for in the notes directory.
+        borrower slug (name in lowercase with hyphens) to search for.
     checkReturned : bool
         to skip returned notes or not.
 
     Returns:
     --------
     search_results : list
-        list of all the file names that match the keyword.
-    """
-    # Initiating a list to contain the search results.
-    search_results = []
-    # Looping through all files/folders in notes directory.
-    for filename in os.listdir("./data/notes/"):
-        # A check if the path is a file.
-        if os.path.isfile(f"./data/notes/{filename}"):
-            if filename.endswith(".data"):
-                # A check if the book has already been returned.
-                if checkReturned:
-                    with open(f"./data/notes/{filename}") as note:
-                        lines = note.readlines()
-                    if lines[-1].startswith("RETURN:"):
-                        continue
-                # A check if the file is txt and has keyword in it.
-                if keyword in filename:
-                    # Adding the filename to the list
-                    search_results.append(filename.strip('.data'))
-    # Retunrning the search results.
-    return search_results
-
-
-def savenotes(noteid: str, note_file_text: str, note_data_file: str) -> bool:
+        list of all the note IDs of the borrower, oldest first.
+    """
+    catalog = loadnotescatalog()
+    # Getting the borrower's notes from the catalog.
+    borrower_notes = catalog["borrowers"].get(keyword, [])
+    # A check if the book has already been returned.
+    if checkReturned:
+        return [noteid for noteid in borrower_notes if not catalog["returned"][noteid]]
+    return list(borrower_notes)
+
+
+def loadnotescatalog() -> dict:
+    """
+    Returns the notes catalog, reading only the entries added since the last call.
+
+    Catalog format:
+    ---------------
+    noteid,OPEN,cost -> on borrow, cost is missing in older catalogs
+    noteid,RETURNED -> on return
+
+    The note ID is borrowerslug-timestamp, so the later entry for a note wins.
+    The catalog is rebuilt from the notes directory if it doesn't exist.
+
+    Returns:
+    --------
+    catalog : dict
+        "borrowers" maps the borrower slug to note IDs, oldest first.
+        "returned" maps the note ID to its returned status.
+        "timestamps" maps the note ID to its timestamp.
+        "costs" maps the note ID to its cost without fine, when it is known.
+    """
+    global notes_catalog
+    # Recovering the catalog from the raw files in case it is missing.
+    if not os.path.isfile(CATALOG_PATH):
+        rebuildnotescatalog()
+    catalog_size = os.path.getsize(CATALOG_PATH)
+    # Reading the catalog again if it is new or was rebuilt by another process.
+    if notes_catalog is None or catalog_size < notes_catalog["offset"]:
+        notes_catalog = {"borrowers": {}, "returned": {},
+                         "timestamps": {}, "costs": {}, "offset": 0}
+    # Nothing was appended after the last read.
+    if catalog_size == notes_catalog["offset"]:
+        return notes_catalog
+    # Reading the entries appended after the last read, by any process.
+    with open(CATALOG_PATH, "rb") as catalog_file:
+        catalog_file.seek(notes_catalog["offset"])
+        entries = catalog_file.read()
+    # Leaving a partially written last entry for the next read.
+    complete = entries.rfind(b"\n") + 1
+    notes_catalog["offset"] += complete
+    unsorted = set()
+    for entry in entries[:complete].decode().splitlines():
+        noteid, status = entry.rsplit(",", 1)
+        cost = None
+        if status not in ("OPEN", "RETURNED"):
+            noteid, status = noteid.rsplit(",", 1)
+            cost = float(entry.rsplit(",", 1)[1])
+        catalognote(notes_catalog, noteid, status == "RETURNED", cost, unsorted)
+    for slug in unsorted:
+        notes_catalog["borrowers"][slug].sort(key=notes_catalog["timestamps"].get)
+    return notes_catalog
+
+
+def catalognote(catalog: dict, noteid: str, returned: bool, cost: float, unsorted: set):
+    """
+    Adds an entry for the note to an in memory catalog.
+
+    Parameters:
+    -----------
+    catalog : dict
+        catalog with the "borrowers", "returned", "timestamps" and "costs" of loadnotescatalog.
+    noteid : str
+        id for uniquely identifying the notes.
+    returned : bool
+        Boolean value representing if the note has been returned or not.
+    cost : float
+        cost of the open note without fine, None if it isn't known.
+    unsorted : set[str]
+        slugs of the borrowers whose notes have to be sorted, updated in place.
+    """
+    if cost is not None:
+        catalog["costs"][noteid] = cost
+    if noteid not in catalog["returned"]:
+        slug, timestamp = noteid.rsplit("-", 1)
+        catalog["timestamps"][noteid] = int(timestamp)
+        borrower_notes = catalog["borrowers"].setdefault(slug, [])
+        # Entries mostly come oldest first, so only the borrowers out of order are sorted after the read.
+        if borrower_notes and catalog["timestamps"][borrower_notes[-1]] > int(timestamp):
+            unsorted.add(slug)
+        borrower_notes.append(noteid)
+    catalog["returned"][noteid] = returned
+    if returned:
+        catalog["costs"].pop(noteid, None)
+
+
+def addtocatalog(noteid: str, returned: bool, cost: float = None):
+    """
+    Appends an entry for the note to the notes catalog.
+
+    Each entry is a single line written with one append, so readers never see half an update.
+
+    Parameters:
+    -----------
+    noteid : str
+        id for uniquely identifying the notes.
+    returned : bool
+        Boolean value representing if the note has been returned or not.
+    cost : float, optional
+        cost of the note without fine, recorded for open notes.
+    """
+    addtocatalogentries([(noteid, returned, cost)])
+
+
+def addtocatalogentries(entries: list):
+    """
+    Appends the entries to the notes catalog in one write.
+
+    Parameters:
+    -----------
+    entries : list[tuple]
+        note ID, returned status and optionally the cost, in the order they happened.
+    """
+    # Creating the catalog from the existing files before the first entry.
+    if not os.path.isfile(CATALOG_PATH):
+        rebuildnotescatalog()
+    lines = [catalogentry(*entry) for entry in entries]
+    with open(CATALOG_PATH, "a") as catalog_file:
+        catalog_file.write("".join(lines))
+
+
+def catalogentry(noteid: str, returned: bool, cost: float = None) -> str:
+    """
+    Returns the line of the notes catalog for the note.
+
+    Parameters:
+    -----------
+    noteid : str
+        id for uniquely identifying the notes.
+    returned : bool
+        Boolean value representing if the note has been returned or not.
+    cost : float, optional
+        cost of the note without fine, only written for open notes.
+    """
+    if returned:
+        return f"{noteid},RETURNED\n"
+    if cost is None:
+        return f"{noteid},OPEN\n"
+    return f"{noteid},OPEN,{cost}\n"
+
+
+def notescost(note_data_file: str) -> float:
+    """
+    Returns the cost without fine of the notes, the sum of the prices on the BORROW lines.
+
+    Parameters:
+    -----------
+    note_data_file : str
+        notes in the data file format, or a list of its lines.
+    """
+    if isinstance(note_data_file, str):
+        note_data_file = note_data_file.splitlines()
+    return sum([float(line.rsplit(",", 1)[1]) for line in note_data_file if line.startswith("BORROW:")])
+
+
+def listnotes() -> list:
+    """
+    Returns the note IDs of all the notes in the catalog.
+    """
+    return list(loadnotescatalog()["returned"])
+
+
+def openloans() -> tuple:
+    """
+    Returns the note IDs, borrow timestamps and costs of all the open notes.
+
+    Everything comes from the notes catalog, only the notes missing a cost
+    in an older catalog are read from their files.
+
+    Returns:
+    --------
+    noteids, timestamps, costs : tuple[list[str], list[int], list[float]]
+        open notes with their borrow timestamps and costs without fine.
+    """
+    catalog = loadnotescatalog()
+    costs = catalog["costs"]
+    noteids = [noteid for noteid, returned in catalog["returned"].items() if not returned]
+    for noteid in noteids:
+        if noteid not in costs:
+            costs[noteid] = notescost(loadnotes(noteid) or [])
+    return noteids, [catalog["timestamps"][noteid] for noteid in noteids], [costs[noteid] for noteid in noteids]
+
+
+def rebuildnotescatalog() -> int:
+    """
+    Rebuilds the notes catalog from the notes directory.
+
+    The new catalog is written to a temporary file and renamed over the old one.
+
+    Returns:
+    --------
+    total : int
+        Total number of notes in the rebuilt catalog.
+    """
+    global notes_catalog
+    entries = {}
+    # Looping through the notes of both layouts, a note being migrated is only counted once.
+    for noteid, path in iternotes():
+        try:
+            with open(path) as note:
+                lines = note.readlines()
+        except FileNotFoundError:
+            continue  # Moved by the migration, and found again in its shard.
+        # The note has been returned if the last line is a return record.
+        returned = bool(lines) and lines[-1].startswith("RETURN:")
+        entries[noteid] = catalogentry(noteid, returned, None if returned else notescost(lines))
+    temp_path = f"{CATALOG_PATH}.tmp"
+    with open(temp_path, "w") as catalog_file:
+        catalog_file.writelines(entries.values())
+        catalog_file.flush()
+        os.fsync(catalog_file.fileno())
+    os.replace(temp_path, CATALOG_PATH)
+    # Forgetting the in memory copy so that it is read again.
+    notes_catalog = None
+    return len(entries)
+
+
+def savenotes(noteid: str, note_data_file: str) -> bool:
     """
     Returns True when saving is complete.
 
     This is to be done when the book is borrowed. This also creates the file in case it doesn't exist or overwrites existing one. So, use this carefully.
+    Only the data file is written, the invoice is rendered from it when needed.
 
     Parameters:
     -----------
     noteid : str
         id for uniquely identifying the notes.
-    note_file_text : str
-        notes to write for the text file.
     note_data_file : str
         notes to add to the new data file.
 
@@ -125,12 +487,57 @@ def savenotes(noteid: str, note_file_text: str, note_data_file: str) -> bool:
     # A try block to catch any errors in case there is one
     try:
         # Opening the file in a context manager
-        with open(f"./data/notes/{noteid}.txt", "w") as usernotes:
-            # Writing the notes to the end of the file.
-            usernotes.write(note_file_text)
-        with open(f"./data/notes/{noteid}.data", "w") as usernotesdata:
+        with opennote(noteid, "data", "w") as usernotesdata:
             # Writing the notes to the end of the file.
             usernotesdata.write(note_data_file)
+        # Adding the note to the catalog as open, with its cost for the overdue report.
+        addtocatalog(noteid, False, notescost(note_data_file))
+        invalidatenotes([noteid])
         return True  # Returns True after everything went smoothly
     except IOError:
         return False  # Returns False in case of an error.
+
+
+def savenotesbatch(borrows: list, returns: list) -> bool:
+    """
+    Returns True when all the borrow and return notes of a batch are saved.
+
+    The data files are written first and the catalog gets all the entries in one write.
+
+    Parameters:
+    -----------
+    borrows : list[tuple[str, str]]
+        note ID and data file notes of each borrow, same as savenotes.
+    returns : list[tuple[str, str]]
+        note ID and data file notes of each return, same as addtonotes.
+
+    Returns:
+    --------
+    True/False : bool
+        Boolean Value depending on the success or failure.
+    """
+    try:
+        for noteid, note_data_file in borrows:
+            with opennote(noteid, "data", "w") as usernotesdata:
+                usernotesdata.write(note_data_file)
+        for noteid, note_data_file in returns:
+            with opennote(noteid, "data", "a") as usernotesdata:
+                usernotesdata.write(note_data_file)
+        # Borrows go first, so a note borrowed and returned in the batch ends up returned.
+        addtocatalogentries([(noteid, False, notescost(note_data_file)) for noteid, note_data_file in borrows] +
+                            [(noteid, True) for noteid, _ in returns])
+        invalidatenotes([noteid for noteid, _ in borrows + returns])
+        return True
+    except IOError:
+        return False
+
+
+# Rebuilding the catalog with: python notesmanager.py rebuild
+# Moving the notes to the sharded layout with: python notesmanager.py migrate
+if __name__ == "__main__":
+    if sys.argv[1:] == ["rebuild"]:
+        print(f"Rebuilt the notes catalog with {rebuildnotescatalog()} notes.")
+    elif sys.argv[1:] == ["migrate"]:
+        print(f"Moved {migratenotes()} note files to the sharded layout.")
+    else:
+        print("Usage: python notesmanager.py rebuild|migrate")
@@ -0,0 +1,122 @@
+"""
+Batch overdue and fine computation across all the open loans.
+
+The borrow timestamps and costs come from the notes catalog (or the loans
+table), so no note is parsed. NumPy is required here.
+
+Usage: python overdue.py [--date 2030-01-01T00:00:00] [--limit 20] [--csv overdue.csv]
+"""
+import csv
+import sys
+import argparse
+from datetime import datetime
+from storage import openloans
+from extras import print_table
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Days a loan lasts and fine per late day, same as Note.
+LOAN_DAYS = 10
+FINE_PER_DAY = 10.0
+# Columns of the CSV report.
+REPORT_FIELDS = ["noteid", "borrower", "borrowed", "due", "late_days", "cost", "fine", "owed"]
+
+
+def compute_fines(timestamps, costs, now: datetime) -> dict:
+    """
+    Returns the days overdue, fines and amounts owed of the loans.
+
+    Same as Note.calculate_cost: the fine is Rs.10 for each whole day past
+    the due date, 10 days after borrowing.
+
+    Parameters:
+    -----------
+    timestamps : array-like of int
+        borrow timestamps of the loans.
+    costs : array-like of float
+        costs of the loans without fine.
+    now : datetime
+        date the fines are computed at.
+
+    Returns:
+    --------
+    fines : dict
+        "late_days", "fine" and "owed" arrays.
+
+    Raises:
+    -------
+    ImportError
+        If NumPy isn't installed.
+    """
+    if np is None:
+        raise ImportError("NumPy is required for the overdue report.")
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    costs = np.asarray(costs, dtype=np.float64)
+    due = timestamps + LOAN_DAYS * 86400
+    late_days = np.floor((now.timestamp() - due) / 86400).astype(np.int64)
+    fine = np.where(late_days > 0, late_days * FINE_PER_DAY, 0.0)
+    return {"late_days": late_days, "fine": fine, "owed": costs + fine}
+
+
+def overdue_report(now: datetime = None, limit: int = None) -> list[dict]:
+    """
+    Returns the overdue open loans, highest amount owed first.
+
+    Parameters:
+    -----------
+    now : datetime, optional
+        date the fines are computed at, now by default.
+    limit : int, optional
+        maximum number of loans to return, all of them if None.
+
+    Returns:
+    --------
+    report : list[dict]
+        noteid, borrower, borrowed and due dates, late days, cost, fine and owed of each loan.
+    """
+    if now is None:
+        now = datetime.now()
+    noteids, timestamps, costs = openloans()
+    fines = compute_fines(timestamps, costs, now)
+    overdue = np.flatnonzero(fines["late_days"] > 0)
+    # Sorting by the amount owed, highest first, keeping the catalog order for equal amounts.
+    order = overdue[np.argsort(-fines["owed"][overdue], kind="stable")]
+    report = []
+    for index in order[:limit]:
+        borrowed = datetime.fromtimestamp(timestamps[index])
+        report.append({
+            "noteid": noteids[index],
+            "borrower": noteids[index].rsplit("-", 1)[0].replace("-", " ").title(),
+            "borrowed": borrowed.date().isoformat(),
+            "due": datetime.fromtimestamp(timestamps[index] + LOAN_DAYS * 86400).date().isoformat(),
+            "late_days": int(fines["late_days"][index]),
+            "cost": float(costs[index]),
+            "fine": float(fines["fine"][index]),
+            "owed": float(fines["owed"][index]),
+        })
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report the overdue loans by amount owed.")
+    parser.add_argument("--date", help="ISO date to compute the fines at (now by default)")
+    parser.add_argument("--limit", type=int, help="number of loans to report (all by default)")
+    parser.add_argument("--csv", help="CSV file for the report instead of the table")
+    args = parser.parse_args()
+    report = overdue_report(datetime.fromisoformat(args.date) if args.date else None, args.limit)
+    if args.csv:
+        with open(args.csv, "w", newline="") as report_file:
+            writer = csv.DictWriter(report_file, REPORT_FIELDS)
+            writer.writeheader()
+            writer.writerows(report)
+    else:
+        heading = (f"|{'Note ID':<30}|{'Borrower':<20}|{'Due':<10}|{'Late Days':<10}|"
+                   f"{'Fine':<10}|{'Owed':<10}|")
+        rows = (f"|{loan['noteid']:<30}|{loan['borrower']:<20}|{loan['due']:<10}|{loan['late_days']:<10}|"
+                f"{loan['fine']:<10.2f}|{loan['owed']:<10.2f}|" for loan in report)
+        print_table("Overdue loans by amount owed", heading, rows)
+    print(f"{len(report)} overdue loans, Rs.{sum([loan['owed'] for loan in report]):.2f} owed.",
+          file=sys.stderr)
@@ -0,0 +1,426 @@
+"""
+Local asyncio service holding one Library for many front desk clients.
+
+Protocol (one JSON object per line each way):
+---------------------------------------------
+{"action": "borrow", "borrower": name, "books": [names or IDs], "date": ISO date (optional)}
+{"action": "return", "noteid": noteid or "borrower": name, "date": ISO date (optional)}
+{"action": "search", "query": name or ID, "limit": number of suggestions (optional)}
+{"action": "list", "available": true/false, "offset": 0, "limit": 100}
+{"action": "find", "query": words (e.g. "author:rowl* potter"), "offset": 0, "limit": 100}
+{"action": "notes", "borrower": name, "returned": true/false}
+{"action": "stats"} -> hit and miss statistics of the parsed notes cache
+
+Every response has "status" ("ok" or "error") and the request's "id" if it had one.
+Errors have a "message". Borrows and returns are applied by a background
+writer, which commits every request waiting at the time with one savebatch
+call, so the event loop never waits for the disk.
+
+Usage: python server.py [--host 127.0.0.1] [--port 8765] [--unix path] [--user server]
+"""
+import sys
+import json
+import asyncio
+import argparse
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from library import Library
+from fulltext import rank_books
+from batch import Batch
+from storage import searchnotes, lockedstocks
+from errors import BookError, NoteNotFound
+from instrumentation import enable_from_environment
+
+# Default address of the service.
+HOST = "127.0.0.1"
+PORT = 8765
+# Borrows and returns committed together at most.
+GROUP_SIZE = 1000
+# Books listed by default.
+LIST_LIMIT = 100
+# Longest request or response line in bytes.
+LINE_LIMIT = 2 ** 24
+
+
+class LibraryServer:
+    """
+    A class to represent the service holding the Library.
+
+    Attributes:
+    -----------
+    library : Library
+        Library shared by all the clients.
+    lock : threading.Lock
+        Lock held while the Library is read or changed outside the event loop.
+    notes_lock : threading.Lock
+        Lock held while the notes catalog is read, and by the writer for the whole commit.
+    queue : asyncio.Queue
+        borrows and returns waiting for the writer, with their futures.
+    writer : ThreadPoolExecutor
+        single thread committing the borrows and returns.
+    readers : ThreadPoolExecutor
+        threads answering the searches and listings.
+
+    Methods:
+    --------
+    handle_client(reader, writer):
+        Answers the requests of a client connection.
+    handle_request(request):
+        Returns the response to a request.
+    write_changes():
+        Commits the queued borrows and returns until cancelled.
+    commit(operations):
+        Applies and saves the borrows and returns, returning their responses.
+    search(request):
+        Returns the books matching the query.
+    list_books(request):
+        Returns a page of the books.
+    find_notes(request):
+        Returns the note IDs of a borrower.
+    cache_stats(request):
+        Returns the hit and miss statistics of the parsed notes cache.
+    """
+
+    def __init__(self, library: Library):
+        """
+        Constructor for the LibraryServer object.
+
+        Parameters:
+        -----------
+        library : Library
+            Library shared by all the clients.
+        """
+        self.library = library
+        self.lock = threading.Lock()
+        self.notes_lock = threading.Lock()
+        self.queue = asyncio.Queue()
+        self.writer = ThreadPoolExecutor(1, thread_name_prefix="lms-writer")
+        self.readers = ThreadPoolExecutor(4, thread_name_prefix="lms-reader")
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Answers the requests of a client connection, one at a time.
+
+        Parameters:
+        -----------
+        reader : asyncio.StreamReader
+            stream of the requests.
+        writer : asyncio.StreamWriter
+            stream of the responses.
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = None
+                try:
+                    request = json.loads(line)
+                    response = await self.handle_request(request)
+                except ValueError as e:
+                    # Invalid JSON, or a request with invalid fields.
+                    message = e.args[-1] if len(e.args) > 1 else "Invalid Request."
+                    response = {"status": "error", "message": str(message)}
+                except Exception:
+                    # Answering even when a request breaks something else, which is logged.
+                    traceback.print_exc()
+                    response = {"status": "error", "message": "Invalid Request."}
+                if isinstance(request, dict) and "id" in request:
+                    response["id"] = request["id"]
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, request: dict) -> dict:
+        """
+        Returns the response to a request.
+
+        Parameters:
+        -----------
+        request : dict
+            request with an action key.
+
+        Returns:
+        --------
+        response : dict
+            response with a status key.
+        """
+        if not isinstance(request, dict):
+            raise ValueError(request, "Invalid Request.")
+        action = request.get("action")
+        loop = asyncio.get_running_loop()
+        if action in ("borrow", "return"):
+            future = loop.create_future()
+            await self.queue.put((request, future))
+            return await future
+        handlers = {"search": self.search, "list": self.list_books, "find": self.find_books,
+                    "notes": self.find_notes, "stats": self.cache_stats}
+        if action not in handlers:
+            return {"status": "error", "message": "Invalid action."}
+        return await loop.run_in_executor(self.readers, handlers[action], request)
+
+    async def write_changes(self):
+        """
+        Commits the queued borrows and returns until cancelled.
+
+        Every request waiting when a commit starts is saved with it.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self.queue.get()]
+            while not self.queue.empty() and len(pending) < GROUP_SIZE:
+                pending.append(self.queue.get_nowait())
+            try:
+                responses = await loop.run_in_executor(
+                    self.writer, self.commit, [request for request, _ in pending])
+            except Exception as e:
+                traceback.print_exc()
+                responses = [{"status": "error", "message": f"Not Saved: {e}"} for _ in pending]
+            for (_, future), response in zip(pending, responses):
+                if not future.cancelled():
+                    future.set_result(response)
+
+    def commit(self, operations: list[dict]) -> list[dict]:
+        """
+        Applies and saves the borrows and returns, returning their responses.
+
+        The library lock is only held while the changes are made in memory,
+        so the searches and listings don't wait for the records to be written.
+
+        Parameters:
+        -----------
+        operations : list[dict]
+            borrow and return requests, in the batch.py format.
+
+        Returns:
+        --------
+        responses : list[dict]
+            response to each request.
+        """
+        responses = []
+        # The returns look up the notes catalog, which find_notes reads too.
+        with lockedstocks(), self.notes_lock:
+            with self.lock:
+                self.library.sync_stocks()
+                batch = Batch(self.library)
+                for operation in operations:
+                    checkpoint = batch.checkpoint()
+                    try:
+                        if operation["action"] == "borrow":
+                            noteid = batch.borrow(operation)
+                            notes = batch.open_notes[noteid]
+                        else:
+                            noteid = batch.return_(operation)
+                            notes = batch.returned[noteid]
+                        responses.append({"status": "ok", "noteid": noteid,
+                                          "books": [book.lib_id for book in notes.books],
+                                          "cost": notes.final_cost if notes.returned else notes.cost,
+                                          "invoice": self.library.get_note_text(notes)})
+                    except (BookError, NoteNotFound, ValueError) as e:
+                        batch.rollback(checkpoint)
+                        responses.append({"status": "error", "message": str(e.args[-1])})
+                    except Exception:
+                        # Only this request is dropped, with its stock changes put back, and the error is logged.
+                        print(f"ERROR! Request failed: {operation!r}", file=sys.stderr)
+                        traceback.print_exc()
+                        batch.rollback(checkpoint)
+                        responses.append({"status": "error", "message": "Invalid Request."})
+            # Still under the stocks lock, so no other process changes the stocks before the save.
+            saved = batch.save()
+            if not saved:
+                # None of the group was saved.
+                responses = [{"status": "error", "message": "Not Saved."} if response["status"] == "ok"
+                             else response for response in responses]
+        return responses
+
+    def search(self, request: dict) -> dict:
+        """
+        Returns the book with the name or ID, or the books with similar names.
+
+        Parameters:
+        -----------
+        request : dict
+            request with query and limit keys.
+
+        Returns:
+        --------
+        response : dict
+            "exact" flag and the matching books.
+        """
+        query = str(request.get("query") or "")
+        with self.lock:
+            book = self.library.find_book_by_arg(query)
+            if book is not None:
+                return {"status": "ok", "exact": True, "books": [book_details(book)]}
+            books = self.library.find_similar_books(query, get_number(request, "limit", 3))
+            return {"status": "ok", "exact": False, "books": [book_details(book) for book in books]}
+
+    def list_books(self, request: dict) -> dict:
+        """
+        Returns a page of the books, or of the available books.
+
+        Parameters:
+        -----------
+        request : dict
+            request with available, offset and limit keys.
+
+        Returns:
+        --------
+        response : dict
+            books of the page and total number of matching books.
+        """
+        offset = get_number(request, "offset", 0)
+        limit = get_number(request, "limit", LIST_LIMIT)
+        with self.lock:
+            books = self.library.bookdb
+            if request.get("available"):
+                books = [book for book in books if book.remaining > 0]
+            return {"status": "ok", "total": len(books),
+                    "books": [book_details(book) for book in books[offset:offset + limit]]}
+
+    def find_books(self, request: dict) -> dict:
+        """
+        Returns a page of the books matching all the words of the query, sorted by name.
+
+        Parameters:
+        -----------
+        request : dict
+            request with query, offset and limit keys.
+
+        Returns:
+        --------
+        response : dict
+            books of the page and total number of matching books.
+        """
+        offset = get_number(request, "offset", 0)
+        limit = get_number(request, "limit", LIST_LIMIT)
+        with self.lock:
+            try:
+                books = self.library.match_books(str(request.get("query") or ""))
+            except ValueError as e:
+                return {"status": "error", "message": str(e.args[-1])}
+            return {"status": "ok", "total": len(books),
+                    "books": [book_details(book) for book in rank_books(books, limit, offset)]}
+
+    def find_notes(self, request: dict) -> dict:
+        """
+        Returns the note IDs of a borrower, oldest first.
+
+        Parameters:
+        -----------
+        request : dict
+            request with borrower and returned keys, open notes only unless returned is true.
+
+        Returns:
+        --------
+        response : dict
+            note IDs of the borrower.
+        """
+        slug = str(request.get("borrower") or "").strip().lower().replace(" ", "-")
+        # The notes catalog is changed by the writer thread while saving.
+        with self.notes_lock:
+            return {"status": "ok", "noteids": searchnotes(slug, not request.get("returned"))}
+
+    def cache_stats(self, request: dict) -> dict:
+        """
+        Returns the hit and miss statistics of the parsed notes cache.
+
+        Parameters:
+        -----------
+        request : dict
+            request without other keys.
+
+        Returns:
+        --------
+        response : dict
+            hits, misses, hit ratio, evictions, size and maxsize of the cache.
+        """
+        return {"status": "ok", "notes_cache": self.library.notes_cache.stats()}
+
+
+def get_number(request: dict, key: str, default: int) -> int:
+    """
+    Returns a whole number field of the request.
+
+    Parameters:
+    -----------
+    request : dict
+        request with the field.
+    key : str
+        name of the field.
+    default : int
+        value used when the field is missing.
+
+    Raises:
+    -------
+    ValueError
+        If the field isn't a whole number of at least 0.
+    """
+    value = request.get(key, default)
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(value, f"Invalid {key}.")
+    if number < 0 or isinstance(value, bool):
+        raise ValueError(value, f"Invalid {key}.")
+    return number
+
+
+def book_details(book) -> dict:
+    """
+    Returns the details of a book for a response.
+    """
+    return {"lib_id": book.lib_id, "name": book.name, "author": book.author,
+            "remaining": book.remaining, "price": book.price}
+
+
+async def serve(library: Library, host: str = HOST, port: int = PORT, unix: str = None):
+    """
+    Serves the Library until cancelled.
+
+    Parameters:
+    -----------
+    library : Library
+        Library shared by all the clients.
+    host : str, optional
+        address to listen on.
+    port : int, optional
+        TCP port to listen on.
+    unix : str, optional
+        Unix socket path to listen on instead of TCP.
+    """
+    server = LibraryServer(library)
+    writer = asyncio.create_task(server.write_changes())
+    if unix:
+        listener = await asyncio.start_unix_server(server.handle_client, unix, limit=LINE_LIMIT)
+    else:
+        listener = await asyncio.start_server(server.handle_client, host, port, limit=LINE_LIMIT)
+    print(f"Serving the {library.name} on {unix or f'{host}:{port}'}.", file=sys.stderr)
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        writer.cancel()
+        server.writer.shutdown()
+        server.readers.shutdown()
+        # Compacting the stock journal once it grew large.
+        library.savebookdb()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the Library to front desk clients.")
+    parser.add_argument("--host", default=HOST, help=f"address to listen on (default {HOST})")
+    parser.add_argument("--port", type=int, default=PORT, help=f"TCP port (default {PORT})")
+    parser.add_argument("--unix", help="Unix socket path to listen on instead of TCP")
+    parser.add_argument("--user", default="server", help="user recorded as the sender")
+    args = parser.parse_args()
+    # Recording the timings when LMS_METRICS is set.
+    enable_from_environment()
+    try:
+        asyncio.run(serve(Library("Islington Library", args.user), args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        print("Server stopped.", file=sys.stderr)
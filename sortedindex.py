@@ -0,0 +1,258 @@
+from bisect import bisect_left, bisect_right
+from heapq import nlargest, nsmallest
+from operator import itemgetter
+
+# Fields of a book kept sorted for the catalog queries.
+SORT_FIELDS = ("pub_date", "price", "remaining", "author")
+# A range with this many times fewer books than the sort range is read instead of the sort index.
+SCAN_FACTOR = 8
+
+
+class SortedIndex:
+    """
+    A class to represent the books sorted by one of their fields, kept sorted with bisect.
+
+    Every entry is the value of the field, the case folded ID of the book and
+    the id() of the book, so that books with the same value keep a fixed order.
+
+    Attributes:
+    -----------
+    key : callable
+        returns the value of the field for a book.
+    entries : list[tuple]
+        sorted entries of the books.
+    books : list[Book]
+        Book objects in the order of the entries.
+    positions : dict[int, tuple]
+        entry of each indexed book, keyed by its id().
+    changed : set[Book]
+        books whose value may have changed since the last refresh.
+
+    Methods:
+    --------
+    add(book):
+        Adds a book to the index.
+    remove(book):
+        Removes a book from the index.
+    mark(book):
+        Notes a book whose value may have changed.
+    refresh():
+        Moves the changed books to their new positions.
+    span(low=None, high=None):
+        Returns the start and stop positions of the books with values between low and high.
+    """
+
+    def __init__(self, key, books: list = None):
+        """
+        Constructor for the SortedIndex object.
+
+        Parameters:
+        -----------
+        key : callable
+            returns the value of the field for a book.
+        books : list[Book], optional
+            Books to be indexed initially, sorted once.
+        """
+        self.key = key
+        self.changed = set()
+        books = {id(book): book for book in books or []}
+        # Sorting the entries alone, which finds the books through their id().
+        self.entries: list[tuple] = sorted([self.entry(book) for book in books.values()])
+        self.books: list = [books[entry[2]] for entry in self.entries]
+        self.positions: dict[int, tuple] = {entry[2]: entry for entry in self.entries}
+
+    def entry(self, book) -> tuple:
+        """
+        Returns the sort entry of the book.
+
+        Parameters:
+        -----------
+        book : Book
+            Book object.
+        """
+        return (self.key(book), book.lib_id.casefold(), id(book))
+
+    def add(self, book):
+        """
+        Adds a book to the index.
+
+        Parameters:
+        -----------
+        book : Book
+            Book object to be indexed.
+        """
+        entry = self.entry(book)
+        position = bisect_left(self.entries, entry)
+        self.entries.insert(position, entry)
+        self.books.insert(position, book)
+        self.positions[id(book)] = entry
+
+    def remove(self, book):
+        """
+        Removes a book from the index.
+
+        Parameters:
+        -----------
+        book : Book
+            Book object to be removed.
+        """
+        entry = self.positions.pop(id(book), None)
+        if entry is None:
+            return
+        position = bisect_left(self.entries, entry)
+        del self.entries[position]
+        del self.books[position]
+
+    def mark(self, book):
+        """
+        Notes a book whose value may have changed, moved on the next refresh.
+
+        Parameters:
+        -----------
+        book : Book
+            Book object changed.
+        """
+        self.changed.add(book)
+
+    def refresh(self):
+        """
+        Moves the changed books to their new positions.
+        """
+        while self.changed:
+            book = self.changed.pop()
+            entry = self.positions.get(id(book))
+            # Skipping the books not indexed and the values changed back.
+            if entry is not None and entry[0] != self.key(book):
+                self.remove(book)
+                self.add(book)
+
+    def span(self, low=None, high=None) -> tuple[int, int]:
+        """
+        Returns the start and stop positions of the books with values between low and high.
+
+        Parameters:
+        -----------
+        low : optional
+            smallest value, no lower bound if None.
+        high : optional
+            largest value, no upper bound if None.
+
+        Returns:
+        --------
+        start, stop : tuple[int, int]
+            positions in the books list, stop excluded.
+        """
+        start = 0 if low is None else bisect_left(self.entries, low, key=itemgetter(0))
+        stop = len(self.entries) if high is None else bisect_right(self.entries, high, key=itemgetter(0))
+        return start, max(start, stop)
+
+
+def get_year(book) -> int:
+    """
+    Returns the published year of the book, 0 if it isn't a year.
+
+    Parameters:
+    -----------
+    book : Book
+        Book object.
+    """
+    try:
+        return int(book.pub_date)
+    except ValueError:
+        return 0
+
+
+# Value of each sorted field for a book.
+SORT_KEYS = {
+    "pub_date": get_year,
+    "price": lambda book: book.price,
+    "remaining": lambda book: book.remaining,
+    "author": lambda book: book.author.casefold(),
+}
+
+
+def select_books(indexes: dict, ranges: dict, sort_by: str, descending: bool = False,
+                 page_size: int = None, offset: int = 0) -> list:
+    """
+    Returns a page of the books with values in all the ranges, sorted by a field.
+
+    The books are read in order from the sort index, checking the other
+    ranges, unless another range has far fewer books. The books of that
+    range are then checked and only the requested page is sorted.
+
+    Parameters:
+    -----------
+    indexes : dict[str, SortedIndex]
+        sorted indexes keyed by the field.
+    ranges : dict[str, tuple]
+        smallest and largest values (None for no bound) keyed by the field.
+    sort_by : str
+        field to sort the books by.
+    descending : bool, optional
+        whether to start with the largest values.
+    page_size : int, optional
+        maximum number of books to return, all of them if None.
+    offset : int, optional
+        number of matching books to skip.
+
+    Returns:
+    --------
+    books : list[Book]
+        books of the page.
+    """
+    for index in indexes.values():
+        index.refresh()
+    spans = {field: indexes[field].span(*bounds) for field, bounds in ranges.items()}
+    sort_index = indexes[sort_by]
+    start, stop = spans.get(sort_by, (0, len(sort_index.books)))
+    end = None if page_size is None else offset + page_size
+    # Range with the fewest books.
+    field, (first, last) = min(spans.items(), key=lambda span: span[1][1] - span[1][0],
+                               default=(sort_by, (start, stop)))
+    if field != sort_by and (last - first) * SCAN_FACTOR < stop - start:
+        # Checking the books of the narrowest range and only sorting the page.
+        candidates = [book for book in indexes[field].books[first:last]
+                      if in_ranges(book, ranges, field)]
+        entry = lambda book: sort_index.positions[id(book)]
+        if end is None:
+            return sorted(candidates, key=entry, reverse=descending)[offset:]
+        select = nlargest if descending else nsmallest
+        return select(end, candidates, key=entry)[offset:]
+    if all([field == sort_by for field in ranges]):
+        # Only the sort range is needed, so the page is a slice of the sort index.
+        if end is None:
+            end = stop - start
+        if descending:
+            return sort_index.books[max(start, stop - end):max(start, stop - offset)][::-1]
+        return sort_index.books[start + offset:min(stop, start + end)]
+    books = []
+    positions = range(stop - 1, start - 1, -1) if descending else range(start, stop)
+    for position in positions:
+        book = sort_index.books[position]
+        if in_ranges(book, ranges, sort_by):
+            books.append(book)
+            if len(books) == end:
+                break
+    return books[offset:]
+
+
+def in_ranges(book, ranges: dict, skipped: str) -> bool:
+    """
+    Returns True if the values of the book are in all the ranges but the skipped one.
+
+    Parameters:
+    -----------
+    book : Book
+        Book object to check.
+    ranges : dict[str, tuple]
+        smallest and largest values (None for no bound) keyed by the field.
+    skipped : str
+        field already known to be in its range.
+    """
+    for field, (low, high) in ranges.items():
+        if field == skipped:
+            continue
+        value = SORT_KEYS[field](book)
+        if (low is not None and value < low) or (high is not None and value > high):
+            return False
+    return True
@@ -0,0 +1,600 @@
+import sys
+import sqlite3
+from book import Book
+from errors import NoMoreStocks
+# Shared by the backends, and exported to storage with the other functions.
+from lrucache import registernotescache, invalidatenotes
+# The same lock file guards the database when several processes share the data directory.
+from libraryfs import lockedstocks
+
+# Database file holding the books and the loans.
+DB_PATH = "./data/library.db"
+# Connection shared by all the functions, opened on first use.
+connection = None
+# Data version of the database when the books were last read by this connection,
+# and the remaining stock in the database of each book ID at that time.
+sync_state = {"version": None, "remaining": {}}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    lib_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    author TEXT NOT NULL,
+    publisher TEXT NOT NULL,
+    pub_date TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    remaining INTEGER NOT NULL,
+    price REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS books_name ON books (name COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS loans (
+    noteid TEXT PRIMARY KEY,
+    borrower TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    returned INTEGER NOT NULL DEFAULT 0,
+    invoice TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS loans_borrower ON loans (borrower, returned, timestamp);
+CREATE TABLE IF NOT EXISTS loan_lines (
+    noteid TEXT NOT NULL REFERENCES loans (noteid) ON DELETE CASCADE,
+    line_no INTEGER NOT NULL,
+    line TEXT NOT NULL,
+    PRIMARY KEY (noteid, line_no)
+);
+"""
+
+
+def connect() -> sqlite3.Connection:
+    """
+    Returns the connection to the database, creating the tables if needed.
+
+    Returns:
+    --------
+    connection : sqlite3.Connection
+        connection in WAL mode with foreign keys enabled.
+    """
+    global connection
+    if connection is None:
+        connection = sqlite3.connect(DB_PATH)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA foreign_keys=ON")
+        connection.executescript(SCHEMA)
+    return connection
+
+
+def loadbookstocks() -> list:
+    """
+    Returns the books stocks details as list.
+
+    Returns:
+    --------
+    bookdb : list
+        contains book objects containing the book details.
+    """
+    db = connect()
+    sync_state["version"] = db.execute("PRAGMA data_version").fetchone()[0]
+    rows = db.execute(
+        "SELECT lib_id, name, author, publisher, pub_date, total, price, remaining FROM books ORDER BY rowid")
+    bookdb = [Book(*row) for row in rows]
+    sync_state["remaining"] = {book.lib_id: book.remaining for book in bookdb}
+    return bookdb
+
+
+def syncbookstocks(bookdb: list, lookup, onchange=None) -> bool:
+    """
+    Applies the stock changes committed by other connections to the book list.
+
+    The books are only read again when the data version of the database
+    shows a commit from another connection. The stocks are changed by the
+    difference since the last read, which keeps the books reserved but not
+    committed yet by this process.
+
+    Parameters:
+    -----------
+    bookdb : list
+        contains book objects to apply the changes to.
+    lookup : callable
+        returns the Book object with the given ID, or None.
+    onchange : callable, optional
+        called with the action and the Book object for every ADD and REMOVE.
+
+    Returns:
+    --------
+    True : bool
+        the changes are always applied in place.
+    """
+    db = connect()
+    version = db.execute("PRAGMA data_version").fetchone()[0]
+    if version == sync_state["version"]:
+        return True
+    sync_state["version"] = version
+    rows = db.execute(
+        "SELECT lib_id, name, author, publisher, pub_date, total, price, remaining FROM books ORDER BY rowid")
+    known = sync_state["remaining"]
+    bookids = set()
+    for row in rows:
+        bookids.add(row[0])
+        book = lookup(row[0])
+        if book is not None:
+            book.add_stock(row[7] - known.get(row[0], row[7]))
+            known[row[0]] = row[7]
+            continue
+        book = Book(*row)
+        known[row[0]] = row[7]
+        bookdb.append(book)
+        if onchange is not None:
+            onchange("ADD", book)
+    for book in [book for book in bookdb if book.lib_id not in bookids]:
+        known.pop(book.lib_id, None)
+        bookdb.remove(book)
+        if onchange is not None:
+            onchange("REMOVE", book)
+    return True
+
+
+def savebookstocks(bookdb: list) -> bool:
+    """
+    Returns True when saving is complete.
+
+    The books table is replaced with the books in the list in one transaction.
+
+    Parameters:
+    -----------
+    bookdb : list
+        contains book objects containing the book details.
+
+    Returns:
+    --------
+    True/False : bool
+        bool value depending on the success or failure.
+    """
+    try:
+        with connect() as db:
+            db.execute("DELETE FROM books")
+            db.executemany("INSERT OR IGNORE INTO books VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                           [(book.lib_id, book.name, book.author, book.publisher, book.pub_date,
+                             book.total, book.remaining, book.price) for book in bookdb])
+        sync_state["remaining"] = {book.lib_id: book.remaining for book in bookdb}
+        return True
+    except sqlite3.Error:
+        return False
+
+
+def compactbookstocks(bookdb: list, threshold: int = 0) -> bool:
+    """
+    Returns False, since every change is already committed to the database.
+
+    Parameters:
+    -----------
+    bookdb : list
+        contains book objects containing the book details.
+    threshold : int, optional
+        unused, kept for the same signature as libraryfs.
+
+    Returns:
+    --------
+    False : bool
+        nothing needs to be compacted.
+    """
+    return False
+
+
+def journalstock(action: str, detail: str) -> bool:
+    """
+    Returns True when the stock change has been committed.
+
+    Parameters:
+    -----------
+    action : str
+        BORROW, RETURN, ADD or REMOVE.
+    detail : str
+        book ID, or the book details in the book stocks format for ADD.
+
+    Returns:
+    --------
+    True/False : bool
+        bool value depending on the success or failure.
+    """
+    return journalstocks([(action, detail)])
+
+
+def journalstocks(changes: list) -> bool:
+    """
+    Returns True when all the stock changes have been committed in one transaction.
+
+    A borrow of a book without remaining stock rolls back the whole
+    transaction and returns False.
+
+    Parameters:
+    -----------
+    changes : list[tuple[str, str]]
+        pairs of action and detail, same as journalstock.
+
+    Returns:
+    --------
+    True/False : bool
+        bool value depending on the success or failure.
+    """
+    try:
+        with connect() as db:
+            applystockchanges(db, changes)
+        recordstockchanges(changes)
+        return True
+    except (sqlite3.Error, NoMoreStocks):
+        # A book without remaining stock rolls back the whole transaction.
+        return False
+
+
+def applystockchanges(db: sqlite3.Connection, changes: list):
+    """
+    Applies the stock changes inside the current transaction.
+
+    Parameters:
+    -----------
+    db : sqlite3.Connection
+        connection with an open transaction.
+    changes : list[tuple[str, str]]
+        pairs of action and detail, same as journalstock.
+    """
+    for action, detail in changes:
+        detail = detail.rstrip("\n")
+        if action == "BORROW":
+            # Only borrowing from the stock still in the database.
+            cursor = db.execute(
+                "UPDATE books SET remaining = remaining - 1 WHERE lib_id = ? AND remaining > 0", (detail,))
+            if cursor.rowcount == 0:
+                raise NoMoreStocks(detail, "Stock Empty.")
+        elif action == "RETURN":
+            db.execute(
+                "UPDATE books SET remaining = remaining + 1 WHERE lib_id = ?", (detail,))
+        elif action == "ADD":
+            db.execute("INSERT INTO books VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                       bookrow(detail))
+        elif action == "REMOVE":
+            db.execute("DELETE FROM books WHERE lib_id = ?", (detail,))
+
+
+def recordstockchanges(changes: list):
+    """
+    Records the committed stock changes of this connection, so that syncbookstocks doesn't apply them again.
+
+    Parameters:
+    -----------
+    changes : list[tuple[str, str]]
+        pairs of action and detail, same as journalstock.
+    """
+    known = sync_state["remaining"]
+    for action, detail in changes:
+        detail = detail.rstrip("\n")
+        if action == "BORROW" and detail in known:
+            known[detail] -= 1
+        elif action == "RETURN" and detail in known:
+            known[detail] += 1
+        elif action == "ADD":
+            row = bookrow(detail)
+            known.setdefault(row[0], row[6])
+        elif action == "REMOVE":
+            known.pop(detail, None)
+
+
+def bookrow(book_details: str) -> tuple:
+    """
+    Returns the books table row for a line of the book stocks file.
+
+    Parameters:
+    -----------
+    book_details : str
+        book details in the book stocks format, without the line break.
+
+    Returns:
+    --------
+    row : tuple
+        values in the books table column order.
+    """
+    bookid, bookname, author, publisher, pub_date, total, remaining, price = book_details.split(
+        ",")
+    return (bookid, bookname, author, publisher, pub_date, int(total), int(remaining), float(price))
+
+
+def loadnotes(noteid: str) -> list[str]:
+    """
+    Returns the notes lines about a transaction, same as the .data file.
+
+    Parameters:
+    -----------
+    noteid : str
+        id for uniquely identifying the notes.
+
+    Returns:
+    --------
+    notes : list[str] or None
+        notes lines, or None if there is no such note.
+    """
+    lines = [row[0] for row in connect().execute(
+        "SELECT line FROM loan_lines WHERE noteid = ? ORDER BY line_no", (noteid,))]
+    return lines if lines else None
+
+
+def notesversion(noteid: str) -> tuple:
+    """
+    Returns the version of the notes, which changes whenever the loan is written.
+
+    Parameters:
+    -----------
+    noteid : str
+        id for uniquely identifying the notes.
+
+    Returns:
+    --------
+    version : tuple or None
+        returned flag and number of notes lines, None if there is no such loan.
+    """
+    return connect().execute(
+        "SELECT returned, (SELECT COUNT(*) FROM loan_lines WHERE noteid = loans.noteid) FROM loans WHERE noteid = ?",
+        (noteid,)).fetchone()
+
+
+def savenotes(noteid: str, note_data_file: str) -> bool:
+    """
+    Returns True when saving is complete.
+
+    Parameters:
+    -----------
+    noteid : str
+        id for uniquely identifying the notes.
+    note_data_file : str
+        notes lines of the new transaction.
+
+    Returns:
+    --------
+    True/False : bool
+        Boolean Value depending on the success or failure.
+    """
+    return saveborrow(noteid, note_data_file, [])
+
+
+def addtonotes(noteid: str, note_data_file: str) -> bool:
+    """
+    Returns True when addition is complete.
+
+    Parameters:
+    -----------
+    noteid : str
+        id for uniquely identifying the notes.
+    note_data_file : str
+        notes lines to add to the transaction.
+
+    Returns:
+    --------
+    True/False : bool
+        Boolean Value depending on the success or failure.
+    """
+    return savereturn(noteid, note_data_file, [])
+
+
+def saveborrow(noteid: str, note_data_file: str, bookids: list) -> bool:
+    """
+    Returns True when the loan and its stock changes are committed in one transaction.
+
+    Parameters:
+    -----------
+    noteid : str
+        id for uniquely identifying the notes.
+    note_data_file : str
+        notes lines of the new transaction.
+    bookids : list[str]
+        IDs of the borrowed books.
+
+    Returns:
+    --------
+    True/False : bool
+        Boolean Value depending on the success or failure.
+    """
+    try:
+        with connect() as db:
+            insertloan(db, noteid, note_data_file)
+            applystockchanges(db, [("BORROW", bookid) for bookid in bookids])
+        recordstockchanges([("BORROW", bookid) for bookid in bookids])
+        invalidatenotes([noteid])
+        return True
+    except (sqlite3.Error, NoMoreStocks):
+        # A book without remaining stock rolls back the whole transaction.
+        return False
+
+
+def savereturn(noteid: str, note_data_file: str, bookids: list) -> bool:
+    """
+    Returns True when the return and its stock changes are committed in one transaction.
+
+    Parameters:
+    -----------
+    noteid : str
+        id for uniquely identifying the notes.
+    note_data_file : str
+        notes lines to add to the transaction.
+    bookids : list[str]
+        IDs of the returned books.
+
+    Returns:
+    --------
+    True/False : bool
+        Boolean Value depending on the success or failure.
+    """
+    try:
+        with connect() as db:
+            updateloan(db, noteid, note_data_file)
+            applystockchanges(db, [("RETURN", bookid) for bookid in bookids])
+        recordstockchanges([("RETURN", bookid) for bookid in bookids])
+        invalidatenotes([noteid])
+        return True
+    except sqlite3.Error:
+        return False
+
+
+def savebatch(borrows: list, returns: list, changes: list) -> bool:
+    """
+    Returns True when all the loans, returns and stock changes of a batch are committed in one transaction.
+
+    Parameters:
+    -----------
+    borrows : list[tuple[str, str]]
+        note ID and notes lines of each borrow.
+    returns : list[tuple[str, str]]
+        note ID and notes lines of each return.
+    changes : list[tuple[str, str]]
+        pairs of action and detail, same as journalstock.
+
+    Returns:
+    --------
+    True/False : bool
+        Boolean Value depending on the success or failure.
+    """
+    try:
+        with connect() as db:
+            for noteid, note_data_file in borrows:
+                insertloan(db, noteid, note_data_file)
+            for noteid, note_data_file in returns:
+                updateloan(db, noteid, note_data_file)
+            applystockchanges(db, changes)
+        recordstockchanges(changes)
+        invalidatenotes([noteid for noteid, _ in borrows + returns])
+        return True
+    except (sqlite3.Error, NoMoreStocks):
+        # A book without remaining stock rolls back the whole transaction.
+        return False
+
+
+def insertloan(db: sqlite3.Connection, noteid: str, note_data_file: str):
+    """
+    Inserts a loan and its notes lines inside the current transaction.
+
+    Parameters:
+    -----------
+    db : sqlite3.Connection
+        connection with an open transaction.
+    noteid : str
+        id for uniquely identifying the notes.
+    note_data_file : str
+        notes lines of the new transaction.
+    """
+    borrower, timestamp = noteid.rsplit("-", 1)
+    # Replacing an existing loan with the same ID, like savenotes does.
+    db.execute("DELETE FROM loans WHERE noteid = ?", (noteid,))
+    # Invoices are rendered from the notes lines, the column is left empty.
+    db.execute("INSERT INTO loans (noteid, borrower, timestamp, invoice) VALUES (?, ?, ?, '')",
+               (noteid, borrower, int(timestamp)))
+    db.executemany("INSERT INTO loan_lines VALUES (?, ?, ?)",
+                   [(noteid, line_no, line) for line_no, line in enumerate(note_data_file.splitlines())])
+
+
+def updateloan(db: sqlite3.Connection, noteid: str, note_data_file: str):
+    """
+    Marks a loan as returned and adds its notes lines inside the current transaction.
+
+    Parameters:
+    -----------
+    db : sqlite3.Connection
+        connection with an open transaction.
+    noteid : str
+        id for uniquely identifying the notes.
+    note_data_file : str
+        notes lines to add to the transaction.
+    """
+    db.execute("UPDATE loans SET returned = 1 WHERE noteid = ?", (noteid,))
+    next_line = db.execute("SELECT COUNT(*) FROM loan_lines WHERE noteid = ?",
+                           (noteid,)).fetchone()[0]
+    db.executemany("INSERT INTO loan_lines VALUES (?, ?, ?)",
+                   [(noteid, next_line + line_no, line) for line_no, line in enumerate(note_data_file.splitlines())])
+
+
+def listnotes() -> list:
+    """
+    Returns the note IDs of all the loans, oldest first.
+    """
+    return [noteid for noteid, in connect().execute("SELECT noteid FROM loans ORDER BY timestamp")]
+
+
+def openloans() -> tuple:
+    """
+    Returns the note IDs, borrow timestamps and costs of all the open loans.
+
+    Returns:
+    --------
+    noteids, timestamps, costs : tuple[list[str], list[int], list[float]]
+        open loans with their borrow timestamps and costs without fine.
+    """
+    loans = {}
+    rows = connect().execute(
+        "SELECT loans.noteid, loans.timestamp, loan_lines.line FROM loans JOIN loan_lines USING (noteid) "
+        "WHERE loans.returned = 0 AND loan_lines.line LIKE 'BORROW:%'")
+    for noteid, timestamp, line in rows:
+        loan = loans.setdefault(noteid, [timestamp, 0.0])
+        loan[1] += float(line.rsplit(",", 1)[1])
+    noteids = list(loans)
+    return noteids, [loans[noteid][0] for noteid in noteids], [loans[noteid][1] for noteid in noteids]
+
+
+def searchnotes(keyword: str, checkReturned: bool) -> list:
+    """
+    Returns a list of note IDs of the borrower.
+
+    Parameters:
+    -----------
+    keyword : str
+        borrower slug (name in lowercase with hyphens) to search for.
+    checkReturned : bool
+        to skip returned notes or not.
+
+    Returns:
+    --------
+    search_results : list
+        list of all the note IDs of the borrower, oldest first.
+    """
+    query = "SELECT noteid FROM loans WHERE borrower = ?"
+    if checkReturned:
+        query += " AND returned = 0"
+    return [row[0] for row in connect().execute(query + " ORDER BY timestamp", (keyword,))]
+
+
+def migrate() -> tuple:
+    """
+    Returns the number of books and loans copied from the text files into the database.
+
+    Existing books and loans with the same IDs are replaced.
+
+    Returns:
+    --------
+    totals : tuple[int, int]
+        books and loans migrated.
+    """
+    import libraryfs
+    import notesmanager
+    bookdb = libraryfs.loadbookstocks()
+    loans = 0
+    with connect() as db:
+        db.executemany("INSERT OR REPLACE INTO books VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                       [(book.lib_id, book.name, book.author, book.publisher, book.pub_date,
+                         book.total, book.remaining, book.price) for book in bookdb])
+        # Notes in either layout of the notes directory.
+        for noteid, path in notesmanager.iternotes():
+            with open(path) as note:
+                lines = note.read().splitlines()
+            borrower, timestamp = noteid.rsplit("-", 1)
+            returned = bool(lines) and lines[-1].startswith("RETURN:")
+            db.execute("DELETE FROM loans WHERE noteid = ?", (noteid,))
+            db.execute("INSERT INTO loans VALUES (?, ?, ?, ?, '')",
+                       (noteid, borrower, int(timestamp), returned))
+            db.executemany("INSERT INTO loan_lines VALUES (?, ?, ?)",
+                           [(noteid, line_no, line) for line_no, line in enumerate(lines)])
+            loans += 1
+    return len(bookdb), loans
+
+
+# Migrating the text files with: python sqlitestore.py migrate
+if __name__ == "__main__":
+    if sys.argv[1:] == ["migrate"]:
+        books, loans = migrate()
+        print(f"Migrated {books} books and {loans} loans to {DB_PATH}.")
+    else:
+        print("Usage: python sqlitestore.py migrate")
@@ -0,0 +1,139 @@
+"""
+Vectorized stock analytics over the Library's Database.
+
+NumPy is optional for the rest of the system but required here.
+"""
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def stock_columns(bookdb: list) -> dict:
+    """
+    Returns a columnar NumPy view of the book list.
+
+    Parameters:
+    -----------
+    bookdb : list[Book]
+        Book objects to take the columns from.
+
+    Returns:
+    --------
+    columns : dict
+        "total", "remaining", "price" and "pub_date" arrays, "author" and
+        "publisher" codes with their names in "authors" and "publishers".
+
+    Raises:
+    -------
+    ImportError
+        If NumPy isn't installed.
+    """
+    if np is None:
+        raise ImportError("NumPy is required for the stock analytics.")
+    count = len(bookdb)
+    authors = {}
+    publishers = {}
+    columns = {
+        "total": np.fromiter((book.total for book in bookdb), dtype=np.int64, count=count),
+        "remaining": np.fromiter((book.remaining for book in bookdb), dtype=np.int64, count=count),
+        "price": np.fromiter((book.price for book in bookdb), dtype=np.float64, count=count),
+        # Years that aren't numbers are counted as 0.
+        "pub_date": np.fromiter((int(book.pub_date) if book.pub_date.strip().isdigit() else 0
+                                 for book in bookdb), dtype=np.int64, count=count),
+        # Codes of the names in the order they were first seen.
+        "author": np.fromiter((authors.setdefault(book.author.strip(), len(authors))
+                               for book in bookdb), dtype=np.int64, count=count),
+        "publisher": np.fromiter((publishers.setdefault(book.publisher.strip(), len(publishers))
+                                  for book in bookdb), dtype=np.int64, count=count),
+    }
+    columns["authors"] = list(authors)
+    columns["publishers"] = list(publishers)
+    return columns
+
+
+def availability_mask(columns: dict):
+    """
+    Returns a boolean array marking the books with remaining stock.
+    """
+    return columns["remaining"] > 0
+
+
+def utilization(columns: dict):
+    """
+    Returns the share of each book's stock that is borrowed, 0 for books without stock.
+    """
+    total = columns["total"]
+    borrowed = total - columns["remaining"]
+    return np.divide(borrowed, total, out=np.zeros(len(total)), where=total > 0)
+
+
+def revenue_by(columns: dict, key: str, limit: int = 10) -> list[tuple]:
+    """
+    Returns the revenue per 10 days grouped by author or publisher, highest potential first.
+
+    The potential revenue lends out the whole stock, the current revenue only the borrowed stock.
+
+    Parameters:
+    -----------
+    columns : dict
+        columns returned by stock_columns.
+    key : str
+        "author" or "publisher".
+    limit : int, optional
+        number of groups to return.
+
+    Returns:
+    --------
+    revenue : list[tuple[str, float, float]]
+        name, potential revenue and current revenue of each group.
+    """
+    names = columns[f"{key}s"]
+    codes = columns[key]
+    price = columns["price"]
+    potential = np.bincount(codes, weights=price * columns["total"], minlength=len(names))
+    current = np.bincount(codes, weights=price * (columns["total"] - columns["remaining"]),
+                          minlength=len(names))
+    top = np.argsort(potential)[::-1][:limit]
+    return [(names[code], float(potential[code]), float(current[code])) for code in top]
+
+
+def year_histogram(columns: dict) -> dict[int, int]:
+    """
+    Returns the number of books published in each year.
+    """
+    years, counts = np.unique(columns["pub_date"], return_counts=True)
+    return {int(year): int(count) for year, count in zip(years, counts)}
+
+
+def stock_report(bookdb: list, limit: int = 10) -> dict:
+    """
+    Returns the stock analytics of the book list.
+
+    Parameters:
+    -----------
+    bookdb : list[Book]
+        Book objects to analyse.
+    limit : int, optional
+        number of authors and publishers in the revenue rankings.
+
+    Returns:
+    --------
+    report : dict
+        totals, utilization, revenue rankings and year histogram.
+    """
+    columns = stock_columns(bookdb)
+    mask = availability_mask(columns)
+    ratios = utilization(columns)
+    return {
+        "titles": len(bookdb),
+        "copies": int(columns["total"].sum()),
+        "borrowed": int((columns["total"] - columns["remaining"]).sum()),
+        "available_titles": int(mask.sum()),
+        "out_of_stock": int((~mask).sum()),
+        "mean_utilization": float(ratios.mean()) if len(bookdb) else 0.0,
+        "fully_borrowed_share": float((ratios >= 1).mean()) if len(bookdb) else 0.0,
+        "authors": revenue_by(columns, "author", limit),
+        "publishers": revenue_by(columns, "publisher", limit),
+        "years": year_histogram(columns),
+    }
@@ -0,0 +1,83 @@
+"""
+Storage backend used by the Library.
+
+The text files backend (libraryfs and notesmanager) is used by default.
+Set the LMS_STORAGE environment variable to "sqlite" to use sqlitestore,
+after migrating the text files with: python sqlitestore.py migrate
+Set it to "log" to keep the loan records in the segments of loanlog instead
+of the notes files, after importing them with: python loanlog.py migrate
+"""
+import os
+
+if os.environ.get("LMS_STORAGE", "text") == "sqlite":
+    from sqlitestore import *
+else:
+    from libraryfs import *
+    from notesmanager import *
+    # The loan records functions of loanlog replace the ones of notesmanager.
+    if os.environ.get("LMS_STORAGE") == "log":
+        from loanlog import *
+
+    def saveborrow(noteid: str, note_data_file: str, bookids: list) -> bool:
+        """
+        Returns True when the loan and its stock changes are saved.
+
+        Parameters:
+        -----------
+        noteid : str
+            id for uniquely identifying the notes.
+        note_data_file : str
+            notes to write for the data file.
+        bookids : list[str]
+            IDs of the borrowed books.
+
+        Returns:
+        --------
+        True/False : bool
+            Boolean Value depending on the success or failure.
+        """
+        # Journalling the stock changes only once the loan is saved.
+        return savenotes(noteid, note_data_file) and journalstocks([("BORROW", bookid) for bookid in bookids])
+
+    def savereturn(noteid: str, note_data_file: str, bookids: list) -> bool:
+        """
+        Returns True when the return and its stock changes are saved.
+
+        Parameters:
+        -----------
+        noteid : str
+            id for uniquely identifying the notes.
+        note_data_file : str
+            notes to add to the data file.
+        bookids : list[str]
+            IDs of the returned books.
+
+        Returns:
+        --------
+        True/False : bool
+            Boolean Value depending on the success or failure.
+        """
+        return addtonotes(noteid, note_data_file) and journalstocks([("RETURN", bookid) for bookid in bookids])
+
+    def savebatch(borrows: list, returns: list, changes: list) -> bool:
+        """
+        Returns True when all the loans, returns and stock changes of a batch are saved.
+
+        The stock changes are journalled in one write once the notes are
+        saved, and the notes catalog gets all the entries in one write.
+
+        Parameters:
+        -----------
+        borrows : list[tuple[str, str]]
+            note ID and data file notes of each borrow.
+        returns : list[tuple[str, str]]
+            note ID and data file notes of each return.
+        changes : list[tuple[str, str]]
+            pairs of action and detail, same as journalstock.
+
+        Returns:
+        --------
+        True/False : bool
+            Boolean Value depending on the success or failure.
+        """
+        return savenotesbatch(borrows, returns) and journalstocks(changes)